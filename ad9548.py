@@ -3,34 +3,840 @@
 #################################################################
 # Class and macros to interact with AD9548 chipsets
 #################################################################
-from smbus import SMBus
+import os
+import sys
+import json
+import socket
+import time
+import ctypes
+try:
+    # smbus2 is a drop-in replacement, that also
+    # exposes combined (repeated start) I2C transactions
+    from smbus2 import SMBus, i2c_msg
+except ImportError:
+    i2c_msg = None
+    try:
+        from smbus import SMBus
+    except ImportError: # SPI only setup
+        SMBus = None
+
+# Default maximal burst size, in bytes.
+# Most I2C adapters accept 255 byte messages
+I2C_MAX_BLOCK = 255
+# SMBus block transfers are limited to 32 bytes,
+# the register address LSB being one of them
+SMBUS_MAX_BLOCK = 32
+# spidev transfers are limited to its 4096 byte buffer,
+# the instruction word being part of it
+SPI_MAX_BLOCK = 4096 - 2
+SPI_SPEED_HZ = 10000000
+# I2C access backend: "smbus" (python-smbus / smbus2 wrapper)
+# or "rdwr" (direct I2C_RDWR ioctl on /dev/i2c-X)
+I2C_BACKENDS = ["smbus", "rdwr"]
+I2C_BACKEND = os.environ.get("AD9548_I2C_BACKEND", "smbus")
+# linux/i2c-dev.h, linux/i2c.h
+I2C_RDWR = 0x0707
+I2C_M_RD = 0x0001
+# ad9548d.py daemon socket, in the user runtime directory
+DAEMON_SOCKET = os.environ.get("AD9548D_SOCKET",
+    os.path.join(os.environ.get("XDG_RUNTIME_DIR", "/run"), "ad9548d.sock"))
+# set to 1 for the tools to always access the devices directly
+NO_DAEMON = os.environ.get("AD9548_NO_DAEMON", "0") not in ["", "0"]
+
+# Register map extent: 0x0000-0x0E3F
+REGMAP_SIZE = 0x0E40
+# Profile registers: 8 profiles of 0x32 bytes,
+# packed by pairs into 0x80 byte pages
+PROFILE_SIZE = 0x32
+PROFILE_BASES = [0x0600, 0x0632, 0x0680, 0x06B2, 0x0700, 0x0732, 0x0780, 0x07B2]
+# Valid register blocks (first, last, name), everything
+# else in 0x0000-0x0E3F is reserved.
+# The AD9547 shares the AD9548 register layout
+_BLOCKS = [
+    (0x0000, 0x0005, "serial-port"),
+    (0x0100, 0x0108, "sysclk"),
+    (0x0200, 0x0214, "general"), # Mx pins, IRQ, watchdog, aux DAC
+    (0x0300, 0x031B, "dpll"),
+    (0x0400, 0x0417, "distribution"),
+    (0x0500, 0x0507, "ref-inputs"),
+] + [
+    (base, base+PROFILE_SIZE-1, "profile-{}".format(i)) for (i, base) in enumerate(PROFILE_BASES)
+] + [
+    (0x0A00, 0x0A10, "operational-controls"),
+    (0x0D00, 0x0D19, "status"),
+    (0x0E00, 0x0E03, "eeprom-control"),
+    (0x0E10, 0x0E3F, "eeprom-storage"),
+]
+REGISTER_BLOCKS = {
+    "ad9547": _BLOCKS,
+    "ad9548": _BLOCKS,
+}
+
+def register_block (addr, chip="ad9548"):
+    """ Returns the name of the register block containing
+    given address, None for reserved addresses """
+    for (first, last, name) in REGISTER_BLOCKS[chip]:
+        if first <= addr <= last:
+            return name
+    return None
+
+# EEPROM storage sequence (0x0E10-0x0E3F) instructions.
+# Data instruction: byte count - 1 (0x00-0x7F), then address (MSB first)
+EEPROM_SEQUENCE = (0x0E10, 0x0E3F)
+EEPROM_MAX_RUN = 0x80
+EEPROM_IO_UPDATE = 0x80
+EEPROM_CALIBRATE = 0xA0
+EEPROM_PAUSE = 0xFE
+EEPROM_END = 0xFF
+# EEPROM status (0x0D00)
+EEPROM_SAVING = 0x01
+EEPROM_LOADING = 0x02
+EEPROM_FAULT = 0x04
+# Default storage sequence: system clock first, calibrated once
+# settled, then the rest of the configuration
+EEPROM_BLOCKS = [
+    (0x0100, 0x0108),
+    EEPROM_IO_UPDATE,
+    EEPROM_CALIBRATE,
+    (0x0200, 0x0214),
+    (0x0300, 0x031B),
+    (0x0400, 0x0417),
+    (0x0500, 0x0507),
+    (0x0600, 0x0663), # profiles 0-1
+    (0x0680, 0x06E3), # profiles 2-3
+    (0x0700, 0x0763), # profiles 4-5
+    (0x0780, 0x07E3), # profiles 6-7
+    EEPROM_IO_UPDATE,
+]
+
+def eeprom_sequence (blocks=EEPROM_BLOCKS):
+    """ Builds the EEPROM storage sequence from given list
+    of (first, last) register ranges and instruction opcodes """
+    seq = []
+    for item in blocks:
+        if isinstance(item, int):
+            seq.append(item)
+            continue
+        (first, last) = item
+        for addr in range (first, last+1, EEPROM_MAX_RUN):
+            n = min(EEPROM_MAX_RUN, last - addr + 1)
+            seq += [n-1, (addr & 0xFF00)>>8, addr & 0xFF]
+    seq.append(EEPROM_END)
+    if len(seq) > EEPROM_SEQUENCE[1] - EEPROM_SEQUENCE[0] + 1:
+        raise ValueError("EEPROM sequence does not fit in {} bytes".format(EEPROM_SEQUENCE[1] - EEPROM_SEQUENCE[0] + 1))
+    return seq
+
+def decode_eeprom_sequence (seq):
+    """ Decodes an EEPROM storage sequence into a list of
+    (first, last) register ranges and instruction opcodes,
+    up to the end instruction """
+    items = []
+    i = 0
+    while i < len(seq) and seq[i] != EEPROM_END:
+        if seq[i] < EEPROM_MAX_RUN:
+            addr = (seq[i+1]<<8) | seq[i+2]
+            items.append((addr, addr + seq[i]))
+            i += 3
+        else:
+            items.append(seq[i])
+            i += 1
+    return items
+
+# Read only registers
+READ_ONLY = [0x0002, 0x0003] + list(range(0x0D00, 0x0D1A))
+# Registers that are transferred to the active
+# register bank by an I/O update (0x0005)
+BUFFERED = (0x0100, 0x0CFF)
+# Registers cleared by the device once their action is performed
+SELF_CLEARING = [0x0005, 0x0306, 0x0A03] + list(range(0x0A04, 0x0A0C)) + [0x0E02, 0x0E03]
+# Bits that read back as written, for load verification.
+# Self clearing registers, soft reset bits (0x0000) and the
+# staged bank readback bit (0x0004, set while verifying)
+# are not verified, other registers are fully verified
+VERIFY_MASKS = dict([(addr, 0x00) for addr in SELF_CLEARING] + [(0x0000, 0xDB), (0x0004, 0xFE)])
+# Registers whose content may change without being written:
+# never served from the shadow cache
+VOLATILE = set(READ_ONLY + SELF_CLEARING)
+# Registers whose actions rewrite other registers (soft reset,
+# EEPROM load, ..): writing them drops the shadow cache.
+# I/O update only activates the written (cached) values
+CACHE_FLUSH = set([0x0000] + SELF_CLEARING) - set([0x0005])
+
+class I2CTransport :
+    """ /dev/i2c-X transport """
+    def __init__ (self, bus, address, max_block=I2C_MAX_BLOCK, handle=None):
+        """ bus: [int] I2C bus number, X in /dev/i2c-X filesystem entry point
+        address: [int] i2c slave address
+        max_block: [int] maximal number of bytes per burst transaction
+        handle: opened SMBus like object, opens /dev/i2c-X when not provided
+        """
+        self.slv_addr = address
+        self.bus = ("i2c", bus)
+        if handle is None:
+            if SMBus is None:
+                raise RuntimeError("I2C access requires python-smbus or smbus2")
+            handle = SMBus()
+            handle.open(bus)
+        self.handle = handle
+        if i2c_msg is not None:
+            self.max_read = max_block
+            self.max_write = max_block
+        else:
+            self.max_read = max_block
+            self.max_write = SMBUS_MAX_BLOCK-1
+
+    def read (self, addr, length):
+        """ Reads `length` bytes from given address in a single burst """
+        msb = (addr & 0xFF00)>>8
+        lsb = addr & 0xFF
+        if i2c_msg is not None:
+            # address + data phases in a single repeated start transaction
+            wr = i2c_msg.write(self.slv_addr, [msb, lsb])
+            rd = i2c_msg.read(self.slv_addr, length)
+            self.handle.i2c_rdwr(wr, rd)
+            return list(rd)
+        # python-smbus cannot express a combined transaction:
+        # set the address pointer once, then stream the auto-incremented bytes
+        self.handle.write_i2c_block_data(self.slv_addr, msb, [lsb])
+        return [self.handle.read_byte(self.slv_addr) for i in range(length)]
+
+    def write (self, addr, data):
+        """ Writes given bytes from given address in a single burst """
+        msb = (addr & 0xFF00)>>8
+        lsb = addr & 0xFF
+        if i2c_msg is not None:
+            self.handle.i2c_rdwr(i2c_msg.write(self.slv_addr, [msb, lsb] + data))
+        else:
+            self.handle.write_i2c_block_data(self.slv_addr, msb, [lsb] + data)
+
+class _I2CMsg (ctypes.Structure):
+    """ struct i2c_msg """
+    _fields_ = [
+        ("addr", ctypes.c_uint16),
+        ("flags", ctypes.c_uint16),
+        ("len", ctypes.c_uint16),
+        ("buf", ctypes.POINTER(ctypes.c_uint8)),
+    ]
+
+class _I2CRdwrData (ctypes.Structure):
+    """ struct i2c_rdwr_ioctl_data """
+    _fields_ = [
+        ("msgs", ctypes.POINTER(_I2CMsg)),
+        ("nmsgs", ctypes.c_uint32),
+    ]
+
+class I2CRdwrTransport :
+    """ /dev/i2c-X transport issuing I2C_RDWR ioctls directly.
+    Reads are a single combined (repeated start) transaction,
+    writes a single message, whatever their length.
+    Message descriptors and data buffers are allocated once
+    and reused by every transaction """
+    def __init__ (self, bus, address, max_block=I2C_MAX_BLOCK, fd=None, ioctl=None):
+        """ bus: [int] I2C bus number, X in /dev/i2c-X filesystem entry point
+        address: [int] i2c slave address
+        max_block: [int] maximal number of bytes per burst transaction
+        fd: opened /dev/i2c-X file descriptor, opens it when not provided
+        ioctl: ioctl(fd, request, arg) function, defaults to fcntl.ioctl
+        """
+        if ioctl is None:
+            import fcntl
+            ioctl = fcntl.ioctl
+        if fd is None:
+            fd = os.open("/dev/i2c-{}".format(bus), os.O_RDWR)
+        self.fd = fd
+        self.ioctl = ioctl
+        self.slv_addr = address
+        self.bus = ("i2c", bus)
+        self.max_read = max_block
+        self.max_write = max_block
+        # register address + data
+        self.wbuf = (ctypes.c_uint8 * (max_block+2))()
+        self.rbuf = (ctypes.c_uint8 * max_block)()
+        self.msgs = (_I2CMsg * 2)()
+        self.msgs[0].addr = address
+        self.msgs[0].flags = 0
+        self.msgs[0].buf = ctypes.cast(self.wbuf, ctypes.POINTER(ctypes.c_uint8))
+        self.msgs[1].addr = address
+        self.msgs[1].flags = I2C_M_RD
+        self.msgs[1].buf = ctypes.cast(self.rbuf, ctypes.POINTER(ctypes.c_uint8))
+        self.data = _I2CRdwrData(ctypes.cast(self.msgs, ctypes.POINTER(_I2CMsg)), 0)
+
+    def read (self, addr, length):
+        """ Reads `length` bytes from given address in a single burst """
+        self.wbuf[0] = (addr & 0xFF00)>>8
+        self.wbuf[1] = addr & 0xFF
+        self.msgs[0].len = 2
+        self.msgs[1].len = length
+        self.data.nmsgs = 2
+        self.ioctl(self.fd, I2C_RDWR, self.data)
+        return self.rbuf[:length]
+
+    def write (self, addr, data):
+        """ Writes given bytes from given address in a single burst """
+        self.wbuf[0] = (addr & 0xFF00)>>8
+        self.wbuf[1] = addr & 0xFF
+        self.wbuf[2:2+len(data)] = data
+        self.msgs[0].len = 2 + len(data)
+        self.data.nmsgs = 1
+        self.ioctl(self.fd, I2C_RDWR, self.data)
+
+    def close (self):
+        os.close(self.fd)
+
+def i2c_transport (bus, address, backend=None, max_block=I2C_MAX_BLOCK):
+    """ Returns an I2C transport using given backend (I2C_BACKENDS),
+    defaults to $AD9548_I2C_BACKEND or "smbus" """
+    backend = backend or I2C_BACKEND
+    if backend == "rdwr":
+        return I2CRdwrTransport(bus, address, max_block=max_block)
+    if backend == "smbus":
+        return I2CTransport(bus, address, max_block=max_block)
+    raise ValueError("unknown I2C backend \"{}\"".format(backend))
+
+class SPITransport :
+    """ /dev/spidevX.Y transport.
+    Uses 16 bit instructions, in default MSB first mode:
+    multi-byte transfers start at the highest address and the
+    device address pointer decrements. Transfers of more than 3 bytes
+    use the streaming mode """
+    def __init__ (self, device, speed=SPI_SPEED_HZ, max_block=SPI_MAX_BLOCK, handle=None):
+        """ device: [str] /dev/spidevX.Y filesystem entry point
+        speed: [int] SCLK frequency [Hz]
+        max_block: [int] maximal number of bytes per burst transaction
+        handle: opened SpiDev like object, opens device when not provided
+        """
+        if handle is None:
+            import spidev
+            (bus, cs) = device.split("spidev")[-1].split(".")
+            handle = spidev.SpiDev()
+            handle.open(int(bus), int(cs))
+            handle.max_speed_hz = speed
+            handle.mode = 0
+        self.handle = handle
+        self.bus = ("spi", device.split("spidev")[-1].split(".")[0])
+        self.max_read = max_block
+        self.max_write = max_block
+
+    def instruction (self, read, addr, length):
+        """ Builds the 2 byte instruction word for
+        a `length` byte transfer starting at `addr` """
+        if length > 3:
+            w = 0x03 # streaming
+        else:
+            w = length - 1
+        # MSB first: instruction addresses the highest byte
+        addr += length - 1
+        instr = (int(read) << 15) | (w << 13) | (addr & 0x1FFF)
+        return [(instr & 0xFF00)>>8, instr & 0xFF]
+
+    def read (self, addr, length):
+        """ Reads `length` bytes from given address in a single burst """
+        rx = self.handle.xfer2(self.instruction(True, addr, length) + [0x00]*length)
+        return list(reversed(rx[2:]))
+
+    def write (self, addr, data):
+        """ Writes given bytes from given address in a single burst """
+        self.handle.xfer2(self.instruction(False, addr, len(data)) + list(reversed(data)))
+
+class DaemonTransport :
+    """ Transport through the ad9548d.py daemon, which owns the bus.
+    Requests and replies are JSON lines over a local Unix socket """
+    def __init__ (self, target, path=DAEMON_SOCKET):
+        """ target: [dict] device served by the daemon,
+            {"bus": int, "address": int} or {"spi": "/dev/spidevX.Y"}
+        path: [str] daemon socket
+        """
+        self.target = target
+        self.bus = ("daemon", target.get("bus", target.get("spi")))
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.stream = self.sock.makefile("rwb")
+        # the daemon splits bursts itself
+        self.max_read = REGMAP_SIZE
+        self.max_write = REGMAP_SIZE
+
+    def request (self, op, **kwargs):
+        """ Sends a request, returns the reply """
+        kwargs["op"] = op
+        kwargs["target"] = self.target
+        self.stream.write((json.dumps(kwargs) + "\n").encode("utf-8"))
+        self.stream.flush()
+        reply = json.loads(self.stream.readline())
+        if "error" in reply:
+            raise OSError(reply["error"])
+        return reply
+
+    def read (self, addr, length):
+        return self.request("read", addr=addr, length=length)["data"]
+
+    def write (self, addr, data):
+        self.request("write", addr=addr, data=data)
+
+    def refresh (self, addr, length):
+        """ Reads from the device itself, bypassing the daemon shadow cache """
+        return self.request("refresh", addr=addr, length=length)["data"]
+
+    def invalidate (self, addr=None, length=1):
+        """ Drops the daemon shadow cache of this device """
+        self.request("invalidate", addr=addr, length=length)
+
+    def close (self):
+        self.stream.close()
+        self.sock.close()
+
+def connect_daemon (target, path=DAEMON_SOCKET, backend=None, sim=False):
+    """ Returns a DaemonTransport to given target, or None when
+    the daemon is not running, or does not serve the requested devices:
+    backend: [str] required I2C backend, any when not specified,
+    sim: [bool] simulated devices are required (hardware otherwise) """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        transport = DaemonTransport(target, path)
+        info = transport.request("ping")
+    except (OSError, ValueError): # stale socket
+        return None
+    if info.get("sim", False) != sim or \
+        (backend is not None and "bus" in target and info.get("backend") != backend):
+        transport.close()
+        return None
+    return transport
+
+class RetryTransport :
+    """ Wraps a transport: transactions failing with OSError
+    (NACK, arbitration lost, ..) are retried with a bounded
+    exponential backoff """
+    def __init__ (self, transport, retries=3, delay=1E-3, max_delay=100E-3):
+        """ transport: transport to wrap
+        retries: [int] maximal number of retries per transaction
+        delay: [float] first backoff delay [s], doubled on each retry
+        max_delay: [float] backoff delay upper bound [s]
+        """
+        self.transport = transport
+        self.bus = getattr(transport, "bus", None)
+        self.max_read = transport.max_read
+        self.max_write = transport.max_write
+        self.retries = retries
+        self.delay = delay
+        self.max_delay = max_delay
+        self.failures = 0
+
+    def retry (self, op, *args):
+        delay = self.delay
+        for i in range (self.retries + 1):
+            try:
+                return op(*args)
+            except OSError:
+                self.failures += 1
+                if i == self.retries:
+                    raise
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_delay)
+
+    def read (self, addr, length):
+        return self.retry(self.transport.read, addr, length)
+
+    def write (self, addr, data):
+        return self.retry(self.transport.write, addr, data)
+
+    def refresh (self, addr, length):
+        return self.retry(getattr(self.transport, "refresh", self.transport.read), addr, length)
+
+    def invalidate (self, addr=None, length=1):
+        if hasattr(self.transport, "invalidate"):
+            self.transport.invalidate(addr, length)
+
 class AD9548 :
     """ Class to interact with AD9548 chipset,
-    only I2C bus supported @ the moment """
-    def __init__ (self, bus, address):
-        """ Creates an AD9546 device, 
-        bus: [int] I2C bus number, X in /dev/i2c-X filesystem entry point   
+    through I2C or SPI transport """
+    def __init__ (self, bus=None, address=None, max_block=I2C_MAX_BLOCK, transport=None, cache=False):
+        """ Creates an AD9546 device,
+        bus: [int] I2C bus number, X in /dev/i2c-X filesystem entry point
         address: [int] i2c slave address
+        max_block: [int] maximal number of bytes per I2C burst transaction,
+            longer bursts are split automatically
+        transport: transport to use instead of /dev/i2c-X (`SPITransport`, ..)
+        cache: [bool] enables the write-through shadow register cache.
+            Configuration registers are then read from the bus once, and later
+            reads (read-modify-write sequences) are served from the cache.
+            Cached values are the last written values, which may still be
+            staged until next I/O update.
+            Status and self clearing registers are always read from the bus
         """
-        self.slv_addr = address
-        self.handle = SMBus()
-        self.handle.open(bus)
-    
+        if transport is None:
+            transport = i2c_transport(bus, address, max_block=max_block)
+        self.transport = transport
+        self.cache = {} if cache else None
+        self.tx = None
+
     def write_data (self, addr, data):
         """ Writes given data (uint8_t) to given address (uint16_t) """
-        msb = (addr & 0xFF00)>>8
-        lsb = addr & 0xFF
-        self.handle.write_i2c_block_data(self.slv_addr, msb, [lsb, data & 0xFF])
+        self.write_block(addr, [data])
+
+    def write_block (self, addr, data):
+        """ Writes given bytes to consecutive registers starting at given
+        address (uint16_t), using the device address auto-increment.
+        Writes longer than the transaction size are split into several bursts.
+        Within a transaction(), data is staged until commit """
+        if self.tx is not None:
+            for i in range (len(data)):
+                self.tx.stage(addr+i, data[i])
+            return
+        size = self.transport.max_write
+        data = [d & 0xFF for d in data]
+        for i in range (0, len(data), size):
+            self.transport.write(addr+i, data[i:i+size])
+        if self.cache is not None:
+            for i in range (len(data)):
+                if addr+i not in VOLATILE:
+                    self.cache[addr+i] = data[i]
+            if any(data[i] and addr+i in CACHE_FLUSH for i in range (len(data))):
+                self.invalidate()
+
+    def write_bits (self, addr, mask, value):
+        """ Updates the bits of given register (uint16_t) selected by mask,
+        with value bits. Other bits are preserved (read-modify-write) """
+        if self.tx is not None:
+            self.tx.stage(addr, value, mask)
+            return
+        r = self.read_data(addr)
+        self.write_data(addr, (r & (mask ^ 0xFF)) | (value & mask))
 
     def read_data (self, addr):
         """ Reads data at given address (uint16_t) returns uint8_t """
-        msb = (addr & 0xFF00)>>8
-        lsb = addr & 0xFF
-        self.handle.write_i2c_block_data(self.slv_addr, msb, [lsb])
-        data = self.handle.read_byte(self.slv_addr)
+        return self.read_block(addr, 1)[0]
+
+    def read_block (self, addr, length):
+        """ Reads `length` consecutive registers starting at given address (uint16_t),
+        using the device address auto-increment. Returns list of uint8_t.
+        Reads longer than the transaction size are split into several bursts.
+        Within a transaction(), staged data takes precedence """
+        if self.tx is not None:
+            return self.tx.read_block(addr, length)
+        if self.cache is not None:
+            span = range(addr, addr+length)
+            if all(a in self.cache for a in span):
+                return [self.cache[a] for a in span]
+            data = self._read_bus(addr, length)
+            for i in range (length):
+                if addr+i not in VOLATILE:
+                    # cached value was written and may not be active yet
+                    data[i] = self.cache.setdefault(addr+i, data[i])
+            return data
+        return self._read_bus(addr, length)
+
+    def _read_bus (self, addr, length, fresh=False):
+        """ fresh: [bool] bypasses the transport cache (daemon) as well """
+        read = self.transport.read
+        if fresh:
+            read = getattr(self.transport, "refresh", read)
+        data = []
+        while length > 0:
+            n = min(length, self.transport.max_read)
+            data += read(addr, n)
+            addr += n
+            length -= n
         return data
 
     def io_update (self):
-        """ Performs `I/O update` operation. 
-        Refer to device datasheet """
+        """ Performs `I/O update` operation.
+        Refer to device datasheet.
+        Within a transaction(), it is deferred to commit """
+        if self.tx is not None:
+            self.tx.update = True
+            return
         self.write_data(0x0005, 0x01)
+
+    def transaction (self):
+        """ Returns a context manager staging all writes:
+
+        with dev.transaction():
+            dev.write_bits(0x0A00, 0x20, 0x20)
+            dev.write_block(0x0300, [..])
+
+        On exit, staged writes are merged per register, flushed as burst
+        writes and applied at once by a single I/O update.
+        When an exception is raised, nothing is written.
+        Nested transactions join the outer one """
+        if self.tx is None:
+            self.tx = Transaction(self)
+        return self.tx
+
+    def invalidate (self, addr=None, length=1):
+        """ Drops `length` cached registers starting at `addr`,
+        or the whole shadow cache when addr is not specified.
+        The daemon shadow cache is dropped as well """
+        if hasattr(self.transport, "invalidate"):
+            self.transport.invalidate(addr, length)
+        if self.cache is None:
+            return
+        if addr is None:
+            self.cache = {}
+        else:
+            for a in range (addr, addr+length):
+                self.cache.pop(a, None)
+
+    def refresh (self, addr, length=1):
+        """ Reloads `length` cached registers starting at `addr` from
+        the device, discarding cached values (daemon cache included).
+        Returns fresh data """
+        data = self._read_bus(addr, length, fresh=True)
+        if self.cache is not None:
+            for i in range (length):
+                if addr+i not in VOLATILE:
+                    self.cache[addr+i] = data[i]
+        return data
+
+    def eeprom_program (self, blocks=EEPROM_BLOCKS):
+        """ Programs the EEPROM storage sequence (single burst),
+        describing which registers are saved to / loaded from the EEPROM """
+        self.write_block(EEPROM_SEQUENCE[0], eeprom_sequence(blocks))
+
+    def eeprom_wait (self, flag, timeout=1.0):
+        """ Polls the EEPROM status until given flag (EEPROM_SAVING,
+        EEPROM_LOADING) clears. Each poll is a single byte read, spaced by
+        an exponential backoff (100us up to 10ms). Returns the polls count,
+        raises RuntimeError on EEPROM fault or timeout """
+        deadline = time.monotonic() + timeout
+        delay = 100E-6
+        polls = 0
+        while True:
+            r = self.read_data(0x0D00)
+            polls += 1
+            if r & EEPROM_FAULT:
+                raise RuntimeError("EEPROM fault")
+            if not r & flag:
+                return polls
+            if time.monotonic() > deadline:
+                raise RuntimeError("EEPROM operation timed out")
+            time.sleep(delay)
+            delay = min(delay * 2, 10E-3)
+
+    def eeprom_save (self, timeout=1.0):
+        """ Saves registers described by the storage sequence into the
+        EEPROM, waits for completion. Write protection is enabled again
+        once done. Returns the polls count """
+        r = self.read_data(0x0E00)
+        self.write_data(0x0E00, r | 0x01) # write enable
+        try:
+            self.write_data(0x0E02, 0x01)
+            return self.eeprom_wait(EEPROM_SAVING, timeout)
+        finally:
+            self.write_data(0x0E00, r & 0xFE)
+
+    def eeprom_load (self, timeout=1.0):
+        """ Loads registers from the EEPROM, waits for completion.
+        Drops the shadow cache. Returns the polls count """
+        self.write_data(0x0E03, 0x02)
+        try:
+            return self.eeprom_wait(EEPROM_LOADING, timeout)
+        finally:
+            self.invalidate()
+
+class BurstWriter :
+    """ Collects register writes and emits them as the fewest
+    auto-increment burst transactions: pending writes are sorted
+    by address and adjacent addresses are merged into a single burst.
+    Use it as a context manager, or call flush() """
+    def __init__ (self, dev):
+        """ dev: [AD9548] device to write to """
+        self.dev = dev
+        self.pending = {}
+
+    def write (self, addr, data):
+        """ Queues data (uint8_t) for given address (uint16_t).
+        A later write to the same address overrides previous one """
+        self.pending[addr] = data & 0xFF
+
+    def write_block (self, addr, data):
+        """ Queues given bytes for consecutive registers starting at addr """
+        for i in range (len(data)):
+            self.write(addr+i, data[i])
+
+    def write_value (self, addr, value, size):
+        """ Queues an integer value spread over `size` consecutive
+        registers, least significant byte first (device convention) """
+        for i in range (size):
+            self.write(addr+i, (value >> (8*i)) & 0xFF)
+
+    def read (self, addr):
+        """ Reads given register, pending value takes precedence """
+        if addr in self.pending:
+            return self.pending[addr]
+        return self.dev.read_data(addr)
+
+    def runs (self):
+        """ Returns pending writes as a sorted list
+        of (start address, [bytes]) contiguous runs """
+        runs = []
+        for addr in sorted(self.pending):
+            if len(runs) > 0:
+                (start, data) = runs[-1]
+                if start + len(data) == addr:
+                    data.append(self.pending[addr])
+                    continue
+            runs.append((addr, [self.pending[addr]]))
+        return runs
+
+    def flush (self):
+        """ Writes all pending data, returns number of bursts issued """
+        runs = self.runs()
+        for (addr, data) in runs:
+            self.dev.write_block(addr, data)
+        self.pending = {}
+        return len(runs)
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+class Transaction :
+    """ Register writes staged by AD9548.transaction() """
+    def __init__ (self, dev):
+        self.dev = dev
+        self.staged = {} # addr: (value, mask)
+        self.update = False
+        self.depth = 0
+
+    def stage (self, addr, value, mask=0xFF):
+        """ Stages masked bits of given register,
+        merged with previously staged bits """
+        (v, m) = self.staged.get(addr, (0x00, 0x00))
+        v = (v & (mask ^ 0xFF)) | (value & mask)
+        self.staged[addr] = (v & 0xFF, m | mask)
+
+    def read_block (self, addr, length):
+        """ Reads registers, overlaid with staged bits """
+        span = range(addr, addr+length)
+        if all(self.staged.get(a, (0, 0))[1] == 0xFF for a in span):
+            return [self.staged[a][0] for a in span]
+        self.dev.tx = None
+        try:
+            data = self.dev.read_block(addr, length)
+        finally:
+            self.dev.tx = self
+        for i in range (length):
+            if addr+i in self.staged:
+                (v, m) = self.staged[addr+i]
+                data[i] = (data[i] & (m ^ 0xFF)) | v
+        return data
+
+    def commit (self):
+        """ Writes staged registers in bursts, then performs the I/O update.
+        Returns the number of write bursts issued """
+        w = BurstWriter(self.dev)
+        for addr in sorted(self.staged):
+            (v, m) = self.staged[addr]
+            if m != 0xFF: # partial register: merge with current value
+                v |= w.read(addr) & (m ^ 0xFF)
+            w.write(addr, v)
+        bursts = w.flush()
+        if bursts > 0 or self.update:
+            self.dev.io_update()
+        return bursts
+
+    def __enter__ (self):
+        self.depth += 1
+        return self
+
+    def __exit__ (self, exc_type, exc, tb):
+        self.depth -= 1
+        if self.depth > 0:
+            return
+        self.dev.tx = None
+        if exc_type is None:
+            self.commit()
+
+def add_device_args (parser):
+    """ Adds device selection arguments to given argparse parser:
+    I2C bus and slave address, or --spi device """
+    parser.add_argument(
+        "bus",
+        nargs="?",
+        type=int,
+        help="I2C bus (int)",
+    )
+    parser.add_argument(
+        "address",
+        nargs="?",
+        type=str,
+        help="I2C slv address (hex)",
+    )
+    parser.add_argument(
+        "--spi",
+        metavar="/dev/spidevX.Y",
+        type=str,
+        help="Access the device through given SPI device, instead of I2C",
+    )
+    parser.add_argument(
+        "--sim",
+        metavar="state",
+        nargs="?",
+        const="",
+        type=str,
+        help="""Run against the in-memory device simulator instead of hardware.
+        Simulator state is loaded from / stored into optional `state` file""",
+    )
+    parser.add_argument(
+        "--sim-stats",
+        action="store_true",
+        help="Report the simulated bus usage on stderr, on exit",
+    )
+    parser.add_argument(
+        "--i2c-backend",
+        choices=I2C_BACKENDS,
+        help="""I2C access method: smbus wrapper, or direct I2C_RDWR ioctl (rdwr).
+        Defaults to $AD9548_I2C_BACKEND or {}.
+        A running daemon is only used when it has the requested backend""".format(I2C_BACKEND),
+    )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        default=NO_DAEMON,
+        help="""Access the device directly, even when the ad9548d.py daemon is running
+        (also set by $AD9548_NO_DAEMON=1)""",
+    )
+
+def open_device (args, cache=False):
+    """ Opens the AD9548 device described by
+    arguments parsed with `add_device_args`,
+    cache: [bool] enables the shadow register cache.
+    Goes through the ad9548d.py daemon when it is running """
+    if args.sim is not None:
+        return AD9548(transport=open_simulator(args.sim, args.sim_stats), cache=cache)
+    if args.spi is not None:
+        target = {"spi": args.spi}
+    else:
+        if args.bus is None or args.address is None:
+            sys.exit("I2C bus and slave address must be specified, unless --spi is used")
+        target = {"bus": args.bus, "address": int(args.address, 16)}
+    transport = None
+    if not args.no_daemon:
+        transport = connect_daemon(target, backend=args.i2c_backend)
+    if transport is None: # direct access
+        if args.spi is not None:
+            transport = SPITransport(args.spi)
+        else:
+            transport = i2c_transport(target["bus"], target["address"], args.i2c_backend)
+    return AD9548(transport=transport, cache=cache)
+
+def open_simulator (path, stats=False):
+    """ Returns a transport to a simulated device,
+    persisted into given state file (if any).
+    stats: [bool] reports the bus usage on stderr, on exit """
+    import atexit
+    from simulator import AD9548Sim, SimTransport
+    sim = AD9548Sim(path=path or None)
+    transport = SimTransport(sim)
+    def report ():
+        sys.stderr.write("sim: {} transactions, {} bytes read, {} bytes written, {:.3f} ms @ 400kHz\n".format(
+            transport.stats['transactions'],
+            transport.stats['bytes-read'],
+            transport.stats['bytes-written'],
+            transport.wire_time() * 1E3))
+    if stats:
+        atexit.register(report)
+    return transport
@@ -0,0 +1,69 @@
+#################################################################
+# Guillaume W. Bres, 2022          <guillaume.bressaix@gmail.com>
+#################################################################
+# ad9548_async.py: asyncio front-end to AD9548 chipsets,
+# kept apart so the tools do not import asyncio
+#################################################################
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ad9548 import REGMAP_SIZE
+from schema import STATUS, decode
+
+class AsyncAD9548 :
+    """ asyncio front-end to an AD9548 device.
+    Blocking bus accesses run on a single thread executor per bus:
+    operations on a same bus are serialized, while distinct
+    buses are accessed concurrently from a single event loop:
+
+    fleet = [AsyncAD9548(AD9548(bus, addr)) for (bus, addr) in targets]
+    status = await asyncio.gather(*[dev.status() for dev in fleet])
+    """
+    executors = {}
+    lock = threading.Lock()
+
+    def __init__ (self, dev):
+        """ dev: [AD9548] device to drive """
+        self.dev = dev
+        bus = getattr(dev.transport, "bus", id(dev.transport))
+        with AsyncAD9548.lock:
+            if bus not in AsyncAD9548.executors:
+                AsyncAD9548.executors[bus] = ThreadPoolExecutor(max_workers=1)
+            self.executor = AsyncAD9548.executors[bus]
+
+    async def run (self, func, *args):
+        """ Runs given blocking function on this device bus executor """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def read_data (self, addr):
+        return await self.run(self.dev.read_data, addr)
+
+    async def write_data (self, addr, data):
+        await self.run(self.dev.write_data, addr, data)
+
+    async def read_block (self, addr, length):
+        return await self.run(self.dev.read_block, addr, length)
+
+    async def write_block (self, addr, data):
+        await self.run(self.dev.write_block, addr, data)
+
+    async def write_bits (self, addr, mask, value):
+        await self.run(self.dev.write_bits, addr, mask, value)
+
+    async def io_update (self):
+        await self.run(self.dev.io_update)
+
+    async def read_status (self):
+        """ Reads the raw status registers (0x0D00-0x0D19) in a single burst """
+        return await self.read_block(0x0D00, 0x1A)
+
+    async def status (self):
+        """ Returns sys clock, DPLL lock states and current tuning word,
+        decoded from the status registers (single burst) """
+        fields = [f for f in STATUS['sysclk'] + STATUS['dpll'] + STATUS['tuning']
+            if 0x0D00 <= f.addr <= 0x0D19]
+        image = bytearray(REGMAP_SIZE)
+        image[0x0D00:0x0D1A] = bytes(await self.read_status())
+        return decode(fields, image)
@@ -0,0 +1,126 @@
+#! /usr/bin/env python3
+#################################################################
+# Guillaume W. Bres, 2022          <guillaume.bressaix@gmail.com>
+#################################################################
+# ad9548d.py: device daemon, owns the buses and serves
+# the other tools over a local Unix socket
+#################################################################
+import os
+import sys
+import json
+import argparse
+import threading
+import socketserver
+from ad9548 import *
+
+class Handler (socketserver.StreamRequestHandler):
+    """ Serves JSON lines requests of one client """
+    def handle (self):
+        for line in self.rfile:
+            try:
+                reply = self.server.serve(json.loads(line))
+            except Exception as e:
+                reply = {"error": "{}: {}".format(type(e).__name__, e)}
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+class Daemon (socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Keeps one AD9548 handle (and its shadow cache) per target.
+    Requests to devices sharing a bus are serialized,
+    distinct buses are served concurrently """
+    daemon_threads = True
+
+    def __init__ (self, path, cache=True, sim=False, backend=None):
+        """ path: [str] Unix socket to serve
+        cache: [bool] keep a shadow register cache per device
+        sim: [bool] serve in-memory simulated devices instead of hardware
+        backend: [str] I2C access backend (I2C_BACKENDS)
+        """
+        if os.path.exists(path):
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, Handler)
+        self.cache = cache
+        self.sim = sim
+        self.backend = backend
+        self.devices = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def device (self, target):
+        """ Returns (device, bus lock) for given target, opened on first use """
+        if "spi" in target:
+            key = ("spi", target["spi"])
+            bus = key
+        else:
+            key = ("i2c", target["bus"], target["address"])
+            bus = ("i2c", target["bus"])
+        with self.lock:
+            if key not in self.devices:
+                if self.sim:
+                    from simulator import SimTransport
+                    transport = SimTransport()
+                elif "spi" in target:
+                    transport = SPITransport(target["spi"])
+                else:
+                    transport = i2c_transport(target["bus"], target["address"], self.backend)
+                self.devices[key] = AD9548(transport=transport, cache=self.cache)
+                self.locks.setdefault(bus, threading.Lock())
+            return (self.devices[key], self.locks[bus])
+
+    def serve (self, req):
+        """ Executes a single request, returns the reply """
+        op = req["op"]
+        if op == "ping":
+            return {"devices": len(self.devices), "sim": self.sim, "backend": self.backend or I2C_BACKEND}
+        (dev, lock) = self.device(req["target"])
+        with lock:
+            if op == "read":
+                return {"data": dev.read_block(req["addr"], req["length"])}
+            if op == "write":
+                dev.write_block(req["addr"], req["data"])
+                return {}
+            if op == "refresh":
+                return {"data": dev.refresh(req["addr"], req["length"])}
+            if op == "invalidate":
+                dev.invalidate(req.get("addr"), req.get("length", 1))
+                return {}
+        raise ValueError("unknown operation \"{}\"".format(op))
+
+def main (argv):
+    parser = argparse.ArgumentParser(description="AD9548 device daemon")
+    parser.add_argument(
+        "--socket",
+        metavar="path",
+        type=str,
+        default=DAEMON_SOCKET,
+        help="Unix socket to serve. Defaults to $AD9548D_SOCKET or {}".format(DAEMON_SOCKET),
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not keep a shadow register cache, always read registers from the bus",
+    )
+    parser.add_argument(
+        "--sim",
+        action="store_true",
+        help="Serve in-memory simulated devices instead of hardware",
+    )
+    parser.add_argument(
+        "--i2c-backend",
+        choices=I2C_BACKENDS,
+        default=I2C_BACKEND,
+        help="""I2C access method: smbus wrapper, or direct I2C_RDWR ioctl (rdwr).
+        Defaults to $AD9548_I2C_BACKEND or {}""".format(I2C_BACKEND),
+    )
+    args = parser.parse_args(argv)
+    server = Daemon(args.socket, cache=not args.no_cache, sim=args.sim, backend=args.i2c_backend)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
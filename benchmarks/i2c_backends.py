@@ -0,0 +1,79 @@
+#! /usr/bin/env python3
+#################################################################
+# Guillaume W. Bres, 2022          <guillaume.bressaix@gmail.com>
+#################################################################
+# i2c_backends.py: compares the smbus and I2C_RDWR backends
+# against the simulator (host overhead, bus transactions)
+#################################################################
+import os
+import sys
+import time
+import json
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import ad9548
+from ad9548 import AD9548, I2CTransport, I2CRdwrTransport
+from simulator import AD9548Sim, SimI2CBus, SimSMBus, SimI2CAdapter
+
+ADDRESS = 0x48
+
+def open_backend (backend):
+    """ Returns (AD9548, simulated bus) using given backend """
+    bus = SimI2CBus({ADDRESS: AD9548Sim()})
+    if backend == "rdwr":
+        transport = I2CRdwrTransport(0, ADDRESS, fd=-1, ioctl=SimI2CAdapter(bus).ioctl)
+    else:
+        transport = I2CTransport(0, ADDRESS, handle=SimSMBus(bus))
+    return (AD9548(transport=transport), bus)
+
+WORKLOADS = {
+    # full register map dump
+    "dump": lambda dev: dev.read_block(0x0000, ad9548.REGMAP_SIZE),
+    # status block snapshot
+    "status": lambda dev: dev.read_block(0x0D00, 0x1A),
+    # single register poll
+    "poll": lambda dev: dev.read_data(0x0D0A),
+    # profile definition
+    "profile": lambda dev: dev.write_block(0x0600, [0x5A]*0x32),
+}
+
+def run (backend, workload, iterations):
+    (dev, bus) = open_backend(backend)
+    op = WORKLOADS[workload]
+    t0 = time.perf_counter()
+    for i in range (iterations):
+        op(dev)
+    elapsed = time.perf_counter() - t0
+    return {
+        "us/op": elapsed / iterations * 1E6,
+        "transactions/op": bus.transactions / iterations,
+        # 9 SCL cycles per byte @ 400 kHz
+        "wire-us/op": bus.wire_bytes * 9 / 400E3 / iterations * 1E6,
+    }
+
+def main (argv):
+    parser = argparse.ArgumentParser(description="Compare I2C backends against the simulator")
+    parser.add_argument(
+        "--iterations",
+        type=int,
+        default=200,
+        help="Iterations per workload",
+    )
+    parser.add_argument(
+        "--workload",
+        choices=list(WORKLOADS),
+        action="append",
+        help="Workload to run, all of them by default",
+    )
+    args = parser.parse_args(argv)
+    results = {
+        "smbus2": ad9548.i2c_msg is not None,
+    }
+    for workload in args.workload or list(WORKLOADS):
+        results[workload] = {}
+        for backend in ad9548.I2C_BACKENDS:
+            results[workload][backend] = run(backend, workload, args.iterations)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -7,18 +7,10 @@
 import sys
 import argparse
 from ad9548 import *
+from schema import DISTRIB, fetch, encode
 def main (argv):
     parser = argparse.ArgumentParser(description="AD9548 clock distribution tool")
-    parser.add_argument(
-        "bus",
-        type=int,
-        help="I2C bus (int)",
-    )
-    parser.add_argument(
-        "address",
-        type=str,
-        help="I2C slv address (hex)",
-    )
+    add_device_args(parser)
     parser.add_argument(
         "--channel",
         metavar="channel",
@@ -36,7 +28,6 @@ def main (argv):
         "--source",
         metavar="source",
         choices=["direct","active","dpll-feedback"],
-        action="store_true",
         help="""Select the synchronization source for the clock distribution output channels.
         --channel is discarded in the special operation.""",
     )
@@ -83,38 +74,7 @@ def main (argv):
                 )
     args = parser.parse_args(argv)
     # open device
-    dev = AD9548(args.bus, int(args.address,16))
-
-    sources = {
-        'direct': 0,
-        'active': 1,
-        'dpll-feedback': 2,
-    }
-    autosync = {
-        'disabled': 0,
-        'dpll-freq-lock': 1,
-        'dpll-phase-lock': 2,
-    }
-    phase = {
-        'normal': 0,
-        'inverted': 1,
-    }
-    polarity = {
-        'normal': 0,
-        'inverted': 1,
-    }
-    strengths = {
-        'low': 0,
-        'normal': 1,
-    }
-    modes = {
-        'cmos': 0,
-        'cmos+': 1,
-        'trist+': 2,
-        'trist': 3,
-        'lvds': 4,
-        'lvpecl': 5,
-    }
+    dev = open_device(args)
 
     if args.sync: # special op
         r = dev.read_data(0x0A02)
@@ -123,53 +83,33 @@ def main (argv):
         dev.write_data(0x0A02, r & (0x02^0xFF)) # deassert 
         dev.io_update()
         return 0
-    if args.source: # special op
-        r = dev.read_data(0x0402)
-        r &= 0xCF # mask out 
-        dev.write_data(0x0402, r | (sources[args.source]) << 4)
-        dev.io_update()
-        return 0
-    if args.autosync: # special op
-        r = dev.read_data(0x0403)
-        r &= 0xFC # mask out
-        dev.write_data(0x0403, r | autosync[args.autosync])
-        dev.io_update()
-        return 0
-   
-    if args.divider: # Qx DIV
-        if args.channel == 'all':
-            bases = [0x0408, 0x040C, 0x0410, 0x0414]
-        else:
-            bases = [0x0408 + int(args.channel)*4]
-        for base in bases:
-            dev.write_data(base+0, args.divider & 0xFF)
-            dev.write_data(base+1, (args.divider & 0xFF00)>>8)
-            dev.write_data(base+2, (args.divider & 0xFF0000)>>16)
-            dev.write_data(base+3, (args.divider & 0x3F000000)>>24)
-        dev.io_update()
-        return 0
-    
-    # other op
+
     if args.channel == 'all':
-        bases = [0x0404, 0x0405, 0x046, 0x047]
+        channels = range (4)
     else:
-        bases = [0x0408 + int(args.channel)]
+        channels = [int(args.channel)]
 
-    for base in bases:
-        r = dev.read_data(base)
-        if args.cmos_phase:
-            r &= 0xDF # mask bit out
-            r |= phase[args.cmos_phase] << 5
-        if args.polarity:
-            r &= 0xEF # mask bit out
-            r |= polarity[args.polarity] << 4
-        if args.strength:
-            r &= 0xFE # mask bit out
-            r |= strengths[args.strength] << 3
-        if args.mode:
-            r &= 0xF8 # mask bits out
-            r |= modes[args.mode]
-        dev.write_data(base, r)
+    values = {}
+    if args.source: # --channel is discarded
+        values['sync-source'] = args.source
+    if args.autosync: # --channel is discarded
+        values['autosync'] = args.autosync
+    for ch in channels:
+        if args.divider: # Qx DIV
+            values['q{}.divider'.format(ch)] = args.divider
+        for key in ['cmos-phase', 'polarity', 'strength', 'mode']:
+            value = getattr(args, key.replace("-", "_"))
+            if value is not None:
+                values['out{}.{}'.format(ch, key)] = value
+
+    # fetch the registers once, encode in memory,
+    # modified registers are coalesced into burst writes
+    fields = [f for f in DISTRIB if f.name in values]
+    image = fetch(dev, fields)
+    with BurstWriter(dev) as w:
+        for addr in encode(fields, values, image):
+            w.write(addr, image[addr])
     dev.io_update()
+
 if __name__ == "__main__":
     main(sys.argv[1:])
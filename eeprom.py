@@ -0,0 +1,83 @@
+#! /usr/bin/env python3
+#################################################################
+# Guillaume W. Bres, 2022          <guillaume.bressaix@gmail.com>
+#################################################################
+# eeprom.py: AD9548 EEPROM storage sequence, save & load
+#################################################################
+import sys
+import json
+import argparse
+from ad9548 import *
+
+def describe (items):
+    """ Storage sequence items into readable strings """
+    opcodes = {
+        EEPROM_IO_UPDATE: "io-update",
+        EEPROM_CALIBRATE: "calibrate",
+        EEPROM_PAUSE: "pause",
+    }
+    out = []
+    for item in items:
+        if isinstance(item, int):
+            out.append(opcodes.get(item, "0x{:02X}".format(item)))
+        else:
+            out.append("0x{:04X}-0x{:04X}".format(item[0], item[1]))
+    return out
+
+def main (argv):
+    parser = argparse.ArgumentParser(description="AD9548 EEPROM management")
+    add_device_args(parser)
+    parser.add_argument(
+        "--program",
+        action="store_true",
+        help="""Program the storage sequence: system clock (followed by
+        an I/O update and its calibration), Mx pins & IRQ, dpll, distribution,
+        reference inputs and profiles""",
+    )
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        help="Save registers described by the storage sequence to the EEPROM",
+    )
+    parser.add_argument(
+        "--load",
+        action="store_true",
+        help="Load registers from the EEPROM",
+    )
+    parser.add_argument(
+        "--sequence",
+        action="store_true",
+        help="Report the storage sequence",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=1.0,
+        help="EEPROM operation timeout [s]",
+    )
+    args = parser.parse_args(argv)
+    # open device
+    dev = open_device(args)
+
+    report = {}
+    try:
+        if args.program:
+            dev.eeprom_program()
+        if args.sequence:
+            seq = dev.read_block(EEPROM_SEQUENCE[0], EEPROM_SEQUENCE[1] - EEPROM_SEQUENCE[0] + 1)
+            report['sequence'] = describe(decode_eeprom_sequence(seq))
+        if args.save:
+            report['save'] = {'polls': dev.eeprom_save(args.timeout)}
+        if args.load:
+            report['load'] = {'polls': dev.eeprom_load(args.timeout)}
+    except RuntimeError as e:
+        report['error'] = str(e)
+    r = dev.read_data(0x0D00)
+    report['fault'] = bool(r & EEPROM_FAULT)
+    report['saving'] = bool(r & EEPROM_SAVING)
+    report['loading'] = bool(r & EEPROM_LOADING)
+    print(json.dumps(report, sort_keys=True, indent=2))
+    return 1 if 'error' in report else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
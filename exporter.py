@@ -0,0 +1,258 @@
+#! /usr/bin/env python3
+#################################################################
+# Guillaume W. Bres, 2022          <guillaume.bressaix@gmail.com>
+#################################################################
+# exporter.py: Prometheus / OpenMetrics exporter
+#################################################################
+import sys
+import time
+import argparse
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from ad9548 import *
+from schema import STATUS, IRQ_EVENTS, REF_NAMES, READ_OVERHEAD, field, fetch, raw
+from status import ticks
+from fleet import parse_targets
+
+# sampled registers
+FIELDS = STATUS['sysclk'] + STATUS['dpll'] + STATUS['ref'] \
+    + STATUS['watchdog'] + STATUS['tuning'] + IRQ_EVENTS
+
+# (metric, help, field) gauges
+GAUGES = [
+    ("ad9548_sysclk_locked", "System clock PLL locked", "sysclk.locked"),
+    ("ad9548_sysclk_stable", "System clock stable", "sysclk.stable"),
+    ("ad9548_sysclk_calibrating", "System clock calibration in progress", "sysclk.calibrating"),
+    ("ad9548_dpll_active", "DPLL active (closed loop)", "dpll.active"),
+    ("ad9548_dpll_free_running", "DPLL free running", "dpll.free-running"),
+    ("ad9548_dpll_holdover", "DPLL in holdover", "dpll.holdover"),
+    ("ad9548_dpll_phase_locked", "DPLL phase locked", "dpll.phase-locked"),
+    ("ad9548_dpll_freq_locked", "DPLL frequency locked", "dpll.freq-locked"),
+    ("ad9548_dpll_loop_switching", "DPLL switching reference", "dpll.loop-switching"),
+    ("ad9548_dpll_freq_clamped", "DPLL frequency clamped", "dpll.freq-clamped"),
+    ("ad9548_dpll_offset_slew_limiting", "DPLL phase offset slew limiting", "dpll.offset-slew-limiting"),
+    ("ad9548_dpll_phase_build_out", "DPLL phase build out", "dpll.phase-build-out"),
+    ("ad9548_dpll_history_available", "DPLL tuning word history available", "dpll.history"),
+    ("ad9548_dpll_active_ref", "DPLL active reference (0: A, 1: AA, 2: B, .. 7: DD)", "dpll.active-ref"),
+    ("ad9548_dpll_active_ref_priority", "DPLL active reference priority", "dpll.active-ref-priority"),
+    ("ad9548_tuning_word", "DDS frequency tuning word", "tuning"),
+    ("ad9548_watchdog_timer_ms", "Watchdog timer period [ms], 0: disabled", "watchdog.timer"),
+]
+
+# (metric, help, field name suffix) gauges, per reference input
+REF_GAUGES = [
+    ("ad9548_ref_valid", "Reference input valid", "valid"),
+    ("ad9548_ref_fault", "Reference input fault", "fault"),
+    ("ad9548_ref_fast", "Reference input too fast", "fast"),
+    ("ad9548_ref_slow", "Reference input too slow", "slow"),
+    ("ad9548_ref_profile_selected", "Reference input profile selected", "profile-selected"),
+    ("ad9548_ref_selected_profile", "Reference input selected profile", "selected-profile"),
+]
+
+class Target :
+    """ Last sample of a device, and its IRQ event counters """
+    def __init__ (self, name, dev, reopen=None):
+        """ name: [str] target label
+        dev: [AD9548] sampled device
+        reopen: optional callable returning a new AD9548 handle,
+            used after a failed sample (daemon restart, ..)
+        """
+        self.name = name
+        self.dev = dev
+        self.reopen = reopen
+        self.image = bytearray(REGMAP_SIZE)
+        self.time = None
+        self.up = False
+        self.errors = 0
+        self.irqs = dict((f.name, 0) for f in IRQ_EVENTS)
+
+class Sampler (threading.Thread):
+    """ Samples the targets sharing a bus, one after the other,
+    every `interval` seconds. Scrapes are served from the last
+    samples, whatever their rate, so they never reach the bus """
+    def __init__ (self, targets, interval, lock):
+        threading.Thread.__init__(self, daemon=True)
+        self.targets = targets
+        self.interval = interval
+        self.lock = lock
+        self.stopped = threading.Event()
+
+    def sample (self, target):
+        try:
+            if target.dev is None:
+                target.dev = target.reopen()
+            image = fetch(target.dev, FIELDS, gap=READ_OVERHEAD)
+        except Exception: # any failure must show, not kill the sampler
+            if target.reopen is not None:
+                target.dev = None # reopened on next tick
+            with self.lock:
+                target.up = False
+                target.errors += 1
+            return
+        with self.lock:
+            # IRQ status bits are sticky: count their rising edges
+            for f in IRQ_EVENTS:
+                if raw(f, image) and not raw(f, target.image):
+                    target.irqs[f.name] += 1
+            target.image = image
+            target.time = time.time()
+            target.up = True
+
+    def run (self):
+        for _ in ticks(self.interval):
+            if self.stopped.is_set():
+                break
+            for target in self.targets:
+                self.sample(target)
+
+    def stop (self):
+        self.stopped.set()
+
+def render (targets, lock):
+    """ Returns the metrics of given targets, in Prometheus text format """
+    out = []
+    def metric (name, kind, helper, samples):
+        out.append("# HELP {} {}".format(name, helper))
+        out.append("# TYPE {} {}".format(name, kind))
+        for (labels, value) in samples:
+            out.append("{}{{{}}} {}".format(name,
+                ",".join('{}="{}"'.format(k, v) for (k, v) in labels), value))
+    with lock:
+        metric("ad9548_up", "gauge", "Last sample succeeded",
+            [([("target", t.name)], int(t.up)) for t in targets])
+        metric("ad9548_sample_errors_total", "counter", "Failed samples",
+            [([("target", t.name)], t.errors) for t in targets])
+        sampled = [t for t in targets if t.time is not None]
+        metric("ad9548_sample_timestamp_seconds", "gauge", "Last successful sample time",
+            [([("target", t.name)], "{:.3f}".format(t.time)) for t in sampled])
+        for (name, helper, fname) in GAUGES:
+            f = field(FIELDS, fname)
+            metric(name, "gauge", helper,
+                [([("target", t.name)], raw(f, t.image)) for t in sampled])
+        for (name, helper, suffix) in REF_GAUGES:
+            fields = [(r, field(FIELDS, "ref.ref-{}.{}".format(r, suffix))) for r in REF_NAMES]
+            metric(name, "gauge", helper,
+                [([("target", t.name), ("ref", r)], raw(f, t.image)) for t in sampled for (r, f) in fields])
+        metric("ad9548_irq_events_total", "counter", "IRQ events (status bit rising edges) seen by the sampler",
+            [([("target", t.name), ("event", f.name)], t.irqs[f.name]) for t in sampled for f in IRQ_EVENTS])
+    return "\n".join(out) + "\n"
+
+class Handler (BaseHTTPRequestHandler):
+    def do_GET (self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render(self.server.targets, self.server.lock).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message (self, fmt, *args):
+        pass
+
+class Exporter (socketserver.ThreadingMixIn, HTTPServer):
+    """ Serves /metrics of given targets, sampled by one Sampler per bus """
+    daemon_threads = True
+
+    def __init__ (self, address, targets, interval=1.0):
+        """ address: (host, port) to serve
+        targets: [list] of (bus, Target)
+        interval: [float] minimal interval between two samples of a device [s]
+        """
+        HTTPServer.__init__(self, address, Handler)
+        self.lock = threading.Lock()
+        self.targets = [t for (bus, t) in targets]
+        buses = {}
+        for (bus, t) in targets:
+            buses.setdefault(bus, []).append(t)
+        self.samplers = [Sampler(group, interval, self.lock) for group in buses.values()]
+
+    def start (self):
+        for sampler in self.samplers:
+            sampler.start()
+
+    def stop (self):
+        for sampler in self.samplers:
+            sampler.stop()
+
+def main (argv):
+    parser = argparse.ArgumentParser(description="AD9548 Prometheus metrics exporter")
+    parser.add_argument(
+        "--targets",
+        metavar="targets",
+        type=str,
+        required=True,
+        help="""Comma separated `bus:address` list (0:0x48,1:0x48),
+        or file containing such list, as fleet.py""",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=9548,
+        help="HTTP port to serve /metrics on",
+    )
+    parser.add_argument(
+        "--bind",
+        type=str,
+        default="127.0.0.1",
+        help="Address to serve on",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="""Minimal interval between two samples of a device [s].
+        Scrapes are served from the last samples""",
+    )
+    parser.add_argument(
+        "--sim",
+        action="store_true",
+        help="Sample in-memory simulated devices instead of hardware",
+    )
+    parser.add_argument(
+        "--i2c-backend",
+        choices=I2C_BACKENDS,
+        help="""I2C access method: smbus wrapper, or direct I2C_RDWR ioctl (rdwr).
+        Defaults to $AD9548_I2C_BACKEND or {}""".format(I2C_BACKEND),
+    )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        default=NO_DAEMON,
+        help="Access the devices directly, even when the ad9548d.py daemon is running",
+    )
+    args = parser.parse_args(argv)
+    def opener (bus, address):
+        def reopen ():
+            transport = None
+            if not args.no_daemon:
+                transport = connect_daemon({"bus": bus, "address": address}, backend=args.i2c_backend)
+            if transport is None: # direct access
+                transport = i2c_transport(bus, address, args.i2c_backend)
+            return AD9548(transport=transport)
+        return reopen
+
+    targets = []
+    for (bus, address) in parse_targets(args.targets):
+        name = "{}:0x{:02X}".format(bus, address)
+        if args.sim:
+            from simulator import SimTransport
+            targets.append((bus, Target(name, AD9548(transport=SimTransport()))))
+        else:
+            targets.append((bus, Target(name, None, opener(bus, address))))
+    server = Exporter((args.bind, args.port), targets, args.interval)
+    server.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
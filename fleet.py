@@ -0,0 +1,158 @@
+#! /usr/bin/env python3
+#################################################################
+# Guillaume W. Bres, 2022          <guillaume.bressaix@gmail.com>
+#################################################################
+# fleet.py: runs a tool against many bus/address targets
+#################################################################
+import io
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+class ThreadStdout :
+    """ sys.stdout replacement capturing each worker thread output """
+    def __init__ (self, stdout):
+        self.stdout = stdout
+        self.local = threading.local()
+
+    def capture (self):
+        self.local.buffer = io.StringIO()
+
+    def release (self):
+        output = self.local.buffer.getvalue()
+        self.local.buffer = None
+        return output
+
+    def write (self, data):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            return self.stdout.write(data)
+        return buffer.write(data)
+
+    def flush (self):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            self.stdout.flush()
+
+def parse_targets (spec):
+    """ Parses a targets description into a list of (bus, address):
+    comma separated `bus:address` pairs, or a file containing them.
+    `*` as bus expands to all /dev/i2c-X buses,
+    `0x48-0x4B` address ranges are supported """
+    if os.path.isfile(spec):
+        with open(spec) as fd:
+            spec = ",".join(line.split("#")[0].strip() for line in fd)
+    targets = []
+    for item in spec.split(","):
+        item = item.strip()
+        if len(item) == 0:
+            continue
+        (bus, address) = item.split(":")
+        if bus == "*":
+            buses = sorted(int(path.split("-")[-1]) for path in glob.glob("/dev/i2c-*"))
+        else:
+            buses = [int(bus)]
+        if "-" in address:
+            (first, last) = address.split("-")
+            addresses = range(int(first, 16), int(last, 16)+1)
+        else:
+            addresses = [int(address, 16)]
+        for b in buses:
+            for a in addresses:
+                if (b, a) not in targets:
+                    targets.append((b, a))
+    return targets
+
+def load_tool (name):
+    """ Imports given tool (`status`, `regmap.py`, ..) """
+    here = os.path.dirname(os.path.abspath(__file__))
+    path = os.path.join(here, name if name.endswith(".py") else name + ".py")
+    spec = importlib.util.spec_from_file_location(os.path.basename(path)[:-3].replace("-", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run_target (tool, args, bus, address, stdout):
+    """ Runs tool.main() against a single target, returns its report """
+    fields = {"bus": bus, "address": "0x{:02X}".format(address)}
+    argv = [arg.format(**fields) for arg in args]
+    argv += [str(bus), "0x{:02X}".format(address)]
+    report = {}
+    stdout.capture()
+    t0 = time.monotonic()
+    try:
+        code = tool.main(argv)
+    except SystemExit as e:
+        code = e.code
+    except Exception as e:
+        code = 1
+        report["error"] = "{}: {}".format(type(e).__name__, e)
+    report["elapsed"] = time.monotonic() - t0
+    report["exit"] = code or 0
+    output = stdout.release()
+    try:
+        report["output"] = json.loads(output)
+    except ValueError:
+        report["output"] = output
+    return report
+
+def main (argv):
+    parser = argparse.ArgumentParser(description="Run an AD9548 tool against many devices in parallel")
+    parser.add_argument(
+        "--targets",
+        metavar="targets",
+        type=str,
+        required=True,
+        help="""Comma separated `bus:address` list (0:0x48,0:0x4A,1:0x48),
+        or file containing such list. `*:0x48` targets all I2C buses,
+        `0:0x48-0x4B` an address range""",
+    )
+    parser.add_argument(
+        "tool",
+        type=str,
+        help="Tool to run (status, regmap, calib..)",
+    )
+    parser.add_argument(
+        "args",
+        nargs=argparse.REMAINDER,
+        help="""Tool arguments, `bus` and `address` are appended for each target.
+        {bus} and {address} are replaced by the target (--dump /tmp/{bus}-{address}.json)""",
+    )
+    args = parser.parse_args(argv)
+    targets = parse_targets(args.targets)
+    tool = load_tool(args.tool)
+
+    # one worker per bus: devices sharing a bus are run one after the other
+    buses = {}
+    for (bus, address) in targets:
+        buses.setdefault(bus, []).append(address)
+
+    stdout = ThreadStdout(sys.stdout)
+    def run_bus (bus):
+        return [(bus, address, run_target(tool, args.args, bus, address, stdout)) for address in buses[bus]]
+
+    results = {}
+    t0 = time.monotonic()
+    sys.stdout = stdout
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, len(buses))) as pool:
+            for reports in pool.map(run_bus, buses):
+                for (bus, address, report) in reports:
+                    results["{}:0x{:02X}".format(bus, address)] = report
+    finally:
+        sys.stdout = stdout.stdout
+    fleet = {
+        "elapsed": time.monotonic() - t0,
+        "targets": results,
+    }
+    print(json.dumps(fleet, sort_keys=True, indent=2))
+    return 0 if all(report["exit"] == 0 for report in results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
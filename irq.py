@@ -7,18 +7,44 @@
 import sys
 import argparse
 from ad9548 import *
+from schema import STATUS, IRQ_EVENTS, IRQ_STATUS, IRQ_MASK, IRQ_CLEAR, field, fetch, encode
+
+# command line flags: IRQ event name, or prefix of IRQ event names
+EVENTS = {
+    'all': '',
+    'watchdog': 'watchdog.',
+    'dpll': 'dpll.',
+    'sysclk': 'sysclk.',
+    'distrib': 'distrib.',
+    'ref': 'ref-',
+    'eeprom': 'eeprom.',
+    'history': 'dpll-limits.history-updated',
+    'freq-unclamped': 'dpll-limits.freq-unclamped',
+    'freq-clamped': 'dpll-limits.freq-clamped',
+    'slew-unlimited': 'dpll-limits.slew-unlimited',
+    'slew-limited': 'dpll-limits.slew-limited',
+    'dpll-switching': 'dpll.switching-ref',
+    'dpll-closed': 'dpll.closed-loop',
+    'dpll-freerunning': 'dpll.free-run',
+    'dpll-holdover': 'dpll.holdover',
+    'dpll-freq-unlocked': 'dpll.freq.unlocked',
+    'dpll-freq-locked': 'dpll.freq.locked',
+    'dpll-phase-unlocked': 'dpll.phase.unlocked',
+    'dpll-phase-locked': 'dpll.phase.locked',
+    'sysclk-unlocked': 'sysclk.unlocked',
+    'sysclk-locked': 'sysclk.locked',
+    'sysclk-cal-complete': 'sysclk.calibration.done',
+    'sysclk-cal-started': 'sysclk.calibration.started',
+    'eeprom-fault': 'eeprom.fault',
+    'eeprom-complete': 'eeprom.complete',
+}
+for ref in ['a','b','c','d']:
+    EVENTS['ref-{}'.format(ref)] = 'ref-{}.'.format(ref)
+    EVENTS['ref-{0:}{0:}'.format(ref)] = 'ref-{0:}{0:}.'.format(ref)
+
 def main (argv):
     parser = argparse.ArgumentParser(description="AD9548 IRQ clearing/masking tool")
-    parser.add_argument(
-        "bus",
-        type=int,
-        help="I2C bus (int)",
-    )
-    parser.add_argument(
-        "address",
-        type=str,
-        help="I2C slv address (hex)",
-    )
+    add_device_args(parser)
     parser.add_argument(
         "--pin",
         type=str,
@@ -47,6 +73,7 @@ def main (argv):
         ('sysclk', 'All Sys clock related events'),
         ('distrib', 'Distribution Sync Event'),
         ('ref', 'All reference sync event'),
+        ('eeprom', 'All EEPROM related events'),
         ('history', 'Enables all IRQ for indicating the occurence of tuning word history update'),
         ('freq-unclamped', 'Frequency limiter clamped->unclamped transition event'),
         ('freq-clamped', 'Frequency limiter unclamped->clamped transition event'),
@@ -90,155 +117,41 @@ def main (argv):
         )
     args = parser.parse_args(argv)
     # open device
-    dev = AD9548(args.bus, int(args.address,16))
-
-    modes = {
-        'nmos': 0,
-        'pmos': 1,
-        'cmos-high': 2,
-        'cmos-low': 3,
-    }
+    dev = open_device(args, cache=True)
 
     if args.pin:
         # pin special op
-        mode = modes[args.pin]
-        r = dev.read_data(0x0208)
-        dev.write_data(0x0208, r | mode)
+        image = fetch(dev, [field(STATUS['irq'], 'irq.pin')])
+        for addr in encode(STATUS['irq'], {'irq.pin': args.pin}, image):
+            dev.write_data(addr, image[addr])
         dev.io_update()
         return 0 # terminate
 
-    if args.all:
-        if args.clear:
-            # clear all: special op
-            r = dev.read_data(0x0A03)
-            dev.write_data(0x0A03, r | 0x02)
-            dev.io_update()
-            return 0 # special op
-        elif args.enable:
-            # enable all: special op
-            regs = [
-                (0x0209, 0x33),
-                (0x020A, 0x0F),
-                (0x020B, 0xFF),
-                (0x020C, 0x1F),
-                (0x020D, 0xFF),
-                (0x020E, 0xFF),
-                (0x020F, 0xFF),
-                (0x0210, 0xFF),
-            ]
-            for reg in regs:
-                (base, mask) = reg
-                dev.write_data(base, mask)
-            dev.io_update()
-            return 0 # special op
-        elif args.disable:
-            # disable all: special op
-            regs = [
-                (0x0209, 0x00),
-                (0x020A, 0x00),
-                (0x020B, 0x00),
-                (0x020C, 0x00),
-                (0x020D, 0x00),
-                (0x020E, 0x00),
-                (0x020F, 0x00),
-                (0x0210, 0x00),
-            ]
-            for reg in regs:
-                (base, mask) = reg
-                dev.write_data(base, mask)
-            dev.io_update()
-            return 0 # special op
- 
-    regs = []
-    if args.watchdog:
-        regs.append(0x020A, 0x04)
-    
-    if args.dpll:
-        regs.append((0x020B, 0xFF))
-    if args.dpll_switching:
-        regs.append((0x020B, 0x80))
-    if args.dpll_closed:
-        regs.append((0x020B, 0x40))
-    if args.dpll_freerunning:
-        regs.append((0x020B, 0x20))
-    if args.dpll_holdover:
-        regs.append((0x020B, 0x10))
-    if args.dpll_freq_unlocked:
-        regs.append((0x020B, 0x08))
-    if args.dpll_freq_locked:
-        regs.append((0x020B, 0x04))
-    if args.dpll_phase_unlocked:
-        regs.append((0x020B, 0x02))
-    if args.dpll_phase_locked:
-        regs.append((0x020B, 0x01))
-
-    if args.distrib:
-        regs.append((0x020A, 0x08))
-    
-    if args.sysclk:
-        regs.append((0x0209, 0x33))
-    if args.sysclk_unlocked:
-        regs.append((0x0209, 0x20))
-    if args.sysclk_locked:
-        regs.append((0x0209, 0x10))
-    if args.sysclk_cal_complete:
-        regs.append((0x0209, 0x02))
-    if args.sysclk_cal_started:
-        regs.append((0x0209, 0x01))
-
-    if args.eeprom:
-        regs.append((0x020A, 0x03))
-    if args.eeprom_fault:
-        regs.append((0x020A, 0x02))
-    if args.eeprom_complete:
-        regs.append((0x020A, 0x01))
-
-    if args.ref:
-        # all ref: special opmode'or', 
-        regs.append((0x020D, 0xFF))
-        regs.append((0x020E, 0xFF))
-        regs.append((0x020F, 0xFF))
-        regs.append((0x0210, 0xFF))
-    if args.refa:
-        regs.append((0x020D, 0x0F))
-    if args.refaa:
-        regs.append((0x020D, 0xF0))
-    if args.refb:
-        regs.append((0x020E, 0x0F))
-    if args.refbb:
-        regs.append((0x020E, 0xF0))
-    if args.refc:
-        regs.append((0x020F, 0x0F))
-    if args.refcc:
-        regs.append((0x020F, 0xF0))
-    if args.refd:
-        regs.append((0x0210, 0x0F))
-    if args.refdd:
-        regs.append((0x0210, 0xF0))
+    if args.all and args.clear:
+        # clear all: special op
+        r = dev.read_data(0x0A03)
+        dev.write_data(0x0A03, r | 0x02)
+        dev.io_update()
+        return 0 # special op
 
-    if args.history:
-        regs.append((0x020C, 0x10))
-    if args.freq_unclamped:
-        regs.append((0x020C, 0x08))
-    if args.freq_clamped:
-        regs.append((0x020C, 0x04))
-    if args.slew_unlimited:
-        regs.append((0x020C, 0x02))
-    if args.slew_limited:
-        regs.append((0x020C, 0x01))
+    # selected IRQ events, merged per register: {status address: bit mask}
+    regs = {}
+    for (flag, prefix) in EVENTS.items():
+        if getattr(args, flag.replace("-", "_")):
+            for ev in IRQ_EVENTS:
+                if ev.name == prefix or ev.name.startswith(prefix):
+                    regs[ev.addr] = regs.get(ev.addr, 0x00) | ev.mask
 
-    for reg in regs:
-        (addr, mask) = reg # IRQ mask reg
-        if args.clear:
-            addr += 0x7FB # clear REG offset
-        
-        r = dev.read_data(addr)
-        if args.disable: # clear desired bit(s)
-            r &= (mask ^0xFF) # mask out
-            dev.write_data(addr, r)
-        else: # assert desired bit(s)
-            dev.write_data(addr, r | mask)
-    dev.io_update()
+    with dev.transaction():
+        for (addr, mask) in sorted(regs.items()):
+            if args.clear:
+                addr += IRQ_CLEAR - IRQ_STATUS
+            else: # IRQ mask reg
+                addr += IRQ_MASK - IRQ_STATUS
+            if args.disable: # clear desired bit(s)
+                dev.write_bits(addr, mask, 0x00) # mask out
+            else: # assert desired bit(s)
+                dev.write_bits(addr, mask, 0xFF)
 
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -9,16 +9,7 @@ import argparse
 from ad9548 import *
 def main (argv):
     parser = argparse.ArgumentParser(description="AD9548 mx-pin programmable i/o")
-    parser.add_argument(
-        "bus",
-        type=int,
-        help="I2C bus (int)",
-    )
-    parser.add_argument(
-        "address",
-        type=str,
-        help="I2C slv address (hex)",
-    )
+    add_device_args(parser)
     io = {
         'input': 0,
         'output': 1,
@@ -151,7 +142,7 @@ def main (argv):
     )
     args = parser.parse_args(argv)
     # open device
-    dev = AD9548(args.bus, int(args.address,16))
+    dev = open_device(args)
 
     pin = args.pin
     pin_n = int(pin.strip("M"))
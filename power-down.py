@@ -9,16 +9,7 @@ import argparse
 from ad9548 import *
 def main (argv):
     parser = argparse.ArgumentParser(description="AD9548 power-down tool")
-    parser.add_argument(
-        "bus",
-        type=int,
-        help="I2C bus (int)",
-    )
-    parser.add_argument(
-        "address",
-        type=str,
-        help="I2C slv address (hex)",
-    )
+    add_device_args(parser)
     flags = [
         ('clear', 'Clear (recover from a previous) power down op'), 
         ('all',  'Complete device power down'),
@@ -44,7 +35,7 @@ def main (argv):
         )
     args = parser.parse_args(argv)
     # open device
-    dev = AD9548(args.bus, int(args.address,16))
+    dev = open_device(args, cache=True)
 
     regs = []
     if args.all: # special op
@@ -77,13 +68,13 @@ def main (argv):
         if args.refdd:
             regs.append((0x0500, 0x80))
     
-    for reg in regs: # cli OK
-        (addr, mask) = reg
-        r = dev.read_data(addr)
-        if args.clear:
-            dev.write_data(addr, r & (mask^0xFF)) # mask out
-        else:
-            dev.write_data(addr, r | mask) # assert
-        dev.io_update()
+    # all units are powered down/up at once
+    with dev.transaction():
+        for reg in regs: # cli OK
+            (addr, mask) = reg
+            if args.clear:
+                dev.write_bits(addr, mask, 0x00) # mask out
+            else:
+                dev.write_bits(addr, mask, 0xFF) # assert
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -0,0 +1,290 @@
+#! /usr/bin/env python3
+#################################################################
+# Guillaume W. Bres, 2022          <guillaume.bressaix@gmail.com>
+#################################################################
+# recorder.py: status registers time series recorder,
+# into rotating memory mapped segments, and its query tool
+#################################################################
+import os
+import sys
+import json
+import time
+import mmap
+import struct
+import argparse
+from ad9548 import *
+from schema import STATUS, shift, convert
+from status import ticks
+
+# recorded status block
+STATUS_BLOCK = (0x0D00, 0x0D19)
+STATUS_SIZE = STATUS_BLOCK[1] - STATUS_BLOCK[0] + 1
+
+SEGMENT_MAGIC = b"AD9548RC"
+# magic, record size, capacity, number of records
+SEGMENT_HEADER = struct.Struct("<8sIIQ")
+SEGMENT_HEADER_SIZE = 64
+# unix time [s], raw status block, padded to 8 bytes
+RECORD = struct.Struct("<d{}s6x".format(STATUS_SIZE))
+# one day of per second records
+SEGMENT_CAPACITY = 86400
+
+# fields that can be queried: status fields within the recorded block
+FIELDS = dict((f.name, f) for section in STATUS.values() for f in section
+    if STATUS_BLOCK[0] <= f.addr and f.addr + f.width - 1 <= STATUS_BLOCK[1])
+
+class Segment :
+    """ Fixed size records file, memory mapped """
+    def __init__ (self, path, capacity=None):
+        """ path: [str] segment file, created with given `capacity`
+        (number of records) when it does not exist """
+        self.path = path
+        if capacity is not None and not os.path.exists(path):
+            with open(path, "wb") as fd:
+                fd.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, RECORD.size, capacity, 0))
+                fd.truncate(SEGMENT_HEADER_SIZE + capacity * RECORD.size)
+        self.fd = open(path, "r+b" if capacity is not None else "rb")
+        self.map = mmap.mmap(self.fd.fileno(), 0,
+            access=mmap.ACCESS_WRITE if capacity is not None else mmap.ACCESS_READ)
+        (magic, size, self.capacity, _) = SEGMENT_HEADER.unpack_from(self.map)
+        if magic != SEGMENT_MAGIC or size != RECORD.size:
+            raise ValueError("{}: not a status records segment".format(path))
+
+    def __len__ (self):
+        return SEGMENT_HEADER.unpack_from(self.map)[3]
+
+    def full (self):
+        return len(self) == self.capacity
+
+    def append (self, t, block):
+        n = len(self)
+        RECORD.pack_into(self.map, SEGMENT_HEADER_SIZE + n * RECORD.size, t, bytes(block))
+        # record is written before it is accounted for
+        SEGMENT_HEADER.pack_into(self.map, 0, SEGMENT_MAGIC, RECORD.size, self.capacity, n+1)
+
+    def records (self):
+        """ Returns (times, blocks) of the stored records:
+        numpy arrays (float64, uint8 [n, STATUS_SIZE]) viewing the mapping
+        when numpy is available, lists otherwise """
+        n = len(self)
+        try:
+            import numpy as np
+            dtype = np.dtype([("time", "<f8"), ("status", "u1", STATUS_SIZE), ("pad", "V6")])
+            records = np.frombuffer(self.map, dtype=dtype, count=n, offset=SEGMENT_HEADER_SIZE)
+            return (records["time"], records["status"])
+        except ImportError:
+            pass
+        times = []
+        blocks = []
+        for i in range (n):
+            (t, block) = RECORD.unpack_from(self.map, SEGMENT_HEADER_SIZE + i * RECORD.size)
+            times.append(t)
+            blocks.append(block)
+        return (times, blocks)
+
+    def close (self):
+        self.map.close()
+        self.fd.close()
+
+def segments (path):
+    """ Returns the segment files of given recording, oldest first """
+    names = [name for name in os.listdir(path) if name.endswith(".seg")]
+    return [os.path.join(path, name) for name in sorted(names, key=lambda name: int(name[:-4]))]
+
+class Recorder :
+    """ Appends status records to the last segment of a recording,
+    a new segment is started when it is full, only the `keep`
+    latest segments are kept """
+    def __init__ (self, path, capacity=SEGMENT_CAPACITY, keep=7):
+        """ path: [str] recording directory, created when missing
+        capacity: [int] records per segment
+        keep: [int] number of segments to keep, 0 keeps them all
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.capacity = capacity
+        self.keep = keep
+        self.segment = None
+        existing = segments(path)
+        if len(existing) > 0:
+            self.segment = Segment(existing[-1], capacity)
+
+    def append (self, t, block):
+        if self.segment is None or self.segment.full():
+            if self.segment is not None:
+                self.segment.map.flush()
+                self.segment.close()
+            name = "{:d}.seg".format(int(t * 1E6))
+            self.segment = Segment(os.path.join(self.path, name), self.capacity)
+            if self.keep > 0:
+                for old in segments(self.path)[:-self.keep]:
+                    os.unlink(old)
+        self.segment.append(t, block)
+
+    def close (self):
+        if self.segment is not None:
+            self.segment.close()
+
+def field_values (f, blocks):
+    """ Raw values of given field, over status blocks.
+    Vectorized over all records with numpy arrays """
+    offset = f.addr - STATUS_BLOCK[0]
+    if isinstance(blocks, list):
+        return [(int.from_bytes(block[offset:offset+f.width], "little") & f.mask) >> shift(f.mask) for block in blocks]
+    import numpy as np
+    v = np.zeros(len(blocks), dtype=np.uint64)
+    for i in range (f.width):
+        v |= blocks[:, offset+i].astype(np.uint64) << np.uint64(8*i)
+    return (v & np.uint64(f.mask)) >> np.uint64(shift(f.mask))
+
+def parse_time (value, now=None):
+    """ Unix time [s], or duration before now: 30s, 15m, 12h, 7d """
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if value[-1] in units:
+        now = time.time() if now is None else now
+        return now - float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+def query (path, names, since=None, until=None, changes=False):
+    """ Returns the (time, {field: raw value}) records of given recording,
+    within [since, until]. With `changes`, only the records where
+    one of the fields changed (and the first one) are returned """
+    fields = [FIELDS[name] for name in names]
+    out = []
+    for seg_path in segments(path):
+        seg = Segment(seg_path)
+        try:
+            (times, blocks) = seg.records()
+            if isinstance(times, list):
+                keep = [i for (i, t) in enumerate(times)
+                    if (since is None or t >= since) and (until is None or t <= until)]
+                times = [times[i] for i in keep]
+                values = [[v[i] for i in keep] for v in [field_values(f, blocks) for f in fields]]
+                rows = range (len(times))
+                if changes:
+                    rows = [i for i in rows if i == 0
+                        or any(v[i] != v[i-1] for v in values)]
+            else:
+                import numpy as np
+                keep = np.ones(len(times), dtype=bool)
+                if since is not None:
+                    keep &= times >= since
+                if until is not None:
+                    keep &= times <= until
+                times = times[keep]
+                values = [field_values(f, blocks[keep]) for f in fields]
+                # release the mapping view, for the segment to be closed
+                blocks = None
+                rows = np.arange(len(times))
+                if changes and len(times) > 0:
+                    changed = np.zeros(len(times), dtype=bool)
+                    changed[0] = True
+                    for v in values:
+                        changed[1:] |= v[1:] != v[:-1]
+                    rows = np.flatnonzero(changed)
+            for i in rows:
+                out.append((float(times[i]), dict((f.name, int(v[i])) for (f, v) in zip(fields, values))))
+        finally:
+            seg.close()
+    if changes:
+        # records where nothing changed across segment boundaries
+        out = [r for (i, r) in enumerate(out) if i == 0 or r[1] != out[i-1][1]]
+    return out
+
+def query_main (argv):
+    """ recorder.py query PATH --field F [..]: decodes recorded fields """
+    parser = argparse.ArgumentParser(prog="recorder.py query",
+        description="Decode fields from recorded status registers")
+    parser.add_argument(
+        "path",
+        type=str,
+        help="Recording directory",
+    )
+    parser.add_argument(
+        "--field",
+        action="append",
+        required=True,
+        choices=sorted(FIELDS),
+        metavar="name",
+        help="Status field to decode (dpll.holdover, ref.ref-a.valid, irq.dpll.holdover..), can be repeated",
+    )
+    parser.add_argument(
+        "--since",
+        type=str,
+        help="Start of the time range: unix time, or duration before now (30s, 15m, 12h, 7d)",
+    )
+    parser.add_argument(
+        "--until",
+        type=str,
+        help="End of the time range: unix time, or duration before now",
+    )
+    parser.add_argument(
+        "--changes",
+        action="store_true",
+        help="Only report the records where one of the fields changed",
+    )
+    args = parser.parse_args(argv)
+    since = None if args.since is None else parse_time(args.since)
+    until = None if args.until is None else parse_time(args.until)
+    for (t, values) in query(args.path, args.field, since, until, args.changes):
+        record = dict((name, convert(FIELDS[name], v)) for (name, v) in values.items())
+        record['time'] = t
+        sys.stdout.write(json.dumps(record, sort_keys=True, separators=(",", ":")) + "\n")
+    return 0
+
+def main (argv):
+    if len(argv) > 0 and argv[0] == "query":
+        return query_main(argv[1:])
+    parser = argparse.ArgumentParser(
+        description="""Record status registers (0x0D00-0x0D19) into rotating
+        memory mapped segments. `recorder.py query -h` to decode recordings""")
+    add_device_args(parser)
+    parser.add_argument(
+        "--path",
+        metavar="directory",
+        type=str,
+        required=True,
+        help="Recording directory",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="Sampling interval [s]",
+    )
+    parser.add_argument(
+        "--capacity",
+        type=int,
+        default=SEGMENT_CAPACITY,
+        help="Records per segment",
+    )
+    parser.add_argument(
+        "--keep",
+        type=int,
+        default=7,
+        help="Number of segments to keep, 0 keeps them all",
+    )
+    parser.add_argument(
+        "--count",
+        type=int,
+        help="Stop after that many records",
+    )
+    args = parser.parse_args(argv)
+    dev = open_device(args)
+    recorder = Recorder(args.path, args.capacity, args.keep)
+    n = 0
+    try:
+        for _ in ticks(args.interval):
+            t = time.time()
+            recorder.append(t, dev.read_block(STATUS_BLOCK[0], STATUS_SIZE))
+            n += 1
+            if args.count is not None and n >= args.count:
+                break # not waiting for another tick
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -9,16 +9,7 @@ import argparse
 from ad9548 import *
 def main (argv):
     parser = argparse.ArgumentParser(description="AD9548 reference inputs management")
-    parser.add_argument(
-        "bus",
-        type=int,
-        help="I2C bus (int)",
-    )
-    parser.add_argument(
-        "address",
-        type=str,
-        help="I2C slv address (hex)",
-    )
+    add_device_args(parser)
     flags = [
         ('switching-mode', str, ['automatic','fallback','holdover','manual'],
         """Select the operating mode of the reference switching state machine.
@@ -52,10 +43,8 @@ def main (argv):
         Defaults to `all`. Aux-x means auxilary-x input reference, when feasible.""",
     )
     args = parser.parse_args(argv)
-    pin = args.pin
-    ref = args.ref
     # open device
-    dev = AD9548(args.bus, int(args.address, 16))
+    dev = open_device(args, cache=True)
 
     logics = {
         'disabled':  0,
@@ -74,18 +63,20 @@ def main (argv):
             dev.write_data(0x0502, mask) # DD/D/C/CC: assign all
         else:
             mask = logics[args.logic] 
+            shift = 0
             if (args.ref == "aa") or (args.ref == "cc"):
-                mask = mask << 2
+                shift = 2
             if (args.ref == "b") or (args.ref == "d"):
-                mask = mask << 4
+                shift = 4
             if (args.ref == "bb") or (args.ref == "dd"):
-                mask = mask << 6
+                shift = 6
+            mask = mask << shift
             if ((args.ref == "c") or  (args.ref == "cc") or (args.ref == "d") or (args.ref == "dd")):
                 addr = 0x0502
             else:
                 addr = 0x0501
             r = dev.read_data(addr)
-            r &= (mask ^0xFF) # clear bits
+            r &= ((0x03 << shift) ^0xFF) # clear bits
             dev.write_data(addr, r|mask) # assign bits
     dev.io_update()
 if __name__ == "__main__":
@@ -4,12 +4,403 @@
 #################################################################
 # regmap.py: load/dump a register map into device
 #################################################################
+import os
 import sys
 import json
+import time
+import struct
+import hashlib
 import argparse
+import tempfile
+from ad9548 import *
 
-REGMAP = [0x00, 0x0E3F]
 KNOWN_DEVICES = ["ad9547","ad9548"]
+# --diff: unchanged registers separated by up to DIFF_GAP bytes
+# are rewritten, rather than opening a new transaction
+# (slave address + 2 register address bytes)
+DIFF_GAP = 3
+
+def read_regmap (path):
+    """ Returns {addr: value} described by given register map file """
+    with open(path, encoding="utf-8-sig") as f:
+        regmap = json.load(f)["RegisterMap"]
+    return {int(addr, 16): int(regmap[addr], 16) & 0xFF for addr in regmap}
+
+# Compiled write plan, cached next to its register map (`.plan` suffix):
+# header: magic, version, source size, source sha256, number of runs
+# then each run: address, length, payload bytes
+PLAN_MAGIC = b"AD9548PL"
+PLAN_VERSION = 2
+PLAN_HEADER = struct.Struct("<8sHxxq32sI")
+PLAN_RUN = struct.Struct("<HH")
+
+def compile_plan (path):
+    """ Compiles given register map into sorted (address, bytes) runs.
+    Read only registers are dropped """
+    image = read_regmap(path)
+    for addr in READ_ONLY:
+        image.pop(addr, None)
+    return [(first, bytes(image[a] for a in range (first, last+1))) for (first, last) in spans(image)]
+
+def write_plan (path, runs, size, digest):
+    """ Stores compiled runs into given plan file """
+    with open(path, "wb") as fd:
+        fd.write(PLAN_HEADER.pack(PLAN_MAGIC, PLAN_VERSION, size, digest, len(runs)))
+        for (addr, data) in runs:
+            fd.write(PLAN_RUN.pack(addr, len(data)))
+            fd.write(data)
+
+def read_plan (path):
+    """ Returns (header fields, runs) of given plan file """
+    with open(path, "rb") as fd:
+        raw = fd.read()
+    header = PLAN_HEADER.unpack_from(raw)
+    if header[0] != PLAN_MAGIC or header[1] != PLAN_VERSION:
+        raise ValueError("{} is not a register map plan".format(path))
+    runs = []
+    offset = PLAN_HEADER.size
+    for i in range (header[4]):
+        (addr, length) = PLAN_RUN.unpack_from(raw, offset)
+        offset += PLAN_RUN.size
+        runs.append((addr, raw[offset:offset+length]))
+        offset += length
+    return (header, runs)
+
+def load_plan (path):
+    """ Returns the compiled runs of given register map,
+    from its cached plan when still valid: same size and content hash.
+    Modification times are not trusted (cp -p, rsync -t, checkouts..) """
+    plan = path + ".plan"
+    with open(path, "rb") as fd:
+        source = fd.read()
+    digest = hashlib.sha256(source).digest()
+    if os.path.exists(plan):
+        try:
+            (header, runs) = read_plan(plan)
+            if header[2] == len(source) and header[3] == digest:
+                return runs
+        except (ValueError, struct.error):
+            pass
+    runs = compile_plan(path)
+    try:
+        write_plan(plan, runs, len(source), digest)
+    except OSError: # read only location
+        pass
+    return runs
+
+# Binary snapshot (--dump *.bin): fixed size header
+# (magic, version, chip, dump time, image sha256) + raw register image.
+# The image sits at SNAPSHOT_HEADER.size and can be mapped directly
+SNAPSHOT_MAGIC = b"AD9548SN"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<8sH6sd32s")
+SNAPSHOT_SIZE = SNAPSHOT_HEADER.size + REGMAP_SIZE
+
+def write_snapshot (path, chip, image, t=None):
+    """ Stores a register image into given binary snapshot """
+    image = bytes(image)
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+        chip.encode("ascii"), time.time() if t is None else t,
+        hashlib.sha256(image).digest())
+    with open(path, "wb") as fd:
+        fd.write(header + image)
+
+def read_snapshot (path):
+    """ Returns (chip, time, sha256, image) of given binary snapshot """
+    with open(path, "rb") as fd:
+        raw = fd.read()
+    (magic, version, chip, t, digest) = SNAPSHOT_HEADER.unpack_from(raw)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or len(raw) != SNAPSHOT_SIZE:
+        raise ValueError("{} is not a register snapshot".format(path))
+    return (chip.decode("ascii"), t, digest, raw[SNAPSHOT_HEADER.size:])
+
+def read_image (path):
+    """ Returns the register image (REGMAP_SIZE bytes) of given
+    binary snapshot or JSON register map """
+    with open(path, "rb") as fd:
+        magic = fd.read(len(SNAPSHOT_MAGIC))
+    if magic == SNAPSHOT_MAGIC:
+        return read_snapshot(path)[3]
+    image = bytearray(REGMAP_SIZE)
+    for (addr, value) in read_regmap(path).items():
+        image[addr] = value
+    return bytes(image)
+
+def valid_mask (chip="ad9548"):
+    """ Returns a REGMAP_SIZE mask, 0xFF on valid registers """
+    mask = bytearray(REGMAP_SIZE)
+    for (first, last, name) in REGISTER_BLOCKS[chip]:
+        mask[first:last+1] = b"\xFF" * (last-first+1)
+    return bytes(mask)
+
+def diff_images (ref, images, chip="ad9548"):
+    """ Compares images to reference image,
+    returns the list of differing (valid) addresses, per image.
+    Vectorized with numpy when available, integer XOR otherwise """
+    mask = valid_mask(chip)
+    try:
+        import numpy as np
+        valid = np.frombuffer(mask, dtype=np.uint8).astype(bool)
+        ref = np.frombuffer(ref, dtype=np.uint8)
+        stack = np.frombuffer(b"".join(images), dtype=np.uint8).reshape(len(images), REGMAP_SIZE)
+        changed = (stack != ref) & valid
+        return [np.flatnonzero(row).tolist() for row in changed]
+    except ImportError:
+        pass
+    ref = int.from_bytes(ref, "big")
+    valid = int.from_bytes(mask, "big")
+    result = []
+    for image in images:
+        x = (int.from_bytes(image, "big") ^ ref) & valid
+        if x == 0: # identical, the common case
+            result.append([])
+            continue
+        x = x.to_bytes(REGMAP_SIZE, "big")
+        result.append([addr for addr in range (REGMAP_SIZE) if x[addr]])
+    return result
+
+def diff_main (argv):
+    """ regmap.py diff A B [C..]: compares snapshots or register maps to A """
+    parser = argparse.ArgumentParser(prog="regmap.py diff",
+        description="Compare register snapshots (.bin) or register maps (.json) to a reference")
+    parser.add_argument(
+        "reference",
+        type=str,
+        help="Reference snapshot or register map",
+    )
+    parser.add_argument(
+        "others",
+        nargs="+",
+        type=str,
+        help="Snapshots or register maps to compare to the reference",
+    )
+    parser.add_argument(
+        "--chip",
+        type=str,
+        choices=KNOWN_DEVICES,
+        default=KNOWN_DEVICES[0],
+        help="Device the snapshots were taken from",
+    )
+    args = parser.parse_args(argv)
+    ref = read_image(args.reference)
+    images = [read_image(path) for path in args.others]
+    report = {}
+    for (path, image, addrs) in zip(args.others, images, diff_images(ref, images, args.chip)):
+        report[path] = {}
+        for addr in addrs:
+            report[path]["0x{:04X}".format(addr)] = {
+                "block": register_block(addr, args.chip),
+                "reference": "0x{:02X}".format(ref[addr]),
+                "value": "0x{:02X}".format(image[addr]),
+            }
+    print(json.dumps(report, sort_keys=True, indent=2))
+    return 1 if any(len(diff) > 0 for diff in report.values()) else 0
+
+def history_main (argv):
+    """ regmap.py history STORE: queries a snapshot store """
+    parser = argparse.ArgumentParser(prog="regmap.py history",
+        description="Query a register snapshot store (--dump --store)")
+    parser.add_argument(
+        "store",
+        type=str,
+        help="Snapshot store directory",
+    )
+    parser.add_argument(
+        "--target",
+        metavar="bus:address",
+        type=str,
+        help="Restrict to given device (0:0x48, /dev/spidev0.0:)",
+    )
+    parser.add_argument(
+        "--register",
+        metavar="addr",
+        type=str,
+        help="List the changes of given register (hex), instead of the snapshots",
+    )
+    parser.add_argument(
+        "--export",
+        nargs=2,
+        metavar=("hash", "filepath"),
+        help="Export given snapshot to a binary snapshot (.bin) or register map (.json)",
+    )
+    args = parser.parse_args(argv)
+    from snapshots import SnapshotStore
+    store = SnapshotStore(args.store)
+    (bus, address) = (None, None)
+    if args.target:
+        (bus, address) = args.target.rsplit(":", 1)
+        address = int(address, 16) if address else None
+    if args.export:
+        (digest, path) = args.export
+        row = store.db.execute("SELECT chip FROM snapshots WHERE hash = ?", (digest,)).fetchone()
+        if row is None:
+            parser.error("unknown snapshot {}".format(digest))
+        chip = row[0]
+        image = store.get(digest)
+        if path.endswith(".bin"):
+            write_snapshot(path, chip, image)
+        else:
+            regmap = {}
+            for (first, last, name) in REGISTER_BLOCKS[chip]:
+                for addr in range (first, last+1):
+                    regmap["0x{:04X}".format(addr)] = "0x{:02X}".format(image[addr])
+            with open(path, "w") as fd:
+                fd.write(json.dumps({"RegisterMap": regmap}, sort_keys=True, indent=4))
+        return 0
+    def device (bus, address):
+        return "{}:0x{:02X}".format(bus, address) if address is not None else bus
+    if args.register:
+        report = [{
+            "device": device(b, a),
+            "time": t,
+            "old": "0x{:02X}".format(old),
+            "new": "0x{:02X}".format(new),
+        } for (b, a, t, old, new) in store.changes(int(args.register, 16), bus, address)]
+    else:
+        report = [{
+            "device": device(b, a),
+            "time": t,
+            "chip": chip,
+            "hash": digest,
+        } for (b, a, t, chip, digest) in store.history(bus, address)]
+    print(json.dumps(report, indent=2))
+    return 0
+
+def spans (addrs, gap=0):
+    """ Groups addresses into sorted (first, last) spans,
+    spans separated by up to `gap` addresses are merged """
+    result = []
+    for addr in sorted(addrs):
+        if len(result) > 0 and addr - result[-1][1] - 1 <= gap:
+            result[-1][1] = addr
+        else:
+            result.append([addr, addr])
+    return [tuple(span) for span in result]
+
+def read_state (dev, addrs):
+    """ Burst reads given registers from the device, never from
+    a shadow cache, returns ({addr: value}, transactions) """
+    state = {}
+    transactions = 0
+    for (first, last) in spans(addrs, gap=DIFF_GAP):
+        data = dev.refresh(first, last-first+1)
+        transactions += -(-len(data) // dev.transport.max_read)
+        for i in range (len(data)):
+            state[first+i] = data[i]
+    return (state, transactions)
+
+def load_diff (dev, image, state):
+    """ Writes the bytes of `image` that differ from current `state`
+    as coalesced bursts, returns (bytes written, transactions) """
+    w = BurstWriter(dev)
+    prev = None
+    for addr in sorted(a for a in image if image[a] != state.get(a)):
+        if prev is not None and addr - prev - 1 <= DIFF_GAP:
+            gap = range (prev+1, addr)
+            if all(a in image for a in gap):
+                for a in gap:
+                    w.write(a, image[a])
+        w.write(addr, image[addr])
+        prev = addr
+    runs = w.runs()
+    w.flush()
+    size = sum(len(data) for (addr, data) in runs)
+    transactions = sum(-(-len(data) // dev.transport.max_write) for (addr, data) in runs)
+    return (size, transactions)
+
+def sections (runs):
+    """ Groups sorted plan runs into functional sections,
+    one per register block: list of (block name, runs) """
+    out = []
+    for (addr, data) in runs:
+        name = register_block(addr)
+        if len(out) > 0 and out[-1][0] == name:
+            out[-1][1].append((addr, data))
+        else:
+            out.append((name, [(addr, data)]))
+    return out
+
+def verify_section (dev, section):
+    """ Reads back the registers written by given section runs
+    (bursts) from the device, never from a shadow cache.
+    Returns the (addr, written, read, mask) mismatches """
+    written = {}
+    for (addr, data) in section:
+        for i in range (len(data)):
+            written[addr+i] = data[i]
+    mismatches = []
+    for (first, last) in spans(written, gap=DIFF_GAP):
+        data = dev.refresh(first, last-first+1)
+        for i in range (len(data)):
+            addr = first + i
+            if addr not in written:
+                continue
+            mask = VERIFY_MASKS.get(addr, 0xFF)
+            if (data[i] ^ written[addr]) & mask:
+                mismatches.append((addr, written[addr], data[i], mask))
+    return mismatches
+
+def checkpoint_path (path):
+    """ Default checkpoint of given register map: <path>.ckpt,
+    or a file of the temporary directory when the register map
+    lives in a read only location """
+    if os.access(os.path.dirname(os.path.abspath(path)) or ".", os.W_OK):
+        return path + ".ckpt"
+    digest = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), "ad9548-{}.ckpt".format(digest))
+
+def load_sections (dev, runs, checkpoint, resume=False, progress=None, verify=False):
+    """ Writes plan runs section by section. The last written section
+    is recorded into the checkpoint file, which is removed once
+    the load completed (I/O update included).
+    checkpoint: [str] checkpoint file, None disables checkpointing.
+        The load carries on without checkpoint when it cannot be written,
+    resume: [bool] skip sections recorded by a previous, interrupted
+        load of the same register map,
+    progress: optional callback(bytes written),
+    verify: [bool] read back each section right after writing it.
+        Buffered registers are read back from the staged bank (0x0004),
+        so verification does not wait for the final I/O update.
+    Returns (number of sections skipped, verification mismatches) """
+    digest = hashlib.sha256(b"".join(PLAN_RUN.pack(addr, len(data)) + data for (addr, data) in runs)).hexdigest()
+    done = 0
+    if resume and checkpoint is not None and os.path.exists(checkpoint):
+        with open(checkpoint) as fd:
+            state = json.load(fd)
+        if state["sha256"] == digest:
+            done = state["sections"]
+    mismatches = []
+    if verify:
+        readback = dev.read_data(0x0004)
+        dev.write_data(0x0004, readback | 0x01) # read staged registers
+    for (i, (name, section)) in enumerate(sections(runs)):
+        if i < done:
+            continue
+        for (addr, data) in section:
+            dev.write_block(addr, data) # burst write
+            if progress is not None:
+                progress(len(data))
+            if verify and addr <= 0x0004 < addr+len(data):
+                readback = data[0x0004-addr]
+                dev.write_data(0x0004, readback | 0x01)
+        if verify:
+            mismatches += verify_section(dev, section)
+        if checkpoint is None:
+            continue
+        tmp = checkpoint + ".tmp"
+        try:
+            with open(tmp, "w") as fd:
+                json.dump({"sha256": digest, "sections": i+1, "last": name}, fd)
+            os.replace(tmp, checkpoint)
+        except OSError as e: # carry on without checkpoint
+            sys.stderr.write("checkpoint disabled: {}\n".format(e))
+            checkpoint = None
+    if verify:
+        dev.write_data(0x0004, readback & 0xFE)
+    dev.io_update()
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.unlink(checkpoint)
+    return (done, mismatches)
 
 def progress_bar (progress, width=100):
     """ displays progress bar,
@@ -30,18 +421,14 @@ def progress_bar (progress, width=100):
     sys.stdout.flush()
 
 def main (argv):
-    parser = argparse.ArgumentParser(description="Load /dump a profile into/from AD9548 chipset")
-    parser.add_argument(
-        "bus", 
-        metavar="bus", 
-        type=int, 
-        default=0, 
-        help="I2C bus (int)")
-    parser.add_argument(
-        "address", 
-        metavar="address", 
-        type=str,
-        help="I2C slave address (hex)")
+    if len(argv) > 0 and argv[0] == "diff":
+        return diff_main(argv[1:])
+    if len(argv) > 0 and argv[0] == "history":
+        return history_main(argv[1:])
+    parser = argparse.ArgumentParser(description="Load /dump a profile into/from AD9548 chipset",
+        epilog="""regmap.py diff A B [C..] compares register snapshots, see regmap.py diff -h.
+        regmap.py history STORE queries a snapshot store, see regmap.py history -h""")
+    add_device_args(parser)
     parser.add_argument(
         "--load", 
         metavar="filepath",
@@ -51,7 +438,13 @@ def main (argv):
         "--dump", 
         metavar="filepath", 
         type=str, 
-        help="Dump current profile")
+        help="Dump current profile. *.bin files are stored as binary snapshots")
+    parser.add_argument(
+        "--store",
+        metavar="directory",
+        type=str,
+        help="""Record the dumped image into given snapshot store
+        (deduplicated, delta compressed and indexed), --dump is then optional""")
     parser.add_argument(
         "--chip", 
         metavar="{}".format(str(KNOWN_DEVICES)),
@@ -60,6 +453,43 @@ def main (argv):
         default=KNOWN_DEVICES[0],
         help="Accurately describe the chip when --dumping a profile"
     )
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        help="""--load: only write registers that differ from the device state,
+        read in bursts. Read only registers are skipped""",
+    )
+    parser.add_argument(
+        "--snapshot",
+        metavar="filepath",
+        type=str,
+        help="""--load --diff: use given register map as device state instead
+        of reading it. Created when missing, updated after each load""",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        metavar="filepath",
+        type=str,
+        help="""--load: checkpoint file, recording the last register block
+        written. Defaults to <load>.ckpt, removed once the load completed""",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="--load: resume an interrupted load from its checkpoint",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="""--load: read back written registers in bursts, section per section,
+        report mismatches (exit code 1). Self clearing bits are not verified""",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="Retries per bus transaction, with exponential backoff (1ms to 100ms)",
+    )
     parser.add_argument(
         "--quiet",
         default=False,
@@ -67,29 +497,89 @@ def main (argv):
         help="Disable progress bar",
     )
     args = parser.parse_args(argv)
+    if args.diff and args.verify:
+        parser.error("--verify is not supported with --diff")
+    if args.diff and (args.resume or args.checkpoint):
+        parser.error("--resume and --checkpoint are not supported with --diff, which only writes what differs")
     # open device
-    dev = AD9548(args.bus, int(args.address,16))
+    dev = open_device(args)
+    if args.retries > 0:
+        dev.transport = RetryTransport(dev.transport, retries=args.retries)
 
     progress = 0
-    update_perc = 5
 
     if args.load:
-        with open(args.load, encoding="utf-8-sig") as f:
-            data = json.load(f)
-            regmap = data["RegisterMap"]
-            N = len(regmap)
-            for addr in regmap:
-                value = int(regmap[addr], 16) & 0xFF # 1 byte from hex()
-                # 2 address bytes
-                _addr = int(addr, 16)
-                dev.write_data(_addr, value)
-                if not args.quiet:
-                    progress += 100 / N
-                    if int(progress) % update_perc:
-                        progress_bar(int(progress),width=50)
+        runs = load_plan(args.load)
+
+    if args.load and args.diff:
+        image = {}
+        for (addr, data) in runs:
+            for i in range (len(data)):
+                image[addr+i] = data[i]
+        if args.snapshot and os.path.exists(args.snapshot):
+            state = read_regmap(args.snapshot)
+            reads = 0
+        else:
+            (state, reads) = read_state(dev, image)
+        (size, writes) = load_diff(dev, image, state)
+        if size > 0:
             dev.io_update()
+            writes += 1
+        if args.snapshot:
+            state.update(image)
+            struct = {"RegisterMap": {}}
+            for addr in sorted(state):
+                struct["RegisterMap"]["0x{:04X}".format(addr)] = "0x{:02X}".format(state[addr])
+            with open(args.snapshot, "w") as fd:
+                fd.write(json.dumps(struct, sort_keys=True, indent=4))
+        # versus a full load: burst write every run + I/O update
+        full = sum(-(-len(data) // dev.transport.max_write) for (addr, data) in runs) + 1
+        print("diff: {} bytes written in {} transactions, saved {} bytes and {} transactions".format(
+            size, reads + writes, len(image) - size, full - reads - writes))
 
-    if args.dump:
+    elif args.load:
+        N = sum(len(data) for (addr, data) in runs)
+        def show (size):
+            nonlocal progress
+            if not args.quiet:
+                progress += 100 * size / N
+                progress_bar(int(progress),width=50)
+        (skipped, mismatches) = load_sections(dev, runs,
+            args.checkpoint or checkpoint_path(args.load), args.resume, show, args.verify)
+        if not args.quiet:
+            print("")
+        for (addr, written, read, mask) in mismatches:
+            print("verify: 0x{:04X} ({}): wrote 0x{:02X}, read 0x{:02X}, mask 0x{:02X}".format(
+                addr, register_block(addr, args.chip), written, read, mask))
+        if len(mismatches) > 0:
+            return 1
+
+    if args.dump or args.store:
+        image = bytearray(REGMAP_SIZE)
+        blocks = REGISTER_BLOCKS[args.chip]
+        N = sum(last - first + 1 for (first, last, name) in blocks)
+        for (first, last, name) in blocks: # reserved holes are skipped
+            size = last - first + 1
+            image[first:last+1] = bytes(dev.read_block(first, size)) # burst read
+            if not args.quiet:
+                progress += 100 * size / N
+                progress_bar(int(progress),width=50)
+        if args.store:
+            from snapshots import SnapshotStore
+            store = SnapshotStore(args.store)
+            if args.sim is not None:
+                (bus, address) = ("sim", None)
+            elif args.spi is not None:
+                (bus, address) = (args.spi, None)
+            else:
+                (bus, address) = (args.bus, int(args.address, 16))
+            store.put(bus, address, args.chip, image)
+            store.close()
+        if not args.dump:
+            return
+        if args.dump.endswith(".bin"):
+            write_snapshot(args.dump, args.chip, image)
+            return
         # create a json struct
         struct = {}
         struct[args.chip] = {}
@@ -102,17 +592,12 @@ def main (argv):
         struct["wizard"] = {} 
         struct["wizard"]["version"] = "1.0.0.0"
         struct["RegisterMap"] = {}
-        N = REGMAP[1]+1
-        for i in range (REGMAP[0],N):
-            data = dev.read_data(i) # read 1 byte
-            struct["RegisterMap"]["0x{:04X}".format(i)] = "0x{:02X}".format(data)
-            if not args.quiet:
-                progress += 100 / N
-                if int(progress) % update_perc:
-                    progress_bar(int(progress),width=50)
+        for (first, last, name) in blocks:
+            for addr in range (first, last+1):
+                struct["RegisterMap"]["0x{:04X}".format(addr)] = "0x{:02X}".format(image[addr])
         struct = json.dumps(struct, sort_keys=True, indent=4)
         with open(args.dump, "w") as fd:
             fd.write(struct)
 
 if __name__ == "__main__":
-    main(sys.argv[1:])
+    sys.exit(main(sys.argv[1:]))
@@ -9,16 +9,7 @@ import argparse
 from ad9548 import *
 def main (argv):
     parser = argparse.ArgumentParser(description="AD9548 reset tool")
-    parser.add_argument(
-        "bus",
-        type=int,
-        help="I2C bus (int)",
-    )
-    parser.add_argument(
-        "address",
-        type=str,
-        help="I2C slv address (hex)",
-    )
+    add_device_args(parser)
     flags = [
         ('soft', 'Performs a soft reset but maintains current registers value'),
         ('lf',   'Clears digital loop filter'),
@@ -36,28 +27,29 @@ def main (argv):
         )
     args = parser.parse_args(argv)
     # open device
-    dev = AD9548(args.bus, int(args.address,16)) 
+    dev = open_device(args)
     if args.soft:
         reg = dev.read_data(0x0A00)
         dev.write_data(0x0000, reg | 0x01 | 0x80)
         dev.write_data(0x0000, reg)
+    # 0x0A03 is self clearing: all requested
+    # reset functions go out in a single write
+    mask = 0x00
     if args.watchdog:
-        reg = dev.read_data(0x0A03)
-        dev.write_data(0x0A03, reg | 0x01)
+        mask |= 0x01
     if args.lf:
-        reg = dev.read_data(0x0A03)
-        dev.write_data(0x0A03, reg | 0x40)
+        mask |= 0x40
     if args.cci:
-        reg = dev.read_data(0x0A03)
-        dev.write_data(0x0A03, reg | 0x20)
+        mask |= 0x20
     if args.phase:
-        reg = dev.read_data(0x0A03)
-        dev.write_data(0x0A03, reg | 0x10)
+        mask |= 0x10
     if args.autosync:
-        reg = dev.read_data(0x0A03)
-        dev.write_data(0x0A03, reg | 0x08)
+        mask |= 0x08
     if args.history:
+        mask |= 0x04
+    if mask:
         reg = dev.read_data(0x0A03)
-        dev.write_data(0x0A03, reg | 0x04)
+        dev.write_data(0x0A03, reg | mask)
+        dev.io_update()
 if __name__ == "__main__":
     main(sys.argv[1:])
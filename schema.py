@@ -0,0 +1,361 @@
+#################################################################
+# Guillaume W. Bres, 2022          <guillaume.bressaix@gmail.com>
+#################################################################
+# schema.py: AD9548,47 registers and bitfields description,
+# with the decoder and encoder the tools are built on
+#################################################################
+import math
+from collections import namedtuple
+from ad9548 import REGMAP_SIZE, PROFILE_BASES
+
+# name: dotted path of the field in decoded dicts ("sysclk.locked")
+# addr: address of the least significant byte (device is little endian)
+# mask: field mask, over the `width` bytes little endian integer
+# width: number of bytes the field spans
+# labels: None (integer), bool, {raw value: label} enum
+#         (raw values without label, reserved ones, decode as integers),
+#         or one of the Scale, Period, Pow2 and hex conversions
+# access: "rw", "ro" read only or "sc" self clearing
+# volatile: [bool] content changes without being written
+Field = namedtuple("Field", ["name", "addr", "mask", "width", "labels", "access", "volatile"])
+Field.__new__.__defaults__ = (0xFF, 1, None, "rw", False)
+
+# value = raw * factor
+Scale = namedtuple("Scale", ["factor"])
+# value = 1 / (raw * unit): frequency from a period
+Period = namedtuple("Period", ["unit"])
+# value = 2 ** raw
+Pow2 = namedtuple("Pow2", [])
+
+# bytes on the wire to start a read transaction:
+# slave address (W) + 2 register address bytes + slave address (R)
+READ_OVERHEAD = 4
+
+ENABLED = {0: 'disabled', 1: 'enabled'}
+DISABLED = {0: 'enabled', 1: 'disabled'}
+AVAILABLE = {0: 'unavailable', 1: 'available'}
+NORMAL = {0: 'normal', 1: 'inverted'}
+REFERENCES = {0: 'A', 1: 'AA', 2: 'B', 3: 'BB', 4: 'C', 5: 'CC', 6: 'D', 7: 'DD'}
+REF_NAMES = ['a', 'aa', 'b', 'bb', 'c', 'cc', 'd', 'dd']
+
+def status (name, addr, mask=0xFF, width=1, labels=bool):
+    """ Read only, volatile status field """
+    return Field(name, addr, mask, width, labels, "ro", True)
+
+# IRQ events, as reported by the IRQ status registers (0x0D02-0x0D09).
+# Each IRQ status register has its mask register (0x0209-0x0210)
+# and its clearing register (0x0A04-0x0A0B), same bit layout
+IRQ_STATUS = 0x0D02
+IRQ_MASK = 0x0209
+IRQ_CLEAR = 0x0A04
+IRQ_EVENTS = [
+    status("sysclk.unlocked", 0x0D02, 0x20),
+    status("sysclk.locked", 0x0D02, 0x10),
+    status("sysclk.calibration.done", 0x0D02, 0x02),
+    status("sysclk.calibration.started", 0x0D02, 0x01),
+    status("distrib.sync", 0x0D03, 0x08),
+    status("watchdog.expired", 0x0D03, 0x04),
+    status("eeprom.fault", 0x0D03, 0x02),
+    status("eeprom.complete", 0x0D03, 0x01),
+    status("dpll.switching-ref", 0x0D04, 0x80),
+    status("dpll.closed-loop", 0x0D04, 0x40),
+    status("dpll.free-run", 0x0D04, 0x20),
+    status("dpll.holdover", 0x0D04, 0x10),
+    status("dpll.freq.unlocked", 0x0D04, 0x08),
+    status("dpll.freq.locked", 0x0D04, 0x04),
+    status("dpll.phase.unlocked", 0x0D04, 0x02),
+    status("dpll.phase.locked", 0x0D04, 0x01),
+    status("dpll-limits.history-updated", 0x0D05, 0x10),
+    status("dpll-limits.freq-unclamped", 0x0D05, 0x08),
+    status("dpll-limits.freq-clamped", 0x0D05, 0x04),
+    status("dpll-limits.slew-unlimited", 0x0D05, 0x02),
+    status("dpll-limits.slew-limited", 0x0D05, 0x01),
+]
+for (i, c) in enumerate(['a', 'b', 'c', 'd']):
+    for (name, bit) in [('new-profile', 3), ('validated', 2), ('fault-cleared', 1), ('fault', 0)]:
+        IRQ_EVENTS.append(status("ref-{}{}.{}".format(c, c, name), 0x0D06+i, 0x10 << bit))
+        IRQ_EVENTS.append(status("ref-{}.{}".format(c, name), 0x0D06+i, 0x01 << bit))
+
+# status.py sections
+STATUS = {
+    "info": [
+        Field("info.rev", 0x0002, labels=hex, access="ro"),
+        Field("info.id", 0x0003, labels=hex, access="ro"),
+    ],
+    "serial": [
+        Field("serial.spi.unidirectionnal", 0x0000, 0x80, labels=bool),
+        Field("serial.spi.lsbf", 0x0000, 0x40, labels=bool),
+        Field("serial.spi.long", 0x0000, 0x20, labels=bool),
+        Field("serial.readback.registered", 0x0004, 0x01, labels=bool),
+        status("serial.readback.fault-detected", 0x0D00, 0x04),
+        status("serial.readback.loading", 0x0D00, 0x02),
+        status("serial.readback.saving", 0x0D00, 0x01),
+    ],
+    "sysclk": [
+        Field("sysclk.loop-filter", 0x0100, 0x80, labels={0: 'internal', 1: 'external'}),
+        Field("sysclk.charge-pump", 0x0100, 0x40),
+        Field("sysclk.charge-pump-current", 0x0100, 0x38, labels={
+            0: '125uA', 1: '250uA', 2: '375uA', 3: '500uA',
+            4: '625uA', 5: '750uA', 6: '875uA', 7: '1mA'}),
+        Field("sysclk.lock-detect-timer", 0x0100, 0x04, labels=DISABLED),
+        Field("sysclk.lock-detect-depth", 0x0100, 0x03, labels={0: 128, 1: 256, 2: 512, 3: 1024}),
+        Field("sysclk.fb-n-divider", 0x0101),
+        Field("sysclk.m-div-reset", 0x0102, 0x40, labels=bool),
+        Field("sysclk.m-div", 0x0102, 0x30, labels=Pow2()),
+        Field("sysclk.freq-doubler", 0x0102, 0x08, labels=ENABLED),
+        Field("sysclk.pll", 0x0102, 0x04, labels=ENABLED),
+        Field("sysclk.source", 0x0102, 0x03, labels={
+            0: 'crystal', 1: 'direct low freq', 2: 'direct high freq', 3: 'rx power down'}),
+        Field("sysclk.freq", 0x0103, 0x0FFFFF, 3, labels=Period(1E-15)), # fs period
+        Field("sysclk.stability", 0x0106, 0x0FFFFF, 3, labels=Scale(1E-3)), # ms
+        status("sysclk.stable", 0x0D01, 0x10),
+        status("sysclk.calibrating", 0x0D01, 0x02),
+        status("sysclk.locked", 0x0D01, 0x01),
+    ],
+    "mx-pins": [
+        Field("mx-pin.m{}.{}".format(i, name), 0x0200+i, mask)
+            for i in range (8) for (name, mask) in [('output', 0x80), ('function', 0x7F)]
+    ],
+    "dpll": [
+        status("dpll.offset-slew-limiting", 0x0D0A, 0x80),
+        status("dpll.phase-build-out", 0x0D0A, 0x40),
+        status("dpll.freq-locked", 0x0D0A, 0x20),
+        status("dpll.phase-locked", 0x0D0A, 0x10),
+        status("dpll.loop-switching", 0x0D0A, 0x08),
+        status("dpll.holdover", 0x0D0A, 0x04),
+        status("dpll.active", 0x0D0A, 0x02),
+        status("dpll.free-running", 0x0D0A, 0x01),
+        status("dpll.freq-clamped", 0x0D0B, 0x80),
+        status("dpll.history", 0x0D0B, 0x40, labels=AVAILABLE),
+        status("dpll.active-ref-priority", 0x0D0B, 0x38, labels=None),
+        status("dpll.active-ref", 0x0D0B, 0x07, labels=REFERENCES),
+        Field("dpll.forced-holdover", 0x0A01, 0x40, labels=bool),
+        Field("dpll.forced-freerun", 0x0A01, 0x20, labels=bool),
+    ],
+    "ref": [
+        status("ref.ref-{}.{}".format(c, name), 0x0D0C+i, mask, labels=labels)
+            for (i, c) in enumerate(REF_NAMES)
+            for (name, mask, labels) in [
+                ('profile-selected', 0x80, bool),
+                ('selected-profile', 0x70, None),
+                ('valid', 0x08, bool),
+                ('fault', 0x04, bool),
+                ('fast', 0x02, bool),
+                ('slow', 0x01, bool),
+            ]
+    ] + [
+        Field("ref.switching.select-mode", 0x0A01, 0x18, labels={
+            0: 'automatic', 1: 'fallback', 2: 'holdover', 3: 'manual'}),
+        Field("ref.switching.ref-selection", 0x0A01, 0x07, labels={
+            i: 'REF{}'.format(r) for (i, r) in REFERENCES.items()}),
+    ],
+    "watchdog": [
+        Field("watchdog.timer", 0x0211, 0xFFFF, 2), # ms, 0: disabled
+        status("watchdog.expired", 0x0D03, 0x04),
+    ],
+    "tuning": [
+        status("tuning", 0x0D14, 0xFFFFFFFFFFFF, 6, labels=None),
+    ],
+    "irq": [
+        Field("irq.pin", 0x0208, 0x03, labels={0: 'nmos', 1: 'pmos', 2: 'cmos-high', 3: 'cmos-low'}),
+    ] + [f._replace(name="irq." + f.name) for f in IRQ_EVENTS],
+    "eeprom": [
+        Field("eeprom.rate", 0x0E00, 0x02, labels={0: '400kHz', 1: '200kHz'}),
+        Field("eeprom.write-protection", 0x0E00, 0x01, labels=DISABLED),
+        Field("eeprom.download-condition", 0x0E01, 0x1F),
+        Field("eeprom.save-to", 0x0E02, 0x01, labels=bool, access="sc"),
+        Field("eeprom.load-from", 0x0E03, 0x02, labels=bool, access="sc"),
+    ],
+}
+
+# Profile #0 fields, other profiles are
+# described at offset PROFILE_BASES[n] - PROFILE_BASES[0]
+PROFILE = [
+    Field("selection-priority", 0x0600, 0x07),
+    Field("promoted-priority", 0x0600, 0x38),
+    Field("scaling", 0x0600, 0x80, labels={0: 'pico', 1: 'nano'}),
+    Field("freq", 0x0601, 0x03FFFFFFFFFFFF, 7, labels=Period(1E-15)), # fs period
+    Field("tolerance.inner", 0x0608, 0x0FFFFF, 3),
+    Field("tolerance.outter", 0x060B, 0x0FFFFF, 3),
+    Field("validation", 0x060E, 0xFFFF, 2, labels=Scale(1E-3)), # ms
+    Field("redetect", 0x0610, 0xFFFF, 2, labels=Scale(1E-3)), # ms
+    Field("filter.a0", 0x0612, 0xFFFF, 2),
+    Field("filter.a1", 0x0614, 0x3F),
+    Field("filter.a2", 0x0614, 0x01C0, 2),
+    Field("filter.a3", 0x061D, 0xF0),
+    Field("filter.b0", 0x0615, 0x03FFFE, 3),
+    Field("filter.b1", 0x0617, 0x7C),
+    Field("filter.g0", 0x0618, 0x01FFFF, 3),
+    Field("filter.g1", 0x061A, 0x3E),
+    Field("filter.d0", 0x061B, 0x7FFF, 2),
+    Field("filter.d1", 0x061C, 0x0F80, 2),
+    Field("r-div", 0x061E, 0x1FFFFFFF, 4),
+    Field("s-div", 0x0622, 0x1FFFFFFF, 4),
+    Field("fractionnal-div.V", 0x0626, 0x03FF, 2),
+    Field("fractionnal-div.U", 0x0627, 0x1FF0, 2),
+    Field("lock.phase.threshold", 0x0629, 0xFFFF, 2),
+    Field("lock.phase.fill", 0x062B),
+    Field("lock.phase.drain", 0x062C),
+    Field("lock.freq.threshold", 0x062D, 0xFFFFFF, 3, labels=Scale(1E-6)), # ps
+    Field("lock.freq.fill", 0x0630),
+    Field("lock.freq.drain", 0x0631),
+]
+
+# Clock distribution
+DISTRIB = [
+    Field("sync-source", 0x0402, 0x30, labels={0: 'direct', 1: 'active', 2: 'dpll-feedback'}),
+    Field("autosync", 0x0403, 0x03, labels={0: 'disabled', 1: 'dpll-freq-lock', 2: 'dpll-phase-lock'}),
+] + [
+    Field("out{}.{}".format(i, name), 0x0404+i, mask, labels=labels)
+        for i in range (4)
+        for (name, mask, labels) in [
+            ('cmos-phase', 0x20, NORMAL),
+            ('polarity', 0x10, NORMAL),
+            ('strength', 0x08, {0: 'low', 1: 'normal'}),
+            ('mode', 0x07, {0: 'cmos', 1: 'cmos+', 2: 'trist+', 3: 'trist', 4: 'lvds', 5: 'lvpecl'}),
+        ]
+] + [
+    Field("q{}.divider".format(i), 0x0408+4*i, 0x3FFFFFFF, 4) for i in range (4)
+]
+
+def profile_offset (n):
+    """ Address offset of profile #n fields """
+    return PROFILE_BASES[n] - PROFILE_BASES[0]
+
+def field (fields, name):
+    """ Returns the field of given name """
+    for f in fields:
+        if f.name == name:
+            return f
+    raise KeyError(name)
+
+def shift (mask):
+    """ Position of the mask least significant bit """
+    return (mask & -mask).bit_length() - 1
+
+def addresses (fields, offset=0):
+    """ Returns the sorted addresses spanned by given fields """
+    return sorted(set(f.addr+offset+i for f in fields for i in range (f.width)))
+
+def ranges (fields, offset=0, gap=0):
+    """ Returns the (first, last) contiguous address ranges spanned
+    by given fields, ranges separated by up to `gap` bytes are merged """
+    out = []
+    for addr in addresses(fields, offset):
+        if len(out) > 0 and addr - out[-1][1] - 1 <= gap:
+            out[-1][1] = addr
+        else:
+            out.append([addr, addr])
+    return [tuple(r) for r in out]
+
+def plan (fields, offset=0, overhead=READ_OVERHEAD):
+    """ Read plan of given fields: their address ranges, merged
+    whenever reading the bytes in between costs no more than
+    the `overhead` of another read transaction """
+    return ranges(fields, offset, gap=overhead)
+
+def fetch (dev, fields, offset=0, image=None, gap=0):
+    """ Burst reads the contiguous ranges spanned by given fields
+    into a register image (bytearray of REGMAP_SIZE), returned.
+    Ranges separated by up to `gap` bytes are read at once """
+    if image is None:
+        image = bytearray(REGMAP_SIZE)
+    for (first, last) in ranges(fields, offset, gap):
+        image[first:last+1] = bytes(dev.read_block(first, last-first+1))
+    return image
+
+def raw (f, image, offset=0):
+    """ Raw field value, from a register image """
+    addr = f.addr + offset
+    v = int.from_bytes(bytes(image[addr:addr+f.width]), "little")
+    return (v & f.mask) >> shift(f.mask)
+
+def convert (f, v):
+    """ Raw value to its decoded value """
+    labels = f.labels
+    if labels is None:
+        return v
+    if labels is bool:
+        return bool(v)
+    if labels is hex:
+        return hex(v)
+    if isinstance(labels, dict):
+        return labels.get(v, v) # reserved: raw value
+    if isinstance(labels, Scale):
+        return v * labels.factor
+    if isinstance(labels, Period):
+        return 1.0 / (v * labels.unit) if v else 0.0
+    if isinstance(labels, Pow2):
+        return int(pow(2, v))
+    raise TypeError("unknown field conversion {}".format(labels))
+
+def unconvert (f, value):
+    """ Decoded value to its raw value """
+    labels = f.labels
+    if labels is None or labels is bool:
+        return int(value)
+    if labels is hex:
+        return int(value, 16)
+    if isinstance(labels, dict):
+        for (k, v) in labels.items():
+            if v == value:
+                return k
+        if value in labels or (isinstance(value, int) and not isinstance(value, bool)):
+            return value # raw value, range checked by encode()
+        raise ValueError("{}: invalid value \"{}\"".format(f.name, value))
+    if isinstance(labels, Scale):
+        return int(round(value / labels.factor))
+    if isinstance(labels, Period):
+        return int(round(1.0 / (value * labels.unit)))
+    if isinstance(labels, Pow2):
+        return int(math.log2(value))
+    raise TypeError("unknown field conversion {}".format(labels))
+
+def decode (fields, image, offset=0, into=None):
+    """ Decodes given fields from a register image, in one pass.
+    Returns a nested dict, following the dotted field names """
+    out = {} if into is None else into
+    for f in fields:
+        keys = f.name.split(".")
+        node = out
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+        node[keys[-1]] = convert(f, raw(f, image, offset))
+    return out
+
+def changes (fields, old, new, offset=0):
+    """ Returns the (field, old value, new value) of given fields
+    that differ between two register images. Images are compared
+    range by range, then byte wise (XOR): only fields overlapping
+    changed bits are decoded """
+    if all(old[first:last+1] == new[first:last+1] for (first, last) in ranges(fields, offset)):
+        return []
+    out = []
+    for f in fields:
+        addr = f.addr + offset
+        a = bytes(old[addr:addr+f.width])
+        b = bytes(new[addr:addr+f.width])
+        if a == b:
+            continue
+        if (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")) & f.mask:
+            out.append((f, convert(f, raw(f, old, offset)), convert(f, raw(f, new, offset))))
+    return out
+
+def encode (fields, values, image, offset=0):
+    """ Encodes {field name: value} into a register image,
+    other bits are preserved. Returns the sorted touched addresses """
+    touched = set()
+    for f in fields:
+        if f.name not in values:
+            continue
+        if f.access == "ro":
+            raise ValueError("{} is read only".format(f.name))
+        v = unconvert(f, values[f.name]) << shift(f.mask)
+        if v & ~f.mask:
+            raise ValueError("{}: value {} out of range".format(f.name, values[f.name]))
+        addr = f.addr + offset
+        word = int.from_bytes(bytes(image[addr:addr+f.width]), "little")
+        word = (word & ~f.mask) | v
+        image[addr:addr+f.width] = word.to_bytes(f.width, "little")
+        touched.update(range (addr, addr+f.width))
+    return sorted(touched)
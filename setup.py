@@ -8,16 +8,26 @@ except ImportError:
 setup(name="adi-ad9548",
     scripts=[
         "ad9548.py",
+        "ad9548_async.py",
+        "ad9548d.py",
         "calib.py",
         "distrib.py",
         "dpll.py",
+        "eeprom.py",
+        "exporter.py",
+        "fleet.py",
         "irq.py",
         "mx-pin.py",
         "power-down.py",
         "profile.py",
+        "recorder.py",
         "ref-input.py",
         "regmap.py",
         "reset.py",
+        "schema.py",
+        "simulator.py",
+        "snapshots.py",
         "status.py",
+        "tuning.py",
     ],
 )
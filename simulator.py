@@ -0,0 +1,300 @@
+#################################################################
+# Guillaume W. Bres, 2022          <guillaume.bressaix@gmail.com>
+#################################################################
+# simulator.py: in-memory AD9548,47 register file,
+# to run the tools without hardware
+#################################################################
+import os
+import ctypes
+from ad9548 import REGMAP_SIZE, READ_ONLY, BUFFERED, SELF_CLEARING, I2C_MAX_BLOCK, I2C_RDWR, I2C_M_RD
+from ad9548 import EEPROM_SEQUENCE, EEPROM_IO_UPDATE, EEPROM_SAVING, EEPROM_LOADING, EEPROM_FAULT
+from ad9548 import decode_eeprom_sequence
+
+CHIP_IDS = {
+    'ad9547': 0x47,
+    'ad9548': 0x48,
+}
+
+# IRQ clearing registers (0x0A04-0x0A0B)
+# map 1:1 to IRQ status registers (0x0D02-0x0D09)
+IRQ_CLEAR = (0x0A04, 0x0A0B)
+IRQ_STATUS = 0x0D02
+# EEPROM operations remain in progress for that many
+# status (0x0D00) reads, plus one per EEPROM_POLL_BYTES bytes
+EEPROM_POLL_BYTES = 64
+
+class AD9548Sim :
+    """ AD9548/AD9547 register file model.
+    Writes to buffered registers are staged, and only
+    reach the active registers on I/O update.
+    Read only registers ignore writes, self clearing
+    registers return to 0 once their action is performed """
+    def __init__ (self, chip="ad9548", path=None):
+        """ chip: [str] simulated device, 'ad9548' or 'ad9547'
+        path: [str] optional state file, loaded when it exists
+            and updated on every write
+        """
+        self.active = bytearray(REGMAP_SIZE)
+        self.staged = bytearray(REGMAP_SIZE)
+        self.active[0x0003] = CHIP_IDS[chip]
+        # EEPROM content: list of storage sequence items,
+        # (addr, bytes) for data instructions
+        self.eeprom = []
+        self.eeprom_busy = 0
+        self.path = path
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def buffered (self, addr):
+        return BUFFERED[0] <= addr <= BUFFERED[1]
+
+    def read (self, addr, length):
+        """ Reads `length` bytes from given address, as the device does:
+        active registers, or staged ones when 0x0004 bit0 is set """
+        if addr <= 0x0D00 < addr+length and self.eeprom_busy > 0:
+            self.eeprom_busy -= 1
+            if self.eeprom_busy == 0:
+                self.active[0x0D00] &= (EEPROM_SAVING | EEPROM_LOADING) ^ 0xFF
+        if self.active[0x0004] & 0x01:
+            data = []
+            for a in range (addr, addr+length):
+                if self.buffered(a):
+                    data.append(self.staged[a])
+                else:
+                    data.append(self.active[a])
+            return data
+        return list(self.active[addr:addr+length])
+
+    def write (self, addr, data):
+        """ Writes given bytes from given address, as the device does """
+        for d in data:
+            if addr not in READ_ONLY:
+                if self.buffered(addr):
+                    self.staged[addr] = d
+                else:
+                    self.active[addr] = d
+                    if addr == 0x0005 and d & 0x01:
+                        self.io_update()
+                    elif addr == 0x0E02 and d & 0x01:
+                        self.eeprom_save()
+                    elif addr == 0x0E03 and d & 0x02:
+                        self.eeprom_load()
+            addr += 1
+        self.active[0x0005] = 0x00
+        if self.path is not None:
+            self.save(self.path)
+
+    def io_update (self):
+        """ Transfers staged registers to the active bank,
+        then performs and clears the self clearing actions """
+        self.active[BUFFERED[0]:BUFFERED[1]+1] = self.staged[BUFFERED[0]:BUFFERED[1]+1]
+        if self.active[0x0A03] & 0x02: # clear all IRQs
+            for i in range (IRQ_CLEAR[1]-IRQ_CLEAR[0]+1):
+                self.active[IRQ_STATUS+i] = 0x00
+        for i in range (IRQ_CLEAR[1]-IRQ_CLEAR[0]+1):
+            self.active[IRQ_STATUS+i] &= self.active[IRQ_CLEAR[0]+i] ^ 0xFF
+        for addr in SELF_CLEARING:
+            self.active[addr] = 0x00
+            self.staged[addr] = 0x00
+
+    def eeprom_start (self, flag, size):
+        self.active[0x0D00] |= flag
+        self.eeprom_busy = 1 + size // EEPROM_POLL_BYTES
+
+    def eeprom_save (self):
+        """ Stores the registers described by the storage sequence.
+        Faults when the EEPROM is write protected (0x0E00) """
+        self.active[0x0E02] = 0x00
+        self.active[0x0D00] &= EEPROM_FAULT ^ 0xFF
+        if not self.active[0x0E00] & 0x01:
+            self.active[0x0D00] |= EEPROM_FAULT
+            return
+        seq = self.active[EEPROM_SEQUENCE[0]:EEPROM_SEQUENCE[1]+1]
+        self.eeprom = []
+        for item in decode_eeprom_sequence(seq):
+            if isinstance(item, int):
+                self.eeprom.append(item)
+            else:
+                (first, last) = item
+                # saved values are the staged ones
+                self.eeprom.append((first, bytes(self.staged[first:last+1] if self.buffered(first) else self.active[first:last+1])))
+        self.eeprom_start(EEPROM_SAVING, sum(len(item[1]) for item in self.eeprom if not isinstance(item, int)))
+
+    def eeprom_load (self):
+        """ Replays the EEPROM content. Faults when the EEPROM is blank """
+        self.active[0x0E03] = 0x00
+        self.active[0x0D00] &= EEPROM_FAULT ^ 0xFF
+        if len(self.eeprom) == 0:
+            self.active[0x0D00] |= EEPROM_FAULT
+            return
+        for item in self.eeprom:
+            if item == EEPROM_IO_UPDATE:
+                self.io_update()
+            elif not isinstance(item, int): # other instructions are no-ops here
+                (addr, data) = item
+                for d in data:
+                    if addr not in READ_ONLY:
+                        if self.buffered(addr):
+                            self.staged[addr] = d
+                        else:
+                            self.active[addr] = d
+                    addr += 1
+        self.eeprom_start(EEPROM_LOADING, sum(len(item[1]) for item in self.eeprom if not isinstance(item, int)))
+
+    def poke (self, addr, value):
+        """ Sets a register value directly, bypassing the device rules.
+        Used to emulate status and IRQ events """
+        self.active[addr] = value & 0xFF
+        self.staged[addr] = value & 0xFF
+
+    def load (self, path):
+        """ Loads simulator state previously stored with save() """
+        with open(path, "rb") as fd:
+            state = fd.read()
+        self.active[:] = state[:REGMAP_SIZE]
+        self.staged[:] = state[REGMAP_SIZE:2*REGMAP_SIZE]
+        # pending EEPROM operations have completed since
+        self.active[0x0D00] &= (EEPROM_SAVING | EEPROM_LOADING) ^ 0xFF
+        self.eeprom = []
+        eeprom = state[2*REGMAP_SIZE:]
+        i = 0
+        while i < len(eeprom):
+            if eeprom[i] & 0x80:
+                self.eeprom.append(eeprom[i])
+                i += 1
+            else:
+                n = eeprom[i] + 1
+                addr = (eeprom[i+1]<<8) | eeprom[i+2]
+                self.eeprom.append((addr, eeprom[i+3:i+3+n]))
+                i += 3 + n
+
+    def save (self, path):
+        """ Stores simulator state (active + staged banks + EEPROM content,
+        as storage sequence instructions followed by their data) """
+        eeprom = bytearray()
+        for item in self.eeprom:
+            if isinstance(item, int):
+                eeprom.append(item)
+            else:
+                (addr, data) = item
+                eeprom += bytes([len(data)-1, (addr & 0xFF00)>>8, addr & 0xFF]) + data
+        with open(path, "wb") as fd:
+            fd.write(self.active + self.staged + eeprom)
+
+class SimTransport :
+    """ Transport to an AD9548Sim.
+    Each read() and write() accounts for one bus transaction,
+    `calls` logs (operation, address, length) of each of them """
+    def __init__ (self, sim=None, max_block=I2C_MAX_BLOCK, bus=None):
+        """ sim: [AD9548Sim] simulated device, creates one when not provided
+        max_block: [int] maximal number of bytes per burst transaction
+        bus: simulated bus identifier, transports sharing it share a bus.
+            Each simulated device sits on its own bus by default
+        """
+        if sim is None:
+            sim = AD9548Sim()
+        self.sim = sim
+        self.bus = ("sim", id(self) if bus is None else bus)
+        self.max_read = max_block
+        self.max_write = max_block
+        self.reset_stats()
+
+    def reset_stats (self):
+        self.calls = []
+        self.stats = {
+            'transactions': 0,
+            'bytes-read': 0,
+            'bytes-written': 0,
+            'wire-bytes': 0,
+        }
+
+    def read (self, addr, length):
+        self.calls.append(('read', addr, length))
+        self.stats['transactions'] += 1
+        self.stats['bytes-read'] += length
+        # I2C framing: slave addr (W) + 2 address bytes + slave addr (R) + data
+        self.stats['wire-bytes'] += 4 + length
+        return self.sim.read(addr, length)
+
+    def write (self, addr, data):
+        self.calls.append(('write', addr, len(data)))
+        self.stats['transactions'] += 1
+        self.stats['bytes-written'] += len(data)
+        # I2C framing: slave addr (W) + 2 address bytes + data
+        self.stats['wire-bytes'] += 3 + len(data)
+        self.sim.write(addr, data)
+
+    def wire_time (self, rate=400E3):
+        """ Returns estimated I2C bus time [s] at given SCL rate [Hz],
+        9 clock cycles per byte (data + ack) """
+        return self.stats['wire-bytes'] * 9 / rate
+
+class SimI2CBus :
+    """ I2C bus model, device side: AD9548Sim slaves and their
+    auto-incremented address pointer. Counts bus transactions
+    (start conditions) and bytes on the wire """
+    def __init__ (self, devices):
+        """ devices: [dict] {slave address: AD9548Sim} """
+        self.devices = devices
+        self.pointers = {}
+        self.transactions = 0
+        self.wire_bytes = 0
+
+    def message (self, addr, read, data):
+        """ Performs a single message. Writes set the address pointer
+        (2 first bytes) then write the data, reads return `data` bytes
+        (int, length) from the address pointer """
+        sim = self.devices[addr]
+        if read:
+            ptr = self.pointers.get(addr, 0)
+            self.pointers[addr] = ptr + data
+            self.wire_bytes += 1 + data
+            return sim.read(ptr, data)
+        ptr = (data[0]<<8) | data[1]
+        if len(data) > 2:
+            sim.write(ptr, data[2:])
+        self.pointers[addr] = ptr + len(data) - 2
+        self.wire_bytes += 1 + len(data)
+
+class SimSMBus :
+    """ python-smbus like handle to a SimI2CBus,
+    for the I2CTransport (smbus backend) """
+    def __init__ (self, bus):
+        self.bus = bus
+
+    def write_i2c_block_data (self, addr, cmd, data):
+        self.bus.transactions += 1
+        self.bus.message(addr, False, [cmd] + list(data))
+
+    def read_byte (self, addr):
+        self.bus.transactions += 1
+        return self.bus.message(addr, True, 1)[0]
+
+    def i2c_rdwr (self, *msgs):
+        """ smbus2 combined transaction """
+        self.bus.transactions += 1
+        for msg in msgs:
+            if msg.flags & I2C_M_RD:
+                data = self.bus.message(msg.addr, True, msg.len)
+                ctypes.memmove(msg.buf, bytes(data), msg.len)
+            else:
+                self.bus.message(msg.addr, False, list(msg))
+
+class SimI2CAdapter :
+    """ /dev/i2c-X ioctl() model on top of a SimI2CBus,
+    for the I2CRdwrTransport (rdwr backend) """
+    def __init__ (self, bus):
+        self.bus = bus
+
+    def ioctl (self, fd, request, arg):
+        if request != I2C_RDWR:
+            raise OSError("unsupported ioctl 0x{:04X}".format(request))
+        self.bus.transactions += 1
+        for i in range (arg.nmsgs):
+            msg = arg.msgs[i]
+            if msg.flags & I2C_M_RD:
+                data = self.bus.message(msg.addr, True, msg.len)
+                ctypes.memmove(msg.buf, bytes(data), msg.len)
+            else:
+                self.bus.message(msg.addr, False, msg.buf[:msg.len])
+        return 0
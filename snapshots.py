@@ -0,0 +1,166 @@
+#################################################################
+# Guillaume W. Bres, 2022          <guillaume.bressaix@gmail.com>
+#################################################################
+# snapshots.py: content addressed register snapshot store
+#################################################################
+import os
+import time
+import zlib
+import struct
+import sqlite3
+import hashlib
+from ad9548 import REGMAP_SIZE
+
+# Object types: full image, or delta against a base object
+OBJ_FULL = b"F"
+OBJ_DELTA = b"D"
+DELTA_RUN = struct.Struct(">HH")
+# Longest delta chain, a full image is stored past that
+MAX_DEPTH = 32
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    hash TEXT PRIMARY KEY,
+    base TEXT,
+    depth INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    bus TEXT NOT NULL,
+    address INTEGER,
+    time REAL NOT NULL,
+    chip TEXT NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_target ON snapshots (bus, address, time);
+CREATE TABLE IF NOT EXISTS changes (
+    snapshot INTEGER NOT NULL,
+    register INTEGER NOT NULL,
+    old INTEGER NOT NULL,
+    new INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_register ON changes (register, snapshot);
+"""
+
+def delta (base, image):
+    """ Encodes image as (address, length, bytes) runs
+    of the bytes differing from base image """
+    out = []
+    addr = 0
+    while addr < REGMAP_SIZE:
+        if image[addr] == base[addr]:
+            addr += 1
+            continue
+        first = addr
+        while addr < REGMAP_SIZE and image[addr] != base[addr]:
+            addr += 1
+        out.append(DELTA_RUN.pack(first, addr-first) + image[first:addr])
+    return b"".join(out)
+
+def patch (base, data):
+    """ Applies delta() runs to base image """
+    image = bytearray(base)
+    offset = 0
+    while offset < len(data):
+        (addr, length) = DELTA_RUN.unpack_from(data, offset)
+        offset += DELTA_RUN.size
+        image[addr:addr+length] = data[offset:offset+length]
+        offset += length
+    return bytes(image)
+
+class SnapshotStore :
+    """ Register snapshot history of many devices.
+    Images are content addressed (sha256): identical images are
+    stored once. A new image is stored as a delta against the
+    previous snapshot of the same device. The sqlite index records
+    snapshots per (bus, address, time) and the register changes
+    between consecutive snapshots of a device """
+    def __init__ (self, path):
+        """ path: [str] store directory, created when missing """
+        self.path = path
+        os.makedirs(os.path.join(path, "objects"), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(path, "index.db"))
+        self.db.executescript(SCHEMA)
+
+    def close (self):
+        self.db.close()
+
+    def object_path (self, digest):
+        return os.path.join(self.path, "objects", digest[:2], digest[2:])
+
+    def write_object (self, digest, kind, payload):
+        path = self.object_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fd:
+            fd.write(kind + zlib.compress(payload))
+
+    def get (self, digest):
+        """ Returns the image stored under given hash """
+        with open(self.object_path(digest), "rb") as fd:
+            raw = fd.read()
+        payload = zlib.decompress(raw[1:])
+        if raw[:1] == OBJ_FULL:
+            return payload
+        (base,) = self.db.execute("SELECT base FROM objects WHERE hash = ?", (digest,)).fetchone()
+        return patch(self.get(base), payload)
+
+    def latest (self, bus, address):
+        """ Returns (id, hash) of the last snapshot of given device, or None """
+        return self.db.execute(
+            "SELECT id, hash FROM snapshots WHERE bus = ? AND address IS ? ORDER BY time DESC LIMIT 1",
+            (str(bus), address)).fetchone()
+
+    def put (self, bus, address, chip, image, t=None):
+        """ Records a snapshot of given device,
+        bus: I2C bus number or SPI device
+        address: [int] I2C slave address, None for SPI devices
+        chip: [str] device model
+        image: [bytes] REGMAP_SIZE register image
+        t: [float] snapshot time, now by default.
+        Returns the image hash """
+        image = bytes(image)
+        t = time.time() if t is None else t
+        digest = hashlib.sha256(image).hexdigest()
+        ancestor = self.latest(bus, address)
+        base = None
+        if ancestor is not None:
+            base = self.get(ancestor[1])
+        known = self.db.execute("SELECT 1 FROM objects WHERE hash = ?", (digest,)).fetchone()
+        if known is None:
+            depth = None
+            if ancestor is not None:
+                (depth,) = self.db.execute("SELECT depth FROM objects WHERE hash = ?", (ancestor[1],)).fetchone()
+            if depth is not None and depth < MAX_DEPTH:
+                self.write_object(digest, OBJ_DELTA, delta(base, image))
+                self.db.execute("INSERT INTO objects VALUES (?, ?, ?)", (digest, ancestor[1], depth+1))
+            else:
+                self.write_object(digest, OBJ_FULL, image)
+                self.db.execute("INSERT INTO objects VALUES (?, NULL, 0)", (digest,))
+        cursor = self.db.execute("INSERT INTO snapshots (bus, address, time, chip, hash) VALUES (?, ?, ?, ?, ?)",
+            (str(bus), address, t, chip, digest))
+        if base is not None and digest != ancestor[1]:
+            self.db.executemany("INSERT INTO changes VALUES (?, ?, ?, ?)",
+                [(cursor.lastrowid, addr, base[addr], image[addr])
+                    for addr in range (REGMAP_SIZE) if base[addr] != image[addr]])
+        self.db.commit()
+        return digest
+
+    def history (self, bus=None, address=None):
+        """ Returns the recorded (bus, address, time, chip, hash) snapshots,
+        of given device or of all devices """
+        query = "SELECT bus, address, time, chip, hash FROM snapshots"
+        if bus is not None:
+            query += " WHERE bus = ? AND address IS ?"
+            return self.db.execute(query + " ORDER BY time", (str(bus), address)).fetchall()
+        return self.db.execute(query + " ORDER BY bus, address, time").fetchall()
+
+    def changes (self, register, bus=None, address=None):
+        """ Returns the (bus, address, time, old, new) changes of given register,
+        on given device or on all devices, from the index only """
+        query = """SELECT s.bus, s.address, s.time, c.old, c.new FROM changes c
+            JOIN snapshots s ON s.id = c.snapshot WHERE c.register = ?"""
+        params = (register,)
+        if bus is not None:
+            query += " AND s.bus = ? AND s.address IS ?"
+            params += (str(bus), address)
+        return self.db.execute(query + " ORDER BY s.time", params).fetchall()
@@ -5,21 +5,31 @@
 # status.py: AD9548,47 status monitoring
 #################################################################
 import sys
-import math
 import json
+import time
 import argparse
 from ad9548 import *
+from schema import STATUS, READ_OVERHEAD, plan, fetch, decode, changes
+
+def ticks (interval):
+    """ Yields every `interval` seconds. Deadlines are scheduled from
+    the start time, not from the previous tick, so the rate does not
+    drift over time. Deadlines already missed are skipped """
+    t0 = time.monotonic()
+    k = 0
+    while True:
+        deadline = t0 + k * interval
+        now = time.monotonic()
+        if now < deadline:
+            time.sleep(deadline - now)
+        else:
+            k = int((now - t0) / interval)
+        yield
+        k += 1
 
 def main (argv):
     parser = argparse.ArgumentParser(description="AD9547/48 status reporting")
-    parser.add_argument(
-        "bus",
-        help="I2C bus",
-    )
-    parser.add_argument(
-        "address",
-        help="I2C slv address",
-    )
+    add_device_args(parser)
     flags = [
         ("info",    "Device general infos (SN#, ..)"),
         ("serial",  "Serial port status (I2C/SPI)"),
@@ -30,7 +40,7 @@ def main (argv):
         ("mx-pins", "Mx programmable pins infos"),
         ("irq",     "IRQ status"),
         ("eeprom",  "EEPROM status"),
-        ("watchdog","Watchdog timer current reading"),
+        ("watchdog","Watchdog timer period and expiration event"),
     ]
     for (flag, helper) in flags:
         _helper = helper if helper is not None else "Report {} Status".format(flag.upper())
@@ -39,268 +49,93 @@ def main (argv):
             action="store_true",
             help=_helper,
         )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Report the read plan (burst reads) on stderr",
+    )
+    parser.add_argument(
+        "--watch",
+        metavar="interval",
+        type=float,
+        help="""Keep reading the requested sections every `interval` seconds,
+        one compact json line per sample, `time` being a monotonic timestamp [s]""",
+    )
+    parser.add_argument(
+        "--changes",
+        action="store_true",
+        help="""When watching, only report the fields that changed since the previous
+        sample, one {time, field, old, new} json line per change""",
+    )
+    parser.add_argument(
+        "--keyframe",
+        metavar="period",
+        type=float,
+        default=60.0,
+        help="""When watching changes, report a full sample (`keyframe`: true)
+        every `period` seconds, for consumers to resync [s]""",
+    )
+    parser.add_argument(
+        "--count",
+        type=int,
+        help="Stop watching after that many samples",
+    )
     args = parser.parse_args(argv)
+    if args.changes and args.watch is None:
+        parser.error("--changes requires --watch")
     # open device
-    dev = AD9548(args.bus, int(args.address,16))
-
-    enabled = {
-        0: 'disabled',
-        1: 'enabled',
-    }
-    disabled = {
-        0: 'enabled',
-        1: 'disabled',
-    }
-    available = {
-        0: 'unavailable',
-        1: 'available',
-    }
-    loop_filter_ext = {
-        0: 'internal',
-        1: 'external',
-    }
-    auto = {
-        0: 'auto',
-        1: 'manual',
-    }
-    cpump_currents = {
-        '125uA': 0,
-        '250uA': 1,
-        '375uA': 2,
-        '500uA': 3,
-        '625uA': 4,
-        '750uA': 5,
-        '875uA': 6,
-        '1mA': 7,
-    }
-    lock_det_depths = {
-        0: 128,
-        1: 256,
-        2: 512,
-        3: 1024,
-    }
-    sysclk_sources = {
-        0: 'crystal',
-        1: 'direct low freq',
-        2: 'direct high freq',
-        3: 'rx power down',
-    }
-    references = {
-        0: 'A',
-        1: 'AA',
-        2: 'B',
-        3: 'BB',
-        4: 'C',
-        5: 'CC',
-        6: 'D',
-        7: 'DD',
-    }
-
-    status = {}
-    if args.info:
-        status['info'] = {}
-        status['info']['rev'] = hex(dev.read_data(0x0002))
-        status['info']['id']  = hex(dev.read_data(0x0003))
-    
-    if args.serial:
-        status['serial'] = {}
-        status['serial']['spi'] = {}
-        r = dev.read_data(0x0000)
-        status['serial']['spi']['unidirectionnal'] = bool((r&0x80)>>7)
-        status['serial']['spi']['lsbf'] = bool((r&0x40)>>6)
-        status['serial']['spi']['long'] = bool((r&0x20)>>5)
-        status['serial']['readback'] = {}
-        r = dev.read_data(0x0004)
-        status['serial']['readback']['registered'] = bool(r&0x01)
-        r = dev.read_data(0x0D00)
-        status['serial']['readback']['fault-detected'] = bool((r&0x04)>>2)
-        status['serial']['readback']['loading'] = bool((r&0x02)>>1)
-        status['serial']['readback']['saving'] = bool(r&0x01)
-    
-    if args.sysclk:
-        status['sysclk'] = {}
-        r = dev.read_data(0x0100)
-        status['sysclk']['loop-filter'] = loop_filter_ext((r & 0x80)>>7)
-        status['sysclk']['charge-pump'] = (r & 0x40)>>6
-        status['sysclk']['charge-pump-current'] = cpump_currents[(r & 0x38)>>3]
-        status['sysclk']['lock-detect-timer'] = disabled[(r & 0x04)>>2]
-        status['sysclk']['lock-detect-depth'] = lock_det_depths[r & 0x03]
-        status['sysclk']['fb-n-divider'] = dev.read_data(0x0101)
-
-        r = dev.read_data(0x0102)
-        status['sysclk']['m-div-reset'] = bool((r & 0x40)>>6) 
-        status['sysclk']['m-div'] = int(pow(2,(r & 0x30)>>4))
-        status['sysclk']['freq-doubler'] = enabled[(r & 0x08)>>3]
-        status['sysclk']['pll'] = enabled[(r & 0x04)>>2]
-        status['sysclk']['source'] = sysclk_sources[r & 0x03]
-         
-        period = dev.read_data(0x0103)
-        period += dev.read_data(0x0104) << 8
-        period += (dev.read_data(0x0105) & 0x0F) << 16
-        status['sysclk']['freq'] = 1.0/(period*pow(10,-15)) # fs
-
-        period = dev.read_data(0x0106)
-        period += dev.read_data(0x0107) << 8
-        period += (dev.read_data(0x0108) & 0x0F) << 16
-        status['sysclk']['stability'] = period*pow(10,-3) # ms
-
-        r = dev.read_data(0x0D01)
-        status['sysclk']['stable'] = bool((r&0x10)>>4)
-        status['sysclk']['calibrating'] = bool((r&0x02)>>1)
-        status['sysclk']['locked'] = bool(r&0x01)
-
-    if args.mx_pins: 
-        base = 0x0200
-        status['mx-pin'] = {}
-        for i in range (8):
-            data = dev.read_data(base) 
-            status['mx-pin']['m{}'.format(i)] = {}
-            status['mx-pin']['m{}'.format(i)]['output'] = (data & 0x80)>>7
-            status['mx-pin']['m{}'.format(i)]['function'] = data & 0x7F
-            base += 1
-    
-    if args.dpll:
-        status['dpll'] = {}
-        r = dev.read_data(0x0D0A)
-        status['dpll']['offset-slew-limiting'] = bool((r & 0x80)>>7)
-        status['dpll']['phase-build-out'] = bool((r & 0x40)>>6)
-        status['dpll']['freq-locked'] = bool((r & 0x20)>>5)
-        status['dpll']['phase-locked'] = bool((r & 0x10)>>4)
-        status['dpll']['loop-switching'] = bool((r & 0x08)>>3)
-        status['dpll']['holdover'] = bool((r & 0x04)>>2)
-        status['dpll']['active'] = bool((r & 0x02)>>1)
-        status['dpll']['free-running'] = bool((r & 0x01)>>0)
-        r = dev.read_data(0x0D0B)
-        status['dpll']['freq-clamped'] = bool((r & 0x80)>>7)
-        status['dpll']['history'] = available[(r & 0x40)>>6]
-        status['dpll']['active-ref-priority'] = (r & 0x38) >> 3
-        status['dpll']['active-ref'] = references[r & 0x03]
-
-        r = dev.read_data(0x0A01)
-        status['dpll']['forced-holdover'] = bool((r & 0x40)>>6)
-        status['dpll']['forced-freerun'] = bool((r & 0x20)>>5)
-    
-    if args.ref:
-        status['ref'] = {}
-        base = 0x0D0C
-        for c in ['a','aa','b','bb','c','cc','d','dd']:
-            status['ref']['ref-{}'.format(c)] = {}
-            r = dev.read_data(base)
-            status['ref']['c']['profile-selected'] = bool((r & 0x80)>>7)
-            status['ref']['c']['selected-profile'] = (r & 0x70)>>6
-            status['ref']['c']['valid'] = bool((r & 0x08)>>3)
-            status['ref']['c']['fault'] = bool((r & 0x04)>>2)
-            status['ref']['c']['fast'] = bool((r & 0x02)>>1)
-            status['ref']['c']['slow'] = bool((r & 0x01)>>0)
-            base += 1
-
-        status['ref']['switching'] = {}
-        r = dev.read_data(0x0A01)
-        select_modes = {
-            0: 'automatic',
-            1: 'fallback',
-            2: 'holdover',
-            3: 'manual',
-        }
-        selections = {
-            0: 'REFA',
-            1: 'REFAA',
-            2: 'REFB',
-            3: 'REFBB',
-            4: 'REFC',
-            5: 'REFCC',
-            6: 'REFD',
-            7: 'REFDD',
-        }
-        status['ref']['switching']['select-mode'] = select_modes[(r & 0x18)>>3]
-        status['ref']['switching']['ref-selection'] = selections[(r & 0x07)]
-
-    if args.watchdog:
-        count = dev.read_data(0x0211)
-        count += dev.read_data(0x0212) << 8
-        status['watchdog'] = count
-    
-    if args.tuning:
-        tuning = dev.read_data(0x0D14)
-        tuning += dev.read_data(0x0D15) << 8
-        tuning += dev.read_data(0x0D16) << 16
-        tuning += dev.read_data(0x0D17) << 24
-        tuning += dev.read_data(0x0D18) << 32
-        tuning += dev.read_data(0x0D19) << 40
-        status['tuning'] = tuning
-
-    if args.irq:
-        status['irq'] = {}
-        for category in ['sysclk','distrib','eeprom','dpll','watchdog']:
-            status['irq'][category] = {}
-        
-        r = dev.read_data(0x0208)
-        modes = {
-            0: 'nmos',
-            1: 'pmos',
-            2: 'cmos-high',
-            3: 'cmos-low',
-        }
-        status['irq']['pin'] = modes[r & 0x03] 
+    dev = open_device(args)
 
-        r = dev.read_data(0x0D02)
-        status['irq']['sysclk']['unlocked'] = bool((r & 0x20)>>5)
-        status['irq']['sysclk']['locked'] = bool((r & 0x10)>>4)
-        status['irq']['sysclk']['calibration'] = {}
-        status['irq']['sysclk']['calibration']['done'] = bool((r & 0x02)>>1)
-        status['irq']['sysclk']['calibration']['started'] = bool(r & 0x01)
-        
-        r = dev.read_data(0x0D03)
-        status['irq']['distrib']['sync'] = bool((r & 0x08)>>3)
-        status['irq']['watchdog']['expired'] = bool((r & 0x04)>>2)
-        status['irq']['eeprom']['fault'] = bool((r & 0x02)>>1)
-        status['irq']['eeprom']['complete'] = bool((r & 0x01)>>0)
-        
-        r = dev.read_data(0x0D04)
-        status['irq']['dpll']['switching-ref'] = bool((r & 0x80)>>7)
-        status['irq']['dpll']['closed-loop'] = bool((r & 0x40)>>6)
-        status['irq']['dpll']['free-run'] = bool((r & 0x20)>>5)
-        status['irq']['dpll']['holdover'] = bool((r & 0x10)>>4)
-        status['irq']['dpll']['freq'] = {}
-        status['irq']['dpll']['freq']['unlocked'] = bool((r & 0x08)>>3)
-        status['irq']['dpll']['freq']['locked'] = bool((r & 0x04)>>2)
-        status['irq']['dpll']['phase'] = {}
-        status['irq']['dpll']['phase']['unlocked'] = bool((r & 0x02)>>1)
-        status['irq']['dpll']['phase']['locked'] = bool((r & 0x01)>>0)
-        
-        base = 0x0D06
-        for c in ['a','b','c','d']:
-            status['irq']['ref-{:0}'.format(c)] = {}
-            status['irq']['ref-{:0}{:0}'.format(c)] = {}
-            r = dev.read_data(base)
-            status['irq']['ref-{:0}{:0}'.format(c)]['new-profile'] = bool((r & 0x80)>>7)
-            status['irq']['ref-{:0}{:0}'.format(c)]['validated'] = bool((r & 0x40)>>6)
-            status['irq']['ref-{:0}{:0}'.format(c)]['fault-cleared'] = bool((r & 0x20)>>5)
-            status['irq']['ref-{:0}{:0}'.format(c)]['fault'] = bool((r & 0x10)>>4)
-            status['irq']['ref-{:0}'.format(c)]['new-profile'] = bool((r & 0x8)>>3)
-            status['irq']['ref-{:0}'.format(c)]['validated'] = bool((r & 0x4)>>2)
-            status['irq']['ref-{:0}'.format(c)]['fault-cleared'] = bool((r & 0x2)>>1)
-            status['irq']['ref-{:0}'.format(c)]['fault'] = bool((r & 0x1)>>0)
-            base += 1
+    sections = [flag for (flag, helper) in flags if getattr(args, flag.replace("-", "_"))]
+    fields = []
+    for section in sections:
+        fields += STATUS[section]
+    # raw registers are fetched in bursts, nearby ranges being merged
+    # when reading the bytes in between is cheaper than another transaction,
+    # then decoded in memory
+    if args.verbose:
+        transactions = 0
+        for (first, last) in plan(fields):
+            size = last - first + 1
+            transactions += -(-size // dev.transport.max_read)
+            sys.stderr.write("read 0x{:04X}-0x{:04X} ({} bytes)\n".format(first, last, size))
+        sys.stderr.write("{} transactions\n".format(transactions))
+    if args.watch is None:
+        image = fetch(dev, fields, gap=READ_OVERHEAD)
+        status = decode(fields, image)
+        print(json.dumps(status, sort_keys=True, indent=2))
+        return 0
 
-    eeprom_rates = {
-        0: '400kHz',
-        1: '200kHz',
-    }
+    def emit (obj):
+        sys.stdout.write(json.dumps(obj, sort_keys=True, separators=(",", ":")) + "\n")
 
-    if args.eeprom:
-        status['eeprom'] = {}
-        r = dev.read_data(0x0E00)
-        status['eeprom']['rate'] = eeprom_rates[(r & 0x02)>>1] 
-        status['eeprom']['write-protection'] = disabled[r & 0x01]
-        r = dev.read_data(0x0E01)
-        status['eeprom']['download-condition'] = r & 0x1F
-        r = dev.read_data(0x0E02)
-        status['eeprom']['save-to'] = bool(r & 0x01)
-        r = dev.read_data(0x0E03)
-        status['eeprom']['load-from'] = bool((r & 0x02)>>1)
+    image = bytearray(REGMAP_SIZE)
+    previous = bytearray(REGMAP_SIZE)
+    keyframe = None
+    n = 0
+    try:
+        for _ in ticks(args.watch):
+            t = time.monotonic()
+            fetch(dev, fields, image=image, gap=READ_OVERHEAD)
+            if not args.changes or keyframe is None or t - keyframe >= args.keyframe:
+                status = decode(fields, image)
+                status['time'] = round(t, 6)
+                if args.changes:
+                    status['keyframe'] = True
+                    keyframe = t
+                emit(status)
+            else:
+                # previous raw image is kept: only changed fields are decoded
+                for (f, old, new) in changes(fields, previous, image):
+                    emit({'time': round(t, 6), 'field': f.name, 'old': old, 'new': new})
+            sys.stdout.flush()
+            (image, previous) = (previous, image)
+            n += 1
+            if args.count is not None and n >= args.count:
+                break # not waiting for another tick
+    except KeyboardInterrupt:
+        pass
+    return 0
 
-    print(json.dumps(status, sort_keys=True, indent=2))
-    
 if __name__ == "__main__":
-    main(sys.argv[1:])
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,4 @@
+# tools live at the root of the repository
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,56 @@
+#! /usr/bin/env python3
+# asyncio front-end: per-bus serialization, concurrent buses
+import time
+import asyncio
+import threading
+from ad9548 import AD9548
+from ad9548_async import AsyncAD9548
+from simulator import AD9548Sim, SimTransport
+
+class TracedTransport (SimTransport):
+    """ Simulated bus recording its (thread, start, end) transactions.
+    The first read of each bus waits for the other bus to start one:
+    it only completes when the buses are accessed concurrently """
+    barrier = threading.Barrier(2, timeout=5.0)
+
+    def __init__ (self, bus, calls):
+        SimTransport.__init__(self, bus=bus)
+        self.log = calls
+
+    def read (self, addr, length):
+        start = time.monotonic()
+        if not any(bus == self.bus for (bus, _, _, _) in self.log):
+            TracedTransport.barrier.wait()
+        time.sleep(0.01)
+        data = SimTransport.read(self, addr, length)
+        self.log.append((self.bus, threading.get_ident(), start, time.monotonic()))
+        return data
+
+def test_buses_run_concurrently():
+    calls = []
+    fleet = []
+    for bus in ["traced-0", "traced-0", "traced-1", "traced-1"]:
+        fleet.append(AsyncAD9548(AD9548(transport=TracedTransport(bus, calls))))
+    async def poll ():
+        return await asyncio.gather(*[dev.status() for dev in fleet])
+    status = asyncio.run(poll()) # would raise BrokenBarrierError if serialized
+    assert len(status) == 4 and len(calls) == 4
+    for bus in ["traced-0", "traced-1"]:
+        spans = sorted((start, end) for (b, _, start, end) in calls if b == ("sim", bus))
+        assert len(spans) == 2
+        assert spans[0][1] <= spans[1][0] # same bus: never overlap
+        assert len(set(t for (b, t, _, _) in calls if b == ("sim", bus))) == 1 # one thread per bus
+
+def test_async_access():
+    sim = AD9548Sim()
+    dev = AsyncAD9548(AD9548(transport=SimTransport(sim)))
+    async def run ():
+        await dev.write_block(0x0A00, [0x22])
+        await dev.io_update()
+        sim.poke(0x0D0A, 0x30)
+        sim.poke(0x0D14, 0x01)
+        return (await dev.read_data(0x0A00), await dev.status())
+    (r, status) = asyncio.run(run())
+    assert r == 0x22
+    assert status['dpll']['phase-locked'] and status['dpll']['freq-locked']
+    assert status['tuning'] == 1
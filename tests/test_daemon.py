@@ -0,0 +1,70 @@
+#! /usr/bin/env python3
+# ad9548d.py daemon and its clients
+import threading
+from ad9548 import AD9548, DaemonTransport, EEPROM_IO_UPDATE, connect_daemon
+import importlib
+import regmap
+ad9548d = importlib.import_module("ad9548d")
+
+def test_daemon_serves_devices(tmp_path):
+    path = str(tmp_path / "ad9548d.sock")
+    server = ad9548d.Daemon(path, sim=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        dev = AD9548(transport=connect_daemon({"bus": 0, "address": 0x48}, path, sim=True))
+        dev.write_block(0x0300, [0x01, 0x02, 0x03])
+        dev.io_update()
+        assert dev.read_block(0x0300, 3) == [0x01, 0x02, 0x03]
+        assert dev.read_data(0x0003) == 0x48
+        # state is kept between clients
+        other = AD9548(transport=DaemonTransport({"bus": 0, "address": 0x48}, path))
+        assert other.read_block(0x0300, 3) == [0x01, 0x02, 0x03]
+        assert other.transport.request("ping")["devices"] == 1
+        # a simulating daemon never serves hardware accesses, nor another backend
+        assert connect_daemon({"bus": 0, "address": 0x48}, path) is None
+        assert connect_daemon({"bus": 0, "address": 0x48}, path, backend="rdwr", sim=True) is None
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert connect_daemon({"bus": 0, "address": 0x48}, str(tmp_path / "none.sock")) is None
+
+def test_daemon_cache_invalidation(tmp_path):
+    path = str(tmp_path / "ad9548d.sock")
+    server = ad9548d.Daemon(path, sim=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        target = {"bus": 0, "address": 0x48}
+        dev = AD9548(transport=connect_daemon(target, path, sim=True))
+        dev.write_block(0x0300, [0x11])
+        dev.io_update()
+        dev.eeprom_program([(0x0300, 0x0300), EEPROM_IO_UPDATE])
+        dev.eeprom_save()
+        dev.write_block(0x0300, [0x22])
+        dev.io_update()
+        assert dev.read_data(0x0300) == 0x22 # served from the daemon cache
+        dev.eeprom_load()
+        # new client: the daemon cache was dropped by the EEPROM load
+        other = AD9548(transport=connect_daemon(target, path, sim=True))
+        assert other.read_data(0x0300) == 0x11
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_daemon_refresh(tmp_path):
+    path = str(tmp_path / "ad9548d.sock")
+    server = ad9548d.Daemon(path, sim=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        target = {"bus": 0, "address": 0x48}
+        dev = AD9548(transport=connect_daemon(target, path, sim=True))
+        dev.write_block(0x0300, [0x11, 0x22])
+        dev.io_update()
+        # out of band reset: the daemon cache is stale
+        server.devices[("i2c", 0, 0x48)].transport.sim.poke(0x0300, 0x00)
+        assert dev.read_block(0x0300, 2) == [0x11, 0x22]
+        assert regmap.read_state(dev, [0x0300, 0x0301])[0] == {0x0300: 0x00, 0x0301: 0x22}
+        assert regmap.verify_section(dev, [(0x0300, [0x11, 0x22])]) == [(0x0300, 0x11, 0x00, 0xFF)]
+        assert dev.read_block(0x0300, 2) == [0x00, 0x22] # daemon cache refreshed
+    finally:
+        server.shutdown()
+        server.server_close()
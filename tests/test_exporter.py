@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+# exporter.py: metrics served from background samples
+import threading
+import urllib.request
+from ad9548 import AD9548
+from simulator import AD9548Sim, SimTransport
+import exporter
+
+def test_exporter(tmp_path):
+    sims = [AD9548Sim(), AD9548Sim()]
+    transports = [SimTransport(sim, bus=0) for sim in sims]
+    targets = [(0, exporter.Target("0:0x{:02X}".format(0x48+i), AD9548(transport=t)))
+        for (i, t) in enumerate(transports)]
+    server = exporter.Exporter(("127.0.0.1", 0), targets, interval=60.0)
+    assert len(server.samplers) == 1 # same bus
+    sampler = server.samplers[0]
+    sims[0].poke(0x0D0A, 0x32) # active, phase & freq locked
+    sims[0].poke(0x0D0C, 0x08) # ref A valid
+    sims[0].poke(0x0D04, 0x01) # IRQ: phase locked
+    for t in sampler.targets:
+        sampler.sample(t)
+    sampler.sample(sampler.targets[0]) # IRQ still asserted
+    sims[0].poke(0x0D04, 0x00)
+    sampler.sample(sampler.targets[0])
+    sims[0].poke(0x0D04, 0x01)
+    sampler.sample(sampler.targets[0])
+    reads = transports[0].stats['transactions']
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = "http://127.0.0.1:{}/metrics".format(server.server_address[1])
+        for i in range (3):
+            text = urllib.request.urlopen(url).read().decode("utf-8")
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert transports[0].stats['transactions'] == reads # scrapes never reach the bus
+    lines = text.splitlines()
+    assert 'ad9548_up{target="0:0x48"} 1' in lines
+    assert 'ad9548_dpll_phase_locked{target="0:0x48"} 1' in lines
+    assert 'ad9548_dpll_phase_locked{target="0:0x49"} 0' in lines
+    assert 'ad9548_ref_valid{target="0:0x48",ref="a"} 1' in lines
+    assert 'ad9548_ref_valid{target="0:0x48",ref="aa"} 0' in lines
+    assert 'ad9548_irq_events_total{target="0:0x48",event="dpll.phase.locked"} 2' in lines
+    assert '# TYPE ad9548_tuning_word gauge' in lines
+
+class BrokenTransport (SimTransport):
+    """ Daemon went away: replies do not parse """
+    def read (self, addr, length):
+        raise ValueError("Expecting value: line 1 column 1 (char 0)")
+
+def test_sampler_failures():
+    broken = AD9548(transport=BrokenTransport())
+    reopened = []
+    def reopen ():
+        reopened.append(True)
+        return AD9548(transport=SimTransport())
+    target = exporter.Target("0:0x48", broken, reopen)
+    sampler = exporter.Sampler([target], 60.0, threading.Lock())
+    sampler.sample(target)
+    assert not target.up and target.errors == 1 and target.dev is None
+    text = exporter.render([target], sampler.lock)
+    assert 'ad9548_up{target="0:0x48"} 0' in text.splitlines()
+    sampler.sample(target) # next tick: device reopened
+    assert target.up and reopened == [True]
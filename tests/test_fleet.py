@@ -0,0 +1,21 @@
+#! /usr/bin/env python3
+# fleet.py: many targets, one JSON document
+import json
+import fleet
+
+def test_parse_targets(tmp_path):
+    assert fleet.parse_targets("0:0x48,0:0x4A,1:0x48") == [(0, 0x48), (0, 0x4A), (1, 0x48)]
+    assert fleet.parse_targets("2:0x48-0x4A") == [(2, 0x48), (2, 0x49), (2, 0x4A)]
+    targets = tmp_path / "targets"
+    targets.write_text("0:0x48 # top board\n1:0x48,1:0x4A\n")
+    assert fleet.parse_targets(str(targets)) == [(0, 0x48), (1, 0x48), (1, 0x4A)]
+
+def test_fleet_run(tmp_path, capsys):
+    sim = str(tmp_path / "{bus}-{address}.bin")
+    code = fleet.main(["--targets", "0:0x48,0:0x4A,1:0x48", "status", "--sim", sim, "--info"])
+    report = json.loads(capsys.readouterr().out)
+    assert code == 0
+    assert sorted(report["targets"]) == ["0:0x48", "0:0x4A", "1:0x48"]
+    for target in report["targets"].values():
+        assert target["exit"] == 0
+        assert target["output"]["info"]["id"] == "0x48"
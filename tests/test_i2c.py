@@ -0,0 +1,28 @@
+#! /usr/bin/env python3
+# I2C backends against the simulated bus
+from ad9548 import AD9548, I2CTransport, I2CRdwrTransport
+from simulator import AD9548Sim, SimI2CBus, SimSMBus, SimI2CAdapter
+
+def test_rdwr_backend():
+    bus = SimI2CBus({0x48: AD9548Sim()})
+    dev = AD9548(transport=I2CRdwrTransport(0, 0x48, fd=-1, ioctl=SimI2CAdapter(bus).ioctl))
+    dev.write_block(0x0600, list(range(0x32)))
+    assert bus.transactions == 1
+    dev.io_update()
+    assert dev.read_block(0x0600, 0x32) == list(range(0x32))
+    assert bus.transactions == 3 # single combined read
+    assert dev.read_data(0x0003) == 0x48
+
+def test_backends_agree():
+    devices = []
+    for backend in ["smbus", "rdwr"]:
+        bus = SimI2CBus({0x48: AD9548Sim()})
+        if backend == "rdwr":
+            transport = I2CRdwrTransport(0, 0x48, fd=-1, ioctl=SimI2CAdapter(bus).ioctl)
+        else:
+            transport = I2CTransport(0, 0x48, handle=SimSMBus(bus))
+        dev = AD9548(transport=transport)
+        dev.write_block(0x0300, [0xA5]*40)
+        dev.io_update()
+        devices.append(dev)
+    assert devices[0].read_block(0x0000, 0x0E40) == devices[1].read_block(0x0000, 0x0E40)
@@ -0,0 +1,51 @@
+#! /usr/bin/env python3
+# recorder.py: status records, rotating segments and queries
+import json
+import recorder
+
+def test_recorder(tmp_path, capsys):
+    path = str(tmp_path / "rec")
+    rec = recorder.Recorder(path, capacity=4, keep=2)
+    for i in range (10):
+        block = bytearray(recorder.STATUS_SIZE)
+        block[0x0A] = 0x04 if 3 <= i < 5 or i >= 8 else 0x32 # holdover / phase & freq locked
+        block[0x0B] = 0x02 # ref B
+        rec.append(1000.0 + i, block)
+    rec.close()
+    segments = recorder.segments(path)
+    assert len(segments) == 2 # oldest one rotated out
+    seg = recorder.Segment(segments[-1])
+    assert len(seg) == 2 and not seg.full()
+    seg.close()
+
+    records = recorder.query(path, ["dpll.holdover"])
+    assert [t for (t, values) in records] == [1000.0 + i for i in range (4, 10)]
+    changes = recorder.query(path, ["dpll.holdover", "dpll.active-ref"], changes=True)
+    assert changes == [
+        (1004.0, {"dpll.holdover": 1, "dpll.active-ref": 2}),
+        (1005.0, {"dpll.holdover": 0, "dpll.active-ref": 2}),
+        (1008.0, {"dpll.holdover": 1, "dpll.active-ref": 2}),
+    ]
+    assert len(recorder.query(path, ["dpll.holdover"], since=1005.0, until=1007.0)) == 3
+
+    # recording resumes in the last segment
+    rec = recorder.Recorder(path, capacity=4, keep=2)
+    rec.append(1010.0, bytes(recorder.STATUS_SIZE))
+    rec.close()
+    assert len(recorder.segments(path)) == 2
+
+    assert recorder.main(["query", path, "--field", "dpll.holdover", "--field", "dpll.active-ref",
+        "--since", "1007", "--changes"]) == 0
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert lines == [
+        {"dpll.holdover": False, "dpll.active-ref": "B", "time": 1007.0},
+        {"dpll.holdover": True, "dpll.active-ref": "B", "time": 1008.0},
+        {"dpll.holdover": False, "dpll.active-ref": "A", "time": 1010.0},
+    ]
+
+def test_record_simulator(tmp_path):
+    path = str(tmp_path / "rec")
+    assert recorder.main(["--sim", "", "--path", path, "--interval", "0.01", "--count", "5"]) == 0
+    records = recorder.query(path, ["sysclk.locked", "tuning"])
+    assert len(records) == 5
+    assert all(values == {"sysclk.locked": 0, "tuning": 0} for (t, values) in records)
@@ -0,0 +1,156 @@
+#! /usr/bin/env python3
+# regmap.py compiled write plans
+import os
+import json
+import pytest
+from ad9548 import AD9548, RetryTransport
+from simulator import SimTransport
+import regmap
+
+def test_plan_cache(tmp_path):
+    path = tmp_path / "map.json"
+    path.write_text(json.dumps({"RegisterMap": {
+        "0x0301": "0x02", "0x0300": "0x01", "0x0600": "0x03", "0x0D00": "0xFF"}}))
+    runs = regmap.load_plan(str(path))
+    assert runs == [(0x0300, b"\x01\x02"), (0x0600, b"\x03")] # sorted, read only dropped
+    plan = str(path) + ".plan"
+    assert regmap.read_plan(plan)[1] == runs
+    # same content, new mtime: plan reused
+    os.utime(str(path), ns=(0, 1000))
+    mtime = os.stat(plan).st_mtime_ns
+    assert regmap.load_plan(str(path)) == runs
+    assert os.stat(plan).st_mtime_ns == mtime
+    # same size and mtime, modified content: plan rebuilt
+    path.write_text(path.read_text().replace('"0x03"', '"0x07"'))
+    os.utime(str(path), ns=(0, 1000))
+    assert regmap.load_plan(str(path)) == [(0x0300, b"\x01\x02"), (0x0600, b"\x07")]
+
+def test_snapshot_diff(tmp_path, capsys):
+    state = str(tmp_path / "sim.bin")
+    (a, b) = (str(tmp_path / "a.bin"), str(tmp_path / "b.bin"))
+    regmap.main(["--sim", state, "--dump", a, "--quiet"])
+    ref = tmp_path / "ref.json"
+    ref.write_text(json.dumps({"RegisterMap": {"0x0300": "0x2A"}}))
+    regmap.main(["--sim", state, "--load", str(ref), "--quiet"])
+    regmap.main(["--sim", state, "--dump", b, "--quiet"])
+    (chip, t, digest, image) = regmap.read_snapshot(b)
+    assert chip == "ad9547" and len(image) == 0x0E40 and image[0x0300] == 0x2A
+    capsys.readouterr()
+    assert regmap.main(["diff", a, a, b]) == 1
+    report = json.loads(capsys.readouterr().out)
+    assert report[a] == {}
+    assert report[b] == {"0x0300": {"block": "dpll", "reference": "0x00", "value": "0x2A"}}
+
+def test_snapshot_store(tmp_path, capsys):
+    from snapshots import SnapshotStore
+    store = SnapshotStore(str(tmp_path / "store"))
+    image = bytearray(0x0E40)
+    h0 = store.put(0, 0x48, "ad9548", image, t=1.0)
+    assert store.put(0, 0x48, "ad9548", image, t=2.0) == h0 # deduplicated
+    image[0x0A01] = 0x04
+    h1 = store.put(0, 0x48, "ad9548", image, t=3.0)
+    store.put(0, 0x4A, "ad9548", bytearray(0x0E40), t=3.0)
+    assert store.get(h1) == bytes(image) # delta against h0
+    assert len(store.db.execute("SELECT * FROM objects").fetchall()) == 2
+    assert store.changes(0x0A01) == [("0", 0x48, 3.0, 0x00, 0x04)]
+    assert len(store.history(0, 0x48)) == 3
+    store.close()
+    # through regmap.py
+    state = str(tmp_path / "sim.bin")
+    regmap.main(["--sim", state, "--store", str(tmp_path / "store2"), "--quiet"])
+    capsys.readouterr()
+    regmap.main(["history", str(tmp_path / "store2")])
+    report = json.loads(capsys.readouterr().out)
+    assert report[0]["device"] == "sim"
+    regmap.main(["history", str(tmp_path / "store2"), "--export", report[0]["hash"], str(tmp_path / "x.bin")])
+    assert regmap.read_snapshot(str(tmp_path / "x.bin"))[3][0x0003] == 0x48
+    with pytest.raises(SystemExit) as e:
+        regmap.main(["history", str(tmp_path / "store2"), "--export", "deadbeef", str(tmp_path / "y.bin")])
+    assert e.value.code == 2
+    assert "unknown snapshot deadbeef" in capsys.readouterr().err
+
+class FlakyTransport (SimTransport):
+    """ Simulated bus failing given write transactions """
+    def __init__ (self, failures):
+        SimTransport.__init__(self)
+        self.failures = failures
+    def write (self, addr, data):
+        if self.stats['transactions'] in self.failures:
+            self.stats['transactions'] += 1
+            raise OSError(121, "Remote I/O error")
+        SimTransport.write(self, addr, data)
+
+def test_resumable_load(tmp_path):
+    path = tmp_path / "map.json"
+    path.write_text(json.dumps({"RegisterMap": {
+        "0x0100": "0x01", "0x0300": "0x02", "0x0400": "0x03", "0x0500": "0x04"}}))
+    runs = regmap.load_plan(str(path))
+    checkpoint = str(tmp_path / "map.ckpt")
+    # transient failure: retried
+    transport = FlakyTransport([1])
+    dev = AD9548(transport=RetryTransport(transport, delay=0))
+    regmap.load_sections(dev, runs, checkpoint)
+    assert transport.sim.read(0x0500, 1) == [0x04]
+    assert not os.path.exists(checkpoint)
+    # persistent failure on 3rd section: resumed from there
+    transport = FlakyTransport([2, 3])
+    dev = AD9548(transport=RetryTransport(transport, retries=1, delay=0))
+    with pytest.raises(OSError):
+        regmap.load_sections(dev, runs, checkpoint)
+    assert json.load(open(checkpoint))["sections"] == 2
+    transport.failures = []
+    transport.reset_stats()
+    assert regmap.load_sections(dev, runs, checkpoint, resume=True) == (2, [])
+    assert transport.calls == [('write', 0x0400, 1), ('write', 0x0500, 1), ('write', 0x0005, 1)]
+    assert transport.sim.read(0x0100, 1) == [0x01]
+    assert transport.sim.read(0x0500, 1) == [0x04]
+
+class StuckTransport (SimTransport):
+    """ Simulated bus losing writes to given register """
+    def __init__ (self, stuck):
+        SimTransport.__init__(self)
+        self.stuck = stuck
+    def write (self, addr, data):
+        data = list(data)
+        if addr <= self.stuck < addr+len(data):
+            data[self.stuck-addr] = 0x00
+        SimTransport.write(self, addr, data)
+
+def test_verified_load(tmp_path):
+    path = tmp_path / "map.json"
+    path.write_text(json.dumps({"RegisterMap": {
+        "0x0300": "0x2A", "0x0400": "0x03", "0x0A03": "0x01"}}))
+    runs = regmap.load_plan(str(path))
+    checkpoint = str(tmp_path / "map.ckpt")
+    transport = SimTransport()
+    dev = AD9548(transport=transport)
+    assert regmap.load_sections(dev, runs, checkpoint, verify=True) == (0, [])
+    assert transport.sim.read(0x0300, 1) == [0x2A] # staged, then updated
+    assert transport.sim.read(0x0004, 1) == [0x00]
+    dev = AD9548(transport=StuckTransport(0x0400))
+    assert regmap.load_sections(dev, runs, checkpoint, verify=True) == (0, [(0x0400, 0x03, 0x00, 0xFF)])
+
+def test_verified_full_reload(tmp_path, capsys):
+    # a full dump includes 0x0004, its staged readback bit is not verified
+    state = str(tmp_path / "sim.bin")
+    dump = str(tmp_path / "dump.json")
+    assert regmap.main(["--sim", state, "--dump", dump, "--quiet"]) is None
+    assert regmap.main(["--sim", state, "--load", dump, "--verify", "--quiet"]) is None
+    assert "verify:" not in capsys.readouterr().out
+    with pytest.raises(SystemExit):
+        regmap.main(["--sim", state, "--load", dump, "--diff", "--verify"])
+
+def test_load_without_checkpoint(tmp_path, capsys):
+    path = tmp_path / "map.json"
+    path.write_text(json.dumps({"RegisterMap": {"0x0300": "0x2A", "0x0400": "0x03"}}))
+    runs = regmap.load_plan(str(path))
+    transport = SimTransport()
+    dev = AD9548(transport=transport)
+    # checkpoint cannot be written (read only location): load completes
+    checkpoint = str(tmp_path / "missing" / "map.ckpt")
+    assert regmap.load_sections(dev, runs, checkpoint) == (0, [])
+    assert "checkpoint disabled" in capsys.readouterr().err
+    assert transport.sim.read(0x0400, 1) == [0x03]
+    assert regmap.load_sections(dev, runs, None) == (0, [])
+    with pytest.raises(SystemExit):
+        regmap.main(["--sim", "", "--load", str(path), "--diff", "--resume"])
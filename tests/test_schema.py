@@ -0,0 +1,88 @@
+#! /usr/bin/env python3
+# Register schema decoder / encoder
+import pytest
+from schema import STATUS, PROFILE, DISTRIB, IRQ_EVENTS, Field, profile_offset, ranges, plan, decode, encode, changes
+
+def test_decode():
+    image = bytearray(0x0E40)
+    image[0x0100] = 0x9A # external, current #3, lock detect depth 512
+    image[0x0D0B] = 0x4B # history available, priority 1, ref BB
+    image[0x0D14:0x0D1A] = bytes([0x01, 0x02, 0x03, 0x04, 0x05, 0x06])
+    status = decode(STATUS['sysclk'] + STATUS['dpll'] + STATUS['tuning'], image)
+    assert status['sysclk']['loop-filter'] == 'external'
+    assert status['sysclk']['charge-pump-current'] == '500uA'
+    assert status['sysclk']['lock-detect-depth'] == 512
+    assert status['dpll']['history'] == 'available'
+    assert status['dpll']['active-ref-priority'] == 1
+    assert status['dpll']['active-ref'] == 'BB'
+    assert status['tuning'] == 0x060504030201
+
+def test_encode_roundtrip():
+    image = bytearray(0x0E40)
+    offset = profile_offset(3)
+    values = {
+        'scaling': 'nano',
+        'selection-priority': 5,
+        'freq': 10E6,
+        'filter.a2': 5, # spans 0x0614-0x0615
+        'filter.b0': 0x1ABCD,
+        'validation': 0.25,
+    }
+    touched = encode(PROFILE, values, image, offset)
+    assert touched[0] == 0x06B2 and touched[-1] < 0x06B2 + 0x32
+    profile = decode(PROFILE, image, offset)
+    assert profile['scaling'] == 'nano'
+    assert profile['selection-priority'] == 5
+    assert profile['freq'] == 10E6
+    assert profile['filter']['a2'] == 5
+    assert profile['filter']['b0'] == 0x1ABCD
+    assert profile['validation'] == 0.25
+    with pytest.raises(ValueError):
+        encode([Field("x", 0x0300, 0x0F)], {"x": 0x10}, image)
+    with pytest.raises(ValueError):
+        encode(STATUS['tuning'], {"tuning": 0}, image) # read only
+
+def test_irq_layout():
+    masks = {}
+    for ev in IRQ_EVENTS:
+        masks[ev.addr] = masks.get(ev.addr, 0x00) | ev.mask
+    assert [masks[a] for a in range (0x0D02, 0x0D0A)] == [0x33, 0x0F, 0xFF, 0x1F, 0xFF, 0xFF, 0xFF, 0xFF]
+
+def test_ranges():
+    fields = STATUS['sysclk'] + STATUS['eeprom']
+    assert ranges(fields) == [(0x0100, 0x0108), (0x0D01, 0x0D01), (0x0E00, 0x0E03)]
+
+def test_plan():
+    fields = STATUS['info'] + STATUS['serial'] + STATUS['watchdog'] + STATUS['mx-pins']
+    assert ranges(fields) == [(0x0000, 0x0000), (0x0002, 0x0004), (0x0200, 0x0207), (0x0211, 0x0212), (0x0D00, 0x0D00), (0x0D03, 0x0D03)]
+    # 9 bytes in between 0x0207 and 0x0211 cost more than a transaction
+    assert plan(fields) == [(0x0000, 0x0004), (0x0200, 0x0207), (0x0211, 0x0212), (0x0D00, 0x0D03)]
+    assert plan(fields, overhead=9) == [(0x0000, 0x0004), (0x0200, 0x0212), (0x0D00, 0x0D03)]
+    # watchdog timer is configuration: cached, writable
+    timer = [f for f in fields if f.name == 'watchdog.timer'][0]
+    assert timer.access == "rw" and not timer.volatile
+
+def test_changes():
+    fields = STATUS['dpll'] + STATUS['tuning']
+    old = bytearray(0x0E40)
+    old[0x0D0A] = 0x32 # active, phase & freq locked
+    new = bytearray(old)
+    assert changes(fields, old, new) == []
+    new[0x0D0A] = 0x22 # phase lock lost
+    new[0x0D15] = 0x01
+    events = [(f.name, a, b) for (f, a, b) in changes(fields, old, new)]
+    assert events == [('dpll.phase-locked', True, False), ('tuning', 0, 0x100)]
+
+def test_reserved_labels():
+    image = bytearray(0x0E40)
+    image[0x0402] = 0x30 # sync source: reserved
+    image[0x0403] = 0x03 # autosync: reserved
+    image[0x0404] = 0x07 # out0 mode: reserved
+    distrib = decode(DISTRIB, image)
+    assert distrib['sync-source'] == 3
+    assert distrib['autosync'] == 3
+    assert distrib['out0']['mode'] == 7
+    assert distrib['out1']['mode'] == 'cmos'
+    # decoded values encode back
+    assert encode(DISTRIB, {'sync-source': 3, 'out1.mode': 'lvds'}, image) == [0x0402, 0x0405]
+    assert image[0x0405] == 0x04
@@ -0,0 +1,219 @@
+#! /usr/bin/env python3
+# Device simulator and tools, without hardware
+import json
+import sys
+import time
+import pytest
+import importlib
+import importlib.util
+import subprocess
+from ad9548 import AD9548, REGISTER_BLOCKS, register_block
+from simulator import AD9548Sim, SimTransport
+import regmap
+import status
+import dpll
+
+def test_io_update_buffering():
+    transport = SimTransport()
+    dev = AD9548(transport=transport)
+    dev.write_block(0x0300, [0x01, 0x02])
+    assert dev.read_block(0x0300, 2) == [0x00, 0x00] # still staged
+    dev.write_data(0x0004, 0x01) # read staged registers
+    assert dev.read_block(0x0300, 2) == [0x01, 0x02]
+    dev.write_data(0x0004, 0x00)
+    dev.io_update()
+    assert dev.read_block(0x0300, 2) == [0x01, 0x02]
+    assert dev.read_data(0x0005) == 0x00
+
+def test_read_only_and_self_clearing():
+    sim = AD9548Sim()
+    dev = AD9548(transport=SimTransport(sim))
+    sim.poke(0x0D04, 0x11) # phase locked + holdover IRQ events
+    dev.write_data(0x0D04, 0x00)
+    assert dev.read_data(0x0D04) == 0x11
+    dev.write_data(0x0A06, 0x01) # clear phase locked event
+    dev.io_update()
+    assert dev.read_data(0x0D04) == 0x10
+    assert dev.read_data(0x0A06) == 0x00
+    dev.write_data(0x0A03, 0x02) # clear all
+    dev.io_update()
+    assert dev.read_data(0x0D04) == 0x00
+    assert dev.read_data(0x0A03) == 0x00
+
+def test_transaction_accounting():
+    transport = SimTransport(max_block=32)
+    dev = AD9548(transport=transport)
+    dev.read_block(0x0000, 100)
+    dev.write_block(0x0600, [0x00]*10)
+    assert transport.stats['transactions'] == 5
+    assert transport.stats['bytes-read'] == 100
+    assert transport.stats['bytes-written'] == 10
+    assert transport.calls[-1] == ('write', 0x0600, 10)
+
+def test_tools_against_simulator(tmp_path, capsys):
+    state = str(tmp_path / "sim.bin")
+    profile = tmp_path / "profile.json"
+    profile.write_text(json.dumps({"RegisterMap": {"0x0D14": "0x01", "0x0300": "0x2A"}}))
+    regmap.main(["--sim", state, "--load", str(profile), "--quiet"])
+    capsys.readouterr()
+    status.main(["--sim", state, "--info", "--tuning"])
+    report = json.loads(capsys.readouterr().out)
+    assert report['info']['id'] == '0x48'
+    assert report['tuning'] == 0 # read only
+    dump = tmp_path / "dump.json"
+    regmap.main(["--sim", state, "--dump", str(dump), "--quiet"])
+    assert json.loads(dump.read_text())["RegisterMap"]["0x0300"] == "0x2A"
+
+def test_status_watch(tmp_path, capsys):
+    state = str(tmp_path / "sim.bin")
+    AD9548Sim(path=state).save(state)
+    assert status.main(["--sim", state, "--dpll", "--tuning", "--watch", "0.02", "--count", "3"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 3
+    samples = [json.loads(line) for line in lines]
+    assert all(s['tuning'] == 0 and 'phase-locked' in s['dpll'] for s in samples)
+    assert samples[2]['time'] - samples[0]['time'] == pytest.approx(0.04, abs=0.015)
+    # steady state: keyframe only
+    assert status.main(["--sim", state, "--dpll", "--watch", "0.01", "--count", "3", "--changes"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1 and json.loads(lines[0])['keyframe']
+    # last sample: exits without waiting for the next tick
+    t0 = time.monotonic()
+    assert status.main(["--sim", state, "--watch", "10", "--count", "1"]) == 0
+    assert time.monotonic() - t0 < 5.0
+
+def test_sim_stats(tmp_path):
+    # stderr stays clean for scripted use, unless requested
+    state = str(tmp_path / "sim.bin")
+    for (opts, report) in [([], False), (["--sim-stats"], True)]:
+        proc = subprocess.run([sys.executable, "status.py", "--sim", state, "--dpll"] + opts,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        assert proc.returncode == 0
+        assert proc.stderr.startswith("sim: ") == report
+
+def test_dpll_tuning(tmp_path):
+    state = str(tmp_path / "sim.bin")
+    dpll.main(["--sim", state, "--tuning", "0x123456789ABC", "--tuning-apply",
+        "--pull-in-low", "0x000100", "--persistent-history", "--k", "3"])
+    sim = AD9548Sim(path=state)
+    assert sim.read(0x0300, 6) == [0xBC, 0x9A, 0x78, 0x56, 0x34, 0x12]
+    assert sim.read(0x0307, 3) == [0x00, 0x01, 0x00]
+    assert sim.read(0x031B, 1) == [0x0B]
+    assert sim.read(0x0306, 1) == [0x00] # self clearing
+
+def test_ref_input_logic(tmp_path):
+    state = str(tmp_path / "sim.bin")
+    ref_input = importlib.import_module("ref-input")
+    ref_input.main(["--sim", state, "--logic", "3.3v-cmos"])
+    assert AD9548Sim(path=state).read(0x0501, 2) == [0xFF, 0xFF]
+    ref_input.main(["--sim", state, "--logic", "1.5v-cmos", "--ref", "b"])
+    ref_input.main(["--sim", state, "--logic", "disabled", "--ref", "dd"])
+    assert AD9548Sim(path=state).read(0x0501, 2) == [0xDF, 0x3F]
+
+def test_profile_tolerances(tmp_path, capsys):
+    # --outter writes 0x060B-0x060D (not 0x060A, inner tolerance MSB),
+    # tolerances are read back from their own registers, --read 0 is valid
+    state = str(tmp_path / "sim.bin")
+    # not the standard library profile module
+    spec = importlib.util.spec_from_file_location("profile_tool", "profile.py")
+    profile = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(profile)
+    profile.main(["--sim", state, "--load", "0", "--inner", str(0x012345), "--outter", str(0x0ABCDE)])
+    sim = AD9548Sim(path=state)
+    assert list(sim.active[0x0608:0x060E]) == [0x45, 0x23, 0x01, 0xDE, 0xBC, 0x0A]
+    capsys.readouterr()
+    assert profile.main(["--sim", state, "--read", "0"]) == 0
+    report = json.loads(capsys.readouterr().out.split("\n", 1)[1]) # after debug line
+    assert report['tolerance'] == {'inner': 0x012345, 'outter': 0x0ABCDE}
+
+def test_dump_skips_reserved_holes(tmp_path, capsys):
+    dump = tmp_path / "dump.json"
+    regmap.main(["--sim", "", "--dump", str(dump), "--quiet"])
+    registers = json.loads(dump.read_text())["RegisterMap"]
+    blocks = REGISTER_BLOCKS["ad9548"]
+    assert len(registers) == sum(last-first+1 for (first, last, name) in blocks)
+    assert "0x0664" not in registers
+    assert registers["0x0003"] == "0x48"
+    assert register_block(0x0664) is None
+    assert register_block(0x06B2) == "profile-3"
+
+def test_diff_load(tmp_path, capsys):
+    state = str(tmp_path / "sim.bin")
+    profile = tmp_path / "profile.json"
+    profile.write_text(json.dumps({"RegisterMap": {
+        "0x0300": "0x2A", "0x0301": "0x00", "0x0302": "0x01", "0x0D14": "0x01"}}))
+    regmap.main(["--sim", state, "--load", str(profile), "--diff", "--quiet"])
+    assert capsys.readouterr().out.startswith("diff: 3 bytes written in 3 transactions")
+    regmap.main(["--sim", state, "--load", str(profile), "--diff", "--quiet"])
+    assert capsys.readouterr().out.startswith("diff: 0 bytes written in 1 transactions")
+    sim = AD9548Sim(path=state)
+    assert sim.read(0x0300, 3) == [0x2A, 0x00, 0x01]
+
+def test_shadow_cache():
+    transport = SimTransport()
+    dev = AD9548(transport=transport, cache=True)
+    r = dev.read_data(0x031B)
+    dev.write_data(0x031B, r | 0x10)
+    r = dev.read_data(0x031B)
+    dev.write_data(0x031B, r | 0x08)
+    assert dev.read_data(0x031B) == 0x18 # staged value, from cache
+    assert transport.stats['transactions'] == 3 # 1 read + 2 writes
+    transport.sim.poke(0x0D0A, 0x10)
+    assert dev.read_data(0x0D0A) == 0x10 # status: always from bus
+    transport.sim.poke(0x031B, 0x00)
+    assert dev.read_data(0x031B) == 0x18
+    assert dev.refresh(0x031B) == [0x00]
+    dev.invalidate()
+    assert dev.cache == {}
+    # soft reset and EEPROM load rewrite registers: cache is dropped
+    dev.write_data(0x031B, 0x18)
+    dev.io_update()
+    assert 0x031B in dev.cache
+    dev.write_data(0x0000, 0x24)
+    assert dev.cache == {}
+
+def test_transaction():
+    transport = SimTransport()
+    dev = AD9548(transport=transport)
+    dev.write_data(0x0A00, 0x80)
+    dev.io_update()
+    transport.reset_stats()
+    with dev.transaction():
+        dev.write_bits(0x0A00, 0x20, 0xFF)
+        dev.write_bits(0x0A00, 0x02, 0xFF)
+        dev.write_block(0x0300, [0x01, 0x02])
+        dev.write_data(0x0302, 0x03)
+        dev.io_update()
+        assert dev.read_data(0x0A00) == 0xA2 # staged bits overlaid
+        assert dev.read_data(0x0A00) == 0xA2
+    assert dev.read_data(0x0A00) == 0xA2
+    assert dev.read_block(0x0300, 3) == [0x01, 0x02, 0x03]
+    writes = [call for call in transport.calls if call[0] == 'write']
+    assert writes == [('write', 0x0300, 3), ('write', 0x0A00, 1), ('write', 0x0005, 1)]
+
+def test_transaction_abort():
+    transport = SimTransport()
+    dev = AD9548(transport=transport)
+    try:
+        with dev.transaction():
+            dev.write_data(0x0A00, 0x01)
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert dev.read_data(0x0A00) == 0x00
+    assert all(call[0] == 'read' for call in transport.calls)
+
+def test_eeprom():
+    transport = SimTransport()
+    dev = AD9548(transport=transport, cache=True)
+    with pytest.raises(RuntimeError):
+        dev.eeprom_load() # blank EEPROM
+    dev.write_block(0x0300, [0x01, 0x02])
+    dev.io_update()
+    dev.eeprom_program()
+    dev.eeprom_save()
+    assert dev.read_data(0x0E00) & 0x01 == 0x00 # protected again
+    dev.write_block(0x0300, [0x00, 0x00])
+    dev.io_update()
+    assert dev.eeprom_load() > 1 # polled until complete
+    assert dev.read_block(0x0300, 2) == [0x01, 0x02]
@@ -0,0 +1,41 @@
+#! /usr/bin/env python3
+# SPI transport against a local fake spidev
+from ad9548 import AD9548, SPITransport
+
+class FakeSpiDev :
+    """ Emulates the AD9548 SPI port (MSB first mode) """
+    def __init__ (self):
+        self.regs = bytearray(0x0E40)
+        self.instructions = []
+    def xfer2 (self, data):
+        instr = (data[0] << 8) | data[1]
+        self.instructions.append(instr)
+        addr = instr & 0x1FFF
+        rx = [0x00, 0x00]
+        for d in data[2:]:
+            if instr & 0x8000:
+                rx.append(self.regs[addr])
+            else:
+                self.regs[addr] = d
+            addr -= 1 # MSB first: address decrements
+        return rx
+
+def test_spi_block_access():
+    spi = FakeSpiDev()
+    dev = AD9548(transport=SPITransport("/dev/spidev0.0", handle=spi))
+    dev.write_block(0x0300, [0x01, 0x02, 0x03, 0x04, 0x05, 0x06])
+    assert list(spi.regs[0x0300:0x0306]) == [0x01, 0x02, 0x03, 0x04, 0x05, 0x06]
+    assert spi.instructions[-1] == (0x03 << 13) | 0x0305 # streaming
+    assert dev.read_block(0x0300, 6) == [0x01, 0x02, 0x03, 0x04, 0x05, 0x06]
+    assert spi.instructions[-1] == 0x8000 | (0x03 << 13) | 0x0305
+    dev.write_data(0x0A01, 0x04)
+    assert spi.instructions[-1] == 0x0A01
+    assert dev.read_block(0x0A00, 2) == [0x00, 0x04]
+    assert spi.instructions[-1] == 0x8000 | (0x01 << 13) | 0x0A01
+
+def test_spi_long_transfers_are_split():
+    spi = FakeSpiDev()
+    dev = AD9548(transport=SPITransport("/dev/spidev0.0", max_block=16, handle=spi))
+    dev.write_block(0x0600, list(range(50)))
+    assert len(spi.instructions) == 4
+    assert dev.read_block(0x0600, 50) == list(range(50))
@@ -0,0 +1,54 @@
+#! /usr/bin/env python3
+# tuning.py: tuning word sampling and stability analysis
+import json
+import pytest
+from ad9548 import AD9548
+from simulator import AD9548Sim, SimTransport
+import tuning
+
+def test_allan():
+    # alternating offsets: avar(tau0) = <(y[i+1]-y[i])^2> / 2 = 2a^2,
+    # averaged out for longer taus
+    y = [1E-9, -1E-9] * 64
+    assert tuning.octaves(len(y)) == [1, 2, 4, 8, 16, 32, 64]
+    for modified in [False, True]:
+        devs = tuning.allan(y, 0.1, tuning.octaves(len(y), modified), modified)
+        assert devs[0] == (0.1, pytest.approx(2**0.5 * 1E-9))
+        assert all(dev == pytest.approx(0.0, abs=1E-20) for (tau, dev) in devs[1:])
+
+def test_ring():
+    ring = tuning.TuningRing(4)
+    for i in range (6):
+        ring.append(float(i), i)
+    (times, words) = ring.samples()
+    assert len(ring) == 4
+    assert list(times) == [2.0, 3.0, 4.0, 5.0]
+    assert list(words) == [2, 3, 4, 5]
+
+def test_sampler(tmp_path, capsys):
+    sim = AD9548Sim()
+    # 1 GHz system clock: 1E6 fs period
+    for (i, b) in enumerate((1000000).to_bytes(3, "little")):
+        sim.poke(0x0103+i, b)
+    word = 0x0123456789AB
+    for (i, b) in enumerate(word.to_bytes(6, "little")):
+        sim.poke(0x0D14+i, b)
+    transport = SimTransport(sim)
+    dev = AD9548(transport=transport)
+    assert tuning.sysclk_freq(dev) == pytest.approx(1E9)
+    transport.reset_stats()
+    ring = tuning.TuningRing(16)
+    tuning.sample(dev, ring, 10)
+    assert transport.calls == [('read', 0x0D14, 6)] * 10 # one burst per word
+    (times, words) = ring.samples()
+    report = tuning.analyze(times, words, 1E9, nominal=word / 2**48 * 1E9 * (1 + 1E-6))
+    assert report['freq'] == pytest.approx(word / 2**48 * 1E9)
+    assert report['offset'] == pytest.approx(-1E-6, rel=1E-3)
+    assert all(item['adev'] < 1E-15 for item in report['adev']) # constant frequency
+    # stored samples are analyzed offline
+    path = str(tmp_path / "tw.bin")
+    tuning.save_samples(path, times, words, 1E9)
+    assert tuning.main(["--load", path]) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report['samples'] == 10
+    assert report['sysclk'] == 1E9
@@ -0,0 +1,231 @@
+#! /usr/bin/env python3
+#################################################################
+# Guillaume W. Bres, 2022          <guillaume.bressaix@gmail.com>
+#################################################################
+# tuning.py: DDS tuning word sampler,
+# frequency offset and Allan deviation analysis
+#################################################################
+import sys
+import json
+import math
+import time
+import array
+import struct
+import argparse
+import itertools
+from ad9548 import *
+from schema import STATUS, field, fetch, decode
+from status import ticks
+
+# 48 bit tuning word, read in a single burst
+TUNING = 0x0D14
+TUNING_SIZE = 6
+# f_dds = word / 2^48 * f_sys
+TUNING_SCALE = float(1 << 48)
+
+SAMPLES_MAGIC = b"AD9548TW"
+# magic, sysclk frequency [Hz], number of samples
+SAMPLES_HEADER = struct.Struct("<8sdQ")
+
+class TuningRing :
+    """ Preallocated ring buffer of (monotonic time, tuning word) samples.
+    numpy arrays when available, array.array otherwise """
+    def __init__ (self, capacity):
+        self.capacity = capacity
+        self.count = 0
+        try:
+            import numpy as np
+            self.t = np.zeros(capacity, dtype=np.float64)
+            self.words = np.zeros(capacity, dtype=np.uint64)
+        except ImportError:
+            self.t = array.array("d", bytes(8 * capacity))
+            self.words = array.array("Q", bytes(8 * capacity))
+
+    def __len__ (self):
+        return min(self.count, self.capacity)
+
+    def append (self, t, word):
+        i = self.count % self.capacity
+        self.t[i] = t
+        self.words[i] = word
+        self.count += 1
+
+    def samples (self):
+        """ Returns (times, words) in chronological order """
+        if self.count <= self.capacity:
+            return (self.t[:self.count], self.words[:self.count])
+        i = self.count % self.capacity
+        try:
+            import numpy as np
+            return (np.concatenate((self.t[i:], self.t[:i])), np.concatenate((self.words[i:], self.words[:i])))
+        except ImportError:
+            return (self.t[i:] + self.t[:i], self.words[i:] + self.words[:i])
+
+def sysclk_freq (dev):
+    """ System clock frequency [Hz], from its period (0x0103-0x0105) """
+    f = field(STATUS['sysclk'], "sysclk.freq")
+    return decode([f], fetch(dev, [f]))['sysclk']['freq']
+
+def sample (dev, ring, count, interval=None):
+    """ Reads `count` tuning words into given ring buffer,
+    one burst read per word (no torn reads across the 6 bytes),
+    as fast as the bus allows or every `interval` seconds """
+    clock = time.monotonic
+    read = dev.read_block
+    schedule = itertools.repeat(None) if interval is None else ticks(interval)
+    for _ in zip(range (count), schedule):
+        t = clock()
+        ring.append(t, int.from_bytes(bytes(read(TUNING, TUNING_SIZE)), "little"))
+
+def offsets (words, reference):
+    """ Fractional frequency offsets y = word / reference - 1.
+    Differences are taken on integers: 48 bit words keep their resolution """
+    try:
+        import numpy as np
+        words = np.asarray(words, dtype=np.uint64)
+        ref = np.uint64(reference)
+        return (words.astype(np.int64) - np.int64(ref)).astype(np.float64) / float(reference)
+    except ImportError:
+        return [(w - reference) / float(reference) for w in words]
+
+def octaves (n, modified=False):
+    """ Averaging factors 1, 2, 4.. usable over n frequency samples """
+    m = 1
+    out = []
+    while (3*m <= n+1) if modified else (2*m <= n):
+        out.append(m)
+        m *= 2
+    return out
+
+def allan (y, tau0, factors, modified=False):
+    """ Overlapping Allan deviation, or modified Allan deviation,
+    of fractional frequency samples `y` taken every `tau0` seconds.
+    Returns [(tau, deviation)] for each averaging factor """
+    out = []
+    try:
+        import numpy as np
+        y = np.asarray(y, dtype=np.float64)
+        # phase (time error) samples
+        x = np.concatenate(([0.0], np.cumsum(y) * tau0))
+        n = len(x)
+        for m in factors:
+            d = x[2*m:] - 2*x[m:n-m] + x[:n-2*m]
+            if modified:
+                s = np.concatenate(([0.0], np.cumsum(d)))
+                d = s[m:] - s[:-m]
+                var = np.dot(d, d) / (2 * m**4 * tau0**2 * len(d))
+            else:
+                var = np.dot(d, d) / (2 * m**2 * tau0**2 * len(d))
+            out.append((m * tau0, math.sqrt(var)))
+        return out
+    except ImportError:
+        pass
+    x = [0.0] + [v * tau0 for v in itertools.accumulate(y)]
+    n = len(x)
+    for m in factors:
+        d = [x[i+2*m] - 2*x[i+m] + x[i] for i in range (n-2*m)]
+        if modified:
+            s = [0.0] + list(itertools.accumulate(d))
+            d = [s[i+m] - s[i] for i in range (len(s)-m)]
+            var = sum(v*v for v in d) / (2 * m**4 * tau0**2 * len(d))
+        else:
+            var = sum(v*v for v in d) / (2 * m**2 * tau0**2 * len(d))
+        out.append((m * tau0, math.sqrt(var)))
+    return out
+
+def analyze (times, words, fsys, nominal=None):
+    """ Frequency and stability report of tuning word samples.
+    Fractional offsets are relative to the `nominal` DDS frequency [Hz],
+    or to the mean tuning word """
+    n = len(words)
+    tau0 = (times[-1] - times[0]) / (n - 1)
+    mean = sum(int(w) for w in words) / n
+    reference = int(round(mean)) if nominal is None else int(round(nominal * TUNING_SCALE / fsys))
+    y = offsets(words, reference)
+    report = {
+        "samples": n,
+        "tau0": tau0,
+        "sysclk": fsys,
+        "freq": mean / TUNING_SCALE * fsys,
+        "offset": (mean - reference) / reference,
+        "adev": [{"tau": tau, "adev": dev} for (tau, dev) in allan(y, tau0, octaves(n))],
+        "mdev": [{"tau": tau, "mdev": dev} for (tau, dev) in allan(y, tau0, octaves(n, True), True)],
+    }
+    if nominal is not None:
+        report["nominal"] = nominal
+    return report
+
+def save_samples (path, times, words, fsys):
+    with open(path, "wb") as fd:
+        fd.write(SAMPLES_HEADER.pack(SAMPLES_MAGIC, fsys, len(words)))
+        fd.write(array.array("d", times).tobytes())
+        fd.write(array.array("Q", [int(w) for w in words]).tobytes())
+
+def load_samples (path):
+    """ Returns (times, words, sysclk frequency) stored with save_samples() """
+    with open(path, "rb") as fd:
+        raw = fd.read()
+    (magic, fsys, n) = SAMPLES_HEADER.unpack_from(raw)
+    if magic != SAMPLES_MAGIC:
+        raise ValueError("{}: not a tuning word samples file".format(path))
+    offset = SAMPLES_HEADER.size
+    try:
+        import numpy as np
+        times = np.frombuffer(raw, dtype="<f8", count=n, offset=offset)
+        words = np.frombuffer(raw, dtype="<u8", count=n, offset=offset + 8*n)
+    except ImportError:
+        times = array.array("d", raw[offset:offset + 8*n])
+        words = array.array("Q", raw[offset + 8*n:offset + 16*n])
+    return (times, words, fsys)
+
+def main (argv):
+    parser = argparse.ArgumentParser(description="AD9548 tuning word sampler and stability analysis")
+    add_device_args(parser)
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=10000,
+        help="Number of tuning words to read",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        help="Sampling interval [s], as fast as the bus allows by default",
+    )
+    parser.add_argument(
+        "--nominal",
+        type=float,
+        help="Nominal DDS frequency [Hz], frequency offsets are relative to the mean by default",
+    )
+    parser.add_argument(
+        "--save",
+        metavar="path",
+        type=str,
+        help="Store the samples into given file, for later analysis",
+    )
+    parser.add_argument(
+        "--load",
+        metavar="path",
+        type=str,
+        help="Analyze samples stored with --save, instead of reading the device",
+    )
+    args = parser.parse_args(argv)
+    if args.load is not None:
+        (times, words, fsys) = load_samples(args.load)
+    else:
+        if args.samples < 2:
+            parser.error("at least 2 samples are required")
+        dev = open_device(args)
+        fsys = sysclk_freq(dev)
+        ring = TuningRing(args.samples)
+        sample(dev, ring, args.samples, args.interval)
+        (times, words) = ring.samples()
+        if args.save is not None:
+            save_samples(args.save, times, words, fsys)
+    if fsys == 0:
+        sys.exit("system clock period is not programmed (0x0103-0x0105)")
+    print(json.dumps(analyze(times, words, fsys, args.nominal), sort_keys=True, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))